@@ -1,7 +1,9 @@
 from django.contrib import admin
 
 # Register your models here.
-from core.models import LocationHistory, AudioFile
+from core.models import LocationHistory, AudioFile, NavigationSession, Trip
 
 admin.site.register(LocationHistory)
 admin.site.register(AudioFile)
+admin.site.register(NavigationSession)
+admin.site.register(Trip)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from core.feedback import session_call_priority, set_user_input
+from core.locations import process_location_fixes, queue_location
+from core.model_calls import ModelCallFailed, model_scheduler
+from core.models import LocationHistory
+from core.serializers import LocationHistorySerializer
+from core.sessions import get_request_session_id, touch_session
+from core.speech import atranslate_speech
+from core.uploads import (
+    acache_transcription, acached_transcription, archive_upload, transcription_file,
+    upload_hash,
+)
+from core.views import LocationHistoryViewSet
+
+# Async versions of AudioViewSet and LocationHistoryViewSet, routed in their
+# place when ASYNC_VIEWS is on. Responses match the DRF viewsets.
+
+location_history_list = LocationHistoryViewSet.as_view({"get": "list"})
+
+
+def invalid_session_response():
+    return JsonResponse({"detail": "Invalid session token."}, status=403)
+
+
+def model_unavailable_response(model):
+    response = JsonResponse(
+        {"detail": "Speech translation is unavailable, please try again shortly."},
+        status=503,
+    )
+    response["Retry-After"] = str(model_scheduler.retry_after(model))
+    return response
+
+
+def method_not_allowed(request):
+    return JsonResponse(
+        {"detail": f'Method "{request.method}" not allowed.'}, status=405
+    )
+
+
+def request_data(request):
+    """
+    Parsed JSON body, or the form data for form and multipart posts.
+    Raises ValueError for malformed JSON.
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    return request.POST
+
+
+def read_upload(request):
+    """
+    The uploaded audio file and its hash, or (None, None). Parsing the
+    multipart body and hashing both read the whole upload, so this is run
+    off the event loop.
+    """
+    uploaded_file = request.FILES.get("file")
+    if uploaded_file is None:
+        return None, None
+    return uploaded_file, upload_hash(uploaded_file)
+
+
+@csrf_exempt
+async def audio(request):
+    if request.method == "GET":
+        return JsonResponse({"audio": "audio list"})
+    if request.method != "POST":
+        return method_not_allowed(request)
+
+    session_id = get_request_session_id(request)
+    if session_id is None:
+        return invalid_session_response()
+    await sync_to_async(touch_session)(session_id)
+
+    uploaded_file, content_hash = await asyncio.to_thread(read_upload, request)
+    if uploaded_file is None:
+        return JsonResponse({"detail": "No audio file uploaded."}, status=400)
+
+    # Retried uploads are answered from the cache without calling Whisper
+    cached = await acached_transcription(content_hash)
+    if cached is not None:
+        text, language = cached
+        await sync_to_async(set_user_input)(session_id, text, language)
+        return JsonResponse({"message": "Audio Received."})
+
+    # VAD trimming is CPU-bound, so it runs off the event loop
+    file = await asyncio.to_thread(transcription_file, uploaded_file)
+    priority, minutes = await sync_to_async(session_call_priority)(session_id)
+    try:
+        response = await atranslate_speech(file, priority, minutes)
+    except ModelCallFailed as e:
+        print(f"Speech translation failed: {e}")
+        return model_unavailable_response("whisper-1")
+
+    print(response.text)
+
+    await sync_to_async(set_user_input)(session_id, response.text, response.language)
+    await acache_transcription(content_hash, response.text, response.language)
+
+    # The archival copy is written in the background
+    archive_upload(uploaded_file, response.text, response.language, content_hash)
+
+    return JsonResponse({"message": "Audio Received."})
+
+
+def list_locations(request):
+    return location_history_list(request).render()
+
+
+@csrf_exempt
+async def location_history(request):
+    if request.method == "GET":
+        # Listing doesn't call OpenAI; the paginated DRF list serves it
+        return await sync_to_async(list_locations)(request)
+    if request.method != "POST":
+        return method_not_allowed(request)
+
+    session_id = get_request_session_id(request)
+    if session_id is None:
+        return invalid_session_response()
+    await sync_to_async(touch_session)(session_id)
+
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return JsonResponse({"detail": f"JSON parse error - {e}"}, status=400)
+
+    serializer = LocationHistorySerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    if settings.LOCATION_WRITE_BEHIND:
+        location = queue_location(session_id, **serializer.validated_data)
+    else:
+        location = await LocationHistory.objects.acreate(
+            session_id=session_id, **serializer.validated_data
+        )
+
+    # Safe off the shared sync thread; see process_location_fixes
+    interval = await sync_to_async(process_location_fixes, thread_sensitive=False)(
+        session_id, [(location.latitude, location.longitude)]
+    )
+    return JsonResponse(
+        {**LocationHistorySerializer(location).data, "next_fix_seconds": interval}, status=201
+    )
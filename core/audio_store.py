@@ -0,0 +1,174 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class _Entry:
+    __slots__ = ("data", "path", "refs", "released_at")
+
+    def __init__(self, data, path):
+        self.data = data
+        self.path = path
+        self.refs = 0
+        self.released_at = None
+
+
+class AudioStore:
+    """
+    Content-addressed store for synthesized audio responses.
+
+    Small clips are kept in memory, larger ones are spooled to disk under
+    their content hash. Producers `put` audio and pass the returned handle
+    to consumers, which `read` it and `release` it once delivered. An
+    entry is dropped once nobody holds it and the linger period is over,
+    so a consumer that receives the handle slightly late can still read it.
+
+    References only count within one process. A consumer in another
+    process (the shared cache, sharded workers) reads a clip the producer
+    has already released, so there the linger alone keeps it: it must be
+    longer than a response can wait to be sent.
+    """
+
+    def __init__(self, max_memory_bytes, spool_dir, linger_seconds, shared_cache=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.spool_dir = spool_dir
+        self.linger_seconds = linger_seconds
+        # Optional cache shared between workers, for in-memory clips
+        self.shared_cache = shared_cache
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, ext="mp3"):
+        """
+        Store audio bytes and return its handle. The caller holds one
+        reference and must `release` it.
+        """
+        handle = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                if len(data) <= self.max_memory_bytes:
+                    entry = _Entry(data, None)
+                    if self.shared_cache is not None:
+                        self.shared_cache.set(
+                            self._shared_key(handle), data,
+                            timeout=max(self.linger_seconds, 1),
+                        )
+                else:
+                    entry = _Entry(None, self._spool(handle, data))
+                self._entries[handle] = entry
+            entry.refs += 1
+            self._evict_expired()
+        return handle
+
+    def retain(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                entry.refs += 1
+
+    def release(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+                if entry.refs == 0:
+                    entry.released_at = time.monotonic()
+            self._evict_expired()
+
+    def read(self, handle):
+        """
+        Return the audio bytes for a handle, or None if it is unknown.
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+        if entry is not None and entry.data is not None:
+            return entry.data
+        if entry is None:
+            data = self._read_shared(handle)
+            if data is not None:
+                return data
+
+        # Spooled entries may have been written by another process
+        try:
+            path = entry.path if entry is not None else self._spool_path(handle)
+            with open(path, "rb") as f:
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def open(self, handle):
+        """
+        Return a binary file object for a handle, or None if it is unknown.
+        Spooled entries are opened from disk, so call this off the event loop.
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+        if entry is not None and entry.data is not None:
+            return io.BytesIO(entry.data)
+        if entry is None:
+            data = self._read_shared(handle)
+            if data is not None:
+                return io.BytesIO(data)
+
+        try:
+            path = entry.path if entry is not None else self._spool_path(handle)
+            return open(path, "rb")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _shared_key(self, handle):
+        return f"audio:{handle}"
+
+    def _read_shared(self, handle):
+        if self.shared_cache is None:
+            return None
+        return self.shared_cache.get(self._shared_key(handle))
+
+    def _spool_path(self, handle):
+        # Handles are hex digests plus an extension; refuse anything else
+        if os.path.basename(handle) != handle:
+            raise ValueError(f"Invalid audio handle: {handle}")
+        return os.path.join(self.spool_dir, handle)
+
+    def _spool(self, handle, data):
+        path = self._spool_path(handle)
+        if not os.path.exists(path):
+            os.makedirs(self.spool_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return path
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [
+            handle
+            for handle, entry in self._entries.items()
+            if entry.refs == 0 and now - entry.released_at >= self.linger_seconds
+        ]
+        for handle in expired:
+            entry = self._entries.pop(handle)
+            if entry.path is not None:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+audio_store = AudioStore(
+    max_memory_bytes=settings.AUDIO_STORE_MAX_MEMORY_BYTES,
+    spool_dir=settings.AUDIO_STORE_SPOOL_DIR,
+    linger_seconds=settings.AUDIO_STORE_LINGER_SECONDS,
+    shared_cache=cache if settings.AUDIO_STORE_SHARED else None,
+)
@@ -1,23 +1,226 @@
+import asyncio
+import collections
+import io
 import json
+import time
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 import os
 
+from django.conf import settings
+
+from core.audio_store import audio_store
+from core.feedback import session_call_priority, set_user_input
+from core.locations import (
+    LOCATION_FRAME, decode_location_frame, process_location_fixes, write_location_fixes
+)
+from core.speech import (
+    AUDIO_FRAME, SpeechStream, encode_opus, parse_audio_frame, translate_speech
+)
+from core.sessions import get_scope_session_id, session_group_name, touch_session
+from core.tts import scope_audio_format, set_session_audio_format
+
+# Event fields describing an audio response, passed on in its audio_start
+AUDIO_INFO_KEYS = ("codec", "response", "part", "parts")
+
+
+def open_audio(item):
+    """
+    Open a queued audio item, either a stored response handle or a file path.
+    """
+    if "audio_handle" in item:
+        return audio_store.open(item["audio_handle"])
+    try:
+        return open(item["file_path"], "rb")
+    except FileNotFoundError:
+        return None
+
+
+def audio_size(audio_file):
+    if isinstance(audio_file, io.BytesIO):
+        return audio_file.getbuffer().nbytes
+    return os.fstat(audio_file.fileno()).st_size
+
+
+async def read_chunk(audio_file, size):
+    # In-memory clips are sliced inline, spooled ones are read off the loop
+    if isinstance(audio_file, io.BytesIO):
+        return audio_file.read(size)
+    return await asyncio.to_thread(audio_file.read, size)
+
+
+def scope_acks_audio(scope):
+    """
+    Whether a WebSocket client acks the audio it receives (`acks=1`).
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("acks", [""])[0] == "1"
+
+
+class SendWindow:
+    """
+    Flow control for audio sent to a client that acks it. The client sends
+    {"type": "audio_ack", "bytes": n} with the total audio bytes it has
+    received on the connection, and at most `size` bytes are ever sent
+    but not yet acked.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.sent = 0
+        self.acked = 0
+        self._acked = asyncio.Event()
+
+    def ack(self, received):
+        if received > self.acked:
+            self.acked = min(received, self.sent)
+            self._acked.set()
+
+    async def wait(self):
+        while self.sent - self.acked >= self.size:
+            self._acked.clear()
+            await self._acked.wait()
+
+
+def _response_key(item):
+    # Items without a response id (the debug clip) are a response each
+    return item.get("response") or id(item)
+
+
+class AudioSendQueue:
+    """
+    Audio items waiting to be sent on one connection, oldest first, bounded
+    by whole responses rather than parts. When `max_responses` are waiting,
+    the stalest response that hasn't started playing is dropped with all
+    its parts, and parts of it that arrive later are dropped too. Parts of
+    the response being sent are never dropped to make room, but any item
+    that has waited more than `max_wait` seconds expires with its response.
+    """
+
+    def __init__(self, max_responses, max_wait=None):
+        self.max_responses = max_responses
+        self.max_wait = max_wait
+        self.current = None  # Response the client is receiving
+        self._items = collections.deque()  # (queued at, item)
+        self._dropped = collections.OrderedDict()  # Recently dropped responses
+        self._ready = asyncio.Event()
+
+    def put(self, item):
+        """
+        Queue an item. Returns the items dropped to make room, which may
+        include this one.
+        """
+        key = _response_key(item)
+        if key in self._dropped:
+            return [item]
+        dropped = []
+        waiting = {_response_key(queued) for _, queued in self._items} - {self.current}
+        if key != self.current and key not in waiting and len(waiting) >= self.max_responses:
+            stalest = next(
+                _response_key(queued) for _, queued in self._items
+                if _response_key(queued) != self.current
+            )
+            dropped = self._drop(stalest)
+        self._items.append((time.monotonic(), item))
+        self._ready.set()
+        return dropped
+
+    def expire(self):
+        """
+        Drop the responses with an item queued more than `max_wait` seconds
+        ago and return their items.
+        """
+        if self.max_wait is None:
+            return []
+        deadline = time.monotonic() - self.max_wait
+        expired = []
+        for key in {_response_key(item) for queued_at, item in self._items if queued_at < deadline}:
+            expired += self._drop(key)
+        return expired
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        _, item = self._items.popleft()
+        self.current = _response_key(item)
+        return item
+
+    def clear(self):
+        items, self._items = [item for _, item in self._items], collections.deque()
+        return items
+
+    def _drop(self, key):
+        dropped = [item for _, item in self._items if _response_key(item) == key]
+        self._items = collections.deque(
+            (queued_at, item) for queued_at, item in self._items if _response_key(item) != key
+        )
+        self._dropped[key] = True
+        if len(self._dropped) > self.max_responses * 4:
+            self._dropped.popitem(last=False)
+        return dropped
+
 
 class VoiceAssistantWebsocketConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # Accept the WebSocket connection
-        await self.accept()
-        # self.room_name = 'self.scope["url_route"]["kwargs"]["room_name"]'
-        self.room_name = "room1"
-        self.room_group_name = f"file_transfer_{self.room_name}"
+        # Each connection only joins its own session's group
+        self.session_id = get_scope_session_id(self.scope)
+        if self.session_id is None:
+            await self.close()
+            return
+
+        self.room_group_name = session_group_name(self.session_id)
+        await asyncio.to_thread(touch_session, self.session_id)
+
+        # Responses are synthesized in the smallest format the client can play
+        audio_format = scope_audio_format(self.scope)
+        if audio_format is not None:
+            await asyncio.to_thread(set_session_audio_format, self.session_id, audio_format)
+
+        # Audio is streamed by a single sender task per connection. The queue
+        # is bounded so a slow client holds at most a few pending responses.
+        self.audio_queue = AudioSendQueue(
+            settings.AUDIO_SEND_QUEUE_SIZE, settings.AUDIO_SEND_MAX_WAIT_SECONDS
+        )
+        self.audio_sender = asyncio.create_task(self.send_audio_loop())
 
-        # Join the group
+        # Clients that ack audio are sent within a window; others as fast
+        # as the server takes it
+        self.send_window = (
+            SendWindow(settings.AUDIO_SEND_WINDOW_BYTES) if scope_acks_audio(self.scope) else None
+        )
+
+        # Live microphone audio, endpointed server-side
+        self.speech_stream = SpeechStream()
+        self.transcriptions = set()
+        # Last next-fix interval sent to the client
+        self.fix_interval = None
+
+        # Join the group before accepting so nothing sent after the
+        # handshake is missed
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
+        # Accept the WebSocket connection
+        await self.accept()
+        if audio_format is not None:
+            await self.send(text_data=json.dumps({
+                "type": "audio_format", "codec": audio_format.codec, "kbps": audio_format.kbps,
+            }))
+
     async def disconnect(self, close_code):
+        if self.session_id is None:
+            return
+
         # Handle disconnection
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
+        self.audio_sender.cancel()
+        for task in self.transcriptions:
+            task.cancel()
+        for item in self.audio_queue.clear():
+            self.release_audio(item)
+
     # async def receive(self, text_data):
     #     # Handle data received from WebSocket
     #     text_data_json = json.loads(text_data)
@@ -31,24 +234,163 @@ class VoiceAssistantWebsocketConsumer(AsyncWebsocketConsumer):
 
         # Example: Send an audio file when a specific message is received
         if text_data == "send_audio_file":
-            audio_file_path = (
-                "/Users/anepal/workspace/navpal-backend/audio_recording.m4a"
-            )
+            audio_file_path = settings.BASE_DIR / "audio_recording.m4a"
+            self.queue_audio({"file_path": audio_file_path})
+        elif text_data:
+            self.receive_message(text_data)
+
+        # Binary uplink frames are tagged by their first byte
+        elif bytes_data and bytes_data[0] == LOCATION_FRAME:
+            await self.receive_location_frame(bytes_data)
+        elif bytes_data and bytes_data[0] == AUDIO_FRAME:
+            await self.receive_audio_frame(bytes_data)
+
+    def receive_message(self, text_data):
+        try:
+            message = json.loads(text_data)
+            if message["type"] == "audio_ack" and self.send_window is not None:
+                self.send_window.ack(int(message["bytes"]))
+        except (ValueError, TypeError, KeyError):
+            pass
 
-            # Ensure the file exists
-            if os.path.exists(audio_file_path):
-                with open(audio_file_path, "rb") as audio_file:
-                    audio_data = audio_file.read()
-                    await self.send(bytes_data=audio_data)
+    async def receive_location_frame(self, bytes_data):
+        try:
+            fixes = decode_location_frame(bytes_data)
+        except ValueError as e:
+            await self.send(text_data=f"Error: {e}")
+            return
+
+        write_location_fixes(self.session_id, fixes)
+        # Safe off the shared sync thread; see process_location_fixes
+        interval = await sync_to_async(process_location_fixes, thread_sensitive=False)(
+            self.session_id,
+            [(fix.lat, fix.lng) for fix in fixes],
+            [fix.timestamp for fix in fixes],
+        )
+        # The client keeps sampling at the last interval it was sent
+        if interval != self.fix_interval:
+            self.fix_interval = interval
+            await self.send(text_data=json.dumps({"type": "fix_interval", "seconds": interval}))
+
+    async def receive_audio_frame(self, bytes_data):
+        # Opus decoding and the VAD run off the event loop. Frames are
+        # handled one at a time, so they still reach the stream in order.
+        try:
+            codec, payload = parse_audio_frame(bytes_data)
+            if payload:
+                utterances = await asyncio.to_thread(self.speech_stream.feed, codec, payload)
             else:
-                await self.send(text_data="Error: File not found")
+                utterances = [await asyncio.to_thread(self.speech_stream.flush)]
+        except ValueError as e:
+            await self.send(text_data=f"Error: {e}")
+            return
+
+        for utterance in utterances:
+            if utterance is None:
+                continue
+            # Start transcribing as soon as the endpoint is detected, while
+            # the client keeps streaming
+            await self.send(text_data=json.dumps({"type": "speech_end"}))
+            task = asyncio.create_task(self.transcribe_utterance(utterance))
+            self.transcriptions.add(task)
+            task.add_done_callback(self.transcriptions.discard)
+
+    async def transcribe_utterance(self, pcm):
+        try:
+            clip = await asyncio.to_thread(encode_opus, pcm)
+            priority, minutes = await asyncio.to_thread(
+                session_call_priority, self.session_id
+            )
+            response = await asyncio.to_thread(
+                translate_speech, ("utterance.ogg", clip, "audio/ogg"), priority, minutes
+            )
+            await asyncio.to_thread(
+                set_user_input, self.session_id, response.text, response.language
+            )
+        except Exception as e:
+            print(f"Transcription failed: {e}")
+            await self.send(text_data="Error: Transcription failed")
+            return
+
+        await self.send(text_data=json.dumps({"type": "transcript", "text": response.text}))
 
     async def send_audio_file(self, event):
-        # Send the file to the WebSocket
-        audio_file_path = event["file_path"]
-        if os.path.exists(audio_file_path):
-            with open(audio_file_path, "rb") as audio_file:
-                audio_data = audio_file.read()
-                await self.send(bytes_data=audio_data)
-        else:
+        # Queue the stored audio response for the WebSocket. Long responses
+        # arrive as several parts, in order.
+        item = {"audio_handle": event["audio_handle"]}
+        for key in AUDIO_INFO_KEYS:
+            if key in event:
+                item[key] = event[key]
+        self.queue_audio(item)
+
+    def queue_audio(self, item):
+        if "audio_handle" in item:
+            audio_store.retain(item["audio_handle"])
+        # Slow client: the stalest pending response is dropped instead of
+        # buffering without bound
+        dropped = self.audio_queue.put(item)
+        if dropped:
+            print(f"Client is behind, dropped {len(dropped)} audio items")
+        for dropped_item in dropped:
+            self.release_audio(dropped_item)
+
+    def release_audio(self, item):
+        if "audio_handle" in item:
+            audio_store.release(item["audio_handle"])
+
+    async def send_audio_loop(self):
+        while True:
+            # Responses from another worker are only kept for
+            # AUDIO_STORE_LINGER_SECONDS, so none may wait longer than that
+            for expired in self.audio_queue.expire():
+                self.release_audio(expired)
+            item = await self.audio_queue.get()
+            try:
+                await self.stream_audio(item)
+            except asyncio.TimeoutError:
+                # The client stopped acking; its queue is released on disconnect
+                print("Client stopped acking audio, closing")
+                await self.close()
+                return
+            finally:
+                self.release_audio(item)
+
+    async def stream_audio(self, item):
+        """
+        Send one audio response, or one part of it, as an audio_start frame,
+        fixed-size binary chunks and an audio_end frame.
+        """
+        audio_file = await asyncio.to_thread(open_audio, item)
+        if audio_file is None:
             await self.send(text_data="Error: File not found")
+            return
+
+        audio_id = os.path.basename(str(item.get("audio_handle") or item["file_path"]))
+        chunk_size = settings.AUDIO_CHUNK_SIZE
+        start = {
+            "type": "audio_start",
+            "id": audio_id,
+            "size": audio_size(audio_file),
+            "chunk_size": chunk_size,
+        }
+        for key in AUDIO_INFO_KEYS:
+            if key in item:
+                start[key] = item[key]
+        try:
+            await self.send(text_data=json.dumps(start))
+            while True:
+                chunk = await read_chunk(audio_file, chunk_size)
+                if not chunk:
+                    break
+                await self.send(bytes_data=chunk)
+                # Let other connections run between chunks, and wait while
+                # the client is behind so pending responses queue up here
+                await asyncio.sleep(0)
+                if self.send_window is not None:
+                    self.send_window.sent += len(chunk)
+                    await asyncio.wait_for(
+                        self.send_window.wait(), settings.AUDIO_SEND_ACK_TIMEOUT_SECONDS
+                    )
+            await self.send(text_data=json.dumps({"type": "audio_end", "id": audio_id}))
+        finally:
+            audio_file.close()
@@ -1,5 +1,8 @@
 import os
+import threading
 import time
+import uuid
+from collections import OrderedDict
 
 from datetime import datetime, timezone
 
@@ -19,6 +22,14 @@ from django.core.cache import cache
 from core.models import AudioFile
 
 from core import navigation
+from core.audio_store import audio_store
+from core.model_calls import ModelCallFailed, call_priority, departure_minutes
+from core.sessions import (
+    ACTIVE_SESSION_TIMEOUT, DEFAULT_SESSION_ID, active_sessions, session_group_name, session_key
+)
+from core.tts import (
+    audio_extension, session_audio_format, speech_parts, synthesize_in_order
+)
 
 from django.conf import settings
 
@@ -28,9 +39,6 @@ from asgiref.sync import async_to_sync
 import requests
 import googlemaps
 
-from openai import OpenAI
-
-
 GMAPS_API_KEY = os.getenv("GMAPS_API_KEY")
 
 gmaps = googlemaps.Client(key=GMAPS_API_KEY)
@@ -41,8 +49,6 @@ AS_KEY = os.getenv("AVIATIONSTACK_API_KEY")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI()
-
 
 
 # Simple transcription class
@@ -110,13 +116,79 @@ def flight_data_to_dict(response):
     return flight_data
 
 
-def feedback_beat():
-    with open("test.txt", "a") as f:
-        f.write("asfasf\n")
+def set_user_input(session_id, text, language):
+    """
+    Store a transcribed question and start a feedback beat to answer it.
+    """
+    cache.set(session_key(session_id, "user_input_text"), text, timeout=30)
+    cache.set(session_key(session_id, "user_input_lang"), language, timeout=30)
+    feedback_triggers.fire(session_id, QUESTION)
+
+
+# Navigators are rebuilt from the session's cached directions, so any worker
+# can serve any session. The KDTree is memoised per process; the only mutable
+# state, the recent location history, lives in the shared cache.
+NAVIGATOR_CACHE_SIZE = 256
+
+_navigators = OrderedDict()
+_navigators_lock = threading.Lock()
+
+
+def load_navigator(session_id, directions):
+    with _navigators_lock:
+        navigator = _navigators.get(session_id)
+        if navigator is None or navigator.directions != directions:
+            navigator = navigation.Navigator(directions)
+            _navigators[session_id] = navigator
+            if len(_navigators) > NAVIGATOR_CACHE_SIZE:
+                _navigators.popitem(last=False)
+        _navigators.move_to_end(session_id)
+
+    navigator.location_history = cache.get(
+        session_key(session_id, "location_history"), default=[])
+    return navigator
+
+
+def session_navigator(session_id):
+    """
+    The session's Navigator, or None before it has a route. Its location
+    history is not loaded.
+    """
+    with _navigators_lock:
+        navigator = _navigators.get(session_id)
+    if navigator is not None:
+        return navigator
+    directions = cache.get(session_key(session_id, "directions"))
+    return None if directions is None else load_navigator(session_id, directions)
+
+
+def save_navigator(session_id, navigator):
+    cache.set(session_key(session_id, "location_history"), navigator.location_history)
+    cache.set(session_key(session_id, "off_path"), navigator.status == "OFF the path")
+
+
+def session_call_priority(session_id):
+    """
+    (priority, minutes until departure) for the session's model calls.
+    """
+    found = cache.get_many([
+        session_key(session_id, "flight_data"), session_key(session_id, "off_path")
+    ])
+    flight_data = found.get(session_key(session_id, "flight_data")) or {}
+    minutes = departure_minutes(flight_data.get("time_until_flight"))
+    off_path = found.get(session_key(session_id, "off_path"), False)
+    return call_priority(off_path=off_path, minutes=minutes), minutes
+
+
+def feedback_beat(session_id=DEFAULT_SESSION_ID, recent_coords=None, reasons=()):
+    cache.set(session_key(session_id, "last_beat"), time.time(), timeout=ACTIVE_SESSION_TIMEOUT)
 
-    recent_coords = cache.get("recent_coords", default=[(47.4463438,-122.3042077)])
+    # Callers that just received fixes pass them in
+    if recent_coords is None:
+        recent_coords = cache.get(
+            session_key(session_id, "recent_coords"), default=[(47.4463438,-122.3042077)])
 
-    user_input_text = cache.get("user_input_text", default=None)
+    user_input_text = cache.get(session_key(session_id, "user_input_text"), default=None)
 
     origin = ",".join([str(coord) for coord in recent_coords[0]])
 
@@ -125,11 +197,11 @@ def feedback_beat():
         "lng": recent_coords[0][1],
     }
 
-    if cache.get("flight_num", default=None) is None:
+    if cache.get(session_key(session_id, "flight_num"), default=None) is None:
         # If starting navigation
         flight_no = "AS133"
 
-        cache.set("flight_num", flight_no)
+        cache.set(session_key(session_id, "flight_num"), flight_no)
 
         response = pull_flight_info(flight_no)
         flight_data = flight_data_to_dict(response)
@@ -140,35 +212,43 @@ def feedback_beat():
         directions = gmaps.directions(
             origin, dest_str, mode="walking", departure_time=datetime.now())
 
-        # Initialize Navigator with the provided directions
-        navigator = navigation.Navigator(directions)
-
-        cache.set("destination", destination)
-        cache.set("directions", directions)
-        cache.set("flight_data", flight_data)
-
-        transcription_obj = Transcription("")
-        result = navigation.process_location_update(
-            navigator, 
-            loc1, 
-            flight_data["flight_status"], 
-            flight_data["time_until_flight"], 
-            transcription_obj
-        )
-
-    elif user_input_text is not None:
+        cache.set(session_key(session_id, "destination"), destination)
+        cache.set(session_key(session_id, "directions"), directions)
+        cache.set(session_key(session_id, "flight_data"), flight_data)
+
+        if user_input_text is None:
+            # Initialize Navigator with the provided directions
+            navigator = load_navigator(session_id, directions)
+
+            # Nothing is spoken on the first beat, so its LLM call is background work
+            transcription_obj = Transcription("")
+            result = navigation.process_location_update(
+                navigator,
+                loc1,
+                flight_data["flight_status"],
+                flight_data["time_until_flight"],
+                transcription_obj,
+                background=True,
+            )
+            save_navigator(session_id, navigator)
+            return
+        # The session began with a question. Nothing fires again before it
+        # expires, so it is answered now that there is a route.
+
+    if user_input_text is not None:
         # If user input...
-        user_input_lang = cache.get("user_input_lang", default=None)
+        user_input_lang = cache.get(session_key(session_id, "user_input_lang"), default=None)
 
         # Delete input from cache
 
-        cache.delete("user_input_text")
-        cache.delete("user_input_lang")
+        cache.delete(session_key(session_id, "user_input_text"))
+        cache.delete(session_key(session_id, "user_input_lang"))
         
-        directions = cache.get("directions")
+        directions = cache.get(session_key(session_id, "directions"))
+        flight_data = cache.get(session_key(session_id, "flight_data"))
 
         # Initialize Navigator with the provided directions
-        navigator = navigation.Navigator(directions)
+        navigator = load_navigator(session_id, directions)
 
         # Do response to input
         transcription_obj = Transcription(user_input_text)
@@ -179,26 +259,239 @@ def feedback_beat():
             flight_data["time_until_flight"], 
             transcription_obj
         )
-        
+        save_navigator(session_id, navigator)
 
-        # base_path=settings.BASE_DIR
-        print(result)
+        speak(session_id, result)
 
-        speech_file_path = settings.BASE_DIR / "nova.mp3"
-        print(speech_file_path)
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice="nova",
-            input=result,
+    elif OFF_PATH in reasons:
+        # Just left the path: say how to get back on it
+        directions = cache.get(session_key(session_id, "directions"))
+        flight_data = cache.get(session_key(session_id, "flight_data"))
+        navigator = load_navigator(session_id, directions)
+        result = navigation.process_location_update(
+            navigator,
+            loc1,
+            flight_data["flight_status"],
+            flight_data["time_until_flight"],
+            Transcription(""),
         )
-        response.stream_to_file(speech_file_path)
-        
-        room_name = "room1"
-        channel_layer = get_channel_layer()
+        save_navigator(session_id, navigator)
+        speak(session_id, result)
+
+    elif MANEUVER in reasons:
+        # Coming up to a turn: read out the directions for it
+        directions = cache.get(session_key(session_id, "directions"))
+        instruction = load_navigator(session_id, directions).maneuver_instruction(
+            loc1["lat"], loc1["lng"]
+        )
+        if instruction:
+            speak(session_id, instruction)
+
+
+def speak(session_id, text):
+    """
+    Synthesize text and send it to the session's clients.
+    """
+    # Each part is sent as soon as it and the parts before it are
+    # synthesized; the client plays them back to back
+    priority, minutes = session_call_priority(session_id)
+    audio_format = session_audio_format(session_id)
+    texts = speech_parts(text)
+    response_id = uuid.uuid4().hex
+    try:
+        for part, audio in enumerate(
+            synthesize_in_order(texts, priority, minutes, audio_format)
+        ):
+            send_audio(session_id, audio, audio_format, response_id, part, len(texts))
+    except ModelCallFailed as e:
+        print(f"Speech synthesis failed: {e}")
+
+
+def send_audio(session_id, audio, audio_format, response_id, part=0, parts=1):
+    audio_handle = audio_store.put(audio, audio_extension(audio_format))
+
+    channel_layer = get_channel_layer()
+    try:
         async_to_sync(channel_layer.group_send)(
-            f"file_transfer_{room_name}",
-            {"type": "send_audio_file", "file_path": speech_file_path},
+            session_group_name(session_id),
+            {
+                "type": "send_audio_file",
+                "audio_handle": audio_handle,
+                "codec": audio_format.codec,
+                "response": response_id,
+                "part": part,
+                "parts": parts,
+            },
         )
+    finally:
+        audio_store.release(audio_handle)
+
+
+# ----------------------------------------------------------
+# TRIGGERS
+# ----------------------------------------------------------
+# Beats run when something happens in a session rather than on a clock:
+# a question, leaving the path, nearing a turn, or a fix before there is
+# a route. Each is a reason passed to feedback_beat. A heartbeat covers
+# sessions nothing has happened in for FEEDBACK_HEARTBEAT_SECONDS.
+
+QUESTION = "question"
+OFF_PATH = "off_path"
+MANEUVER = "maneuver"
+START = "start"
+HEARTBEAT = "heartbeat"
+
+
+class FeedbackTriggers:
+    """
+    Runs feedback beats on up to `workers` threads, one beat at a time per
+    session. Triggers for a session already waiting are merged into one
+    beat with all their reasons; one that fires mid-beat gets a beat after.
+    With `leases` (core.feedback_workers.BeatLeases) a beat also takes the
+    session's lease; while another process holds it the beat is retried
+    later instead of holding a thread.
+    """
+
+    def __init__(self, beat, workers, leases=None):
+        self.beat = beat
+        self.workers = workers
+        self.leases = leases
+        self.fired = 0
+        self.beats = 0
+        self.failures = 0
+        self.beat_seconds = 0.0
+        self._pending = OrderedDict()
+        # When each waiting session's first trigger fired
+        self._since = {}
+        # time.monotonic() before which a session waiting on its lease is
+        # not retried
+        self._not_before = {}
+        self._running = set()
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def fire(self, session_id, reason):
+        with self._condition:
+            self.fired += 1
+            self._pending.setdefault(session_id, set()).add(reason)
+            self._since.setdefault(session_id, time.monotonic())
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="feedback-triggers", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending) + len(self._running)
+
+    def stats(self):
+        """
+        Counters and queue depth, for metrics.
+        """
+        with self._condition:
+            now = time.monotonic()
+            return {
+                "fired": self.fired,
+                "beats": self.beats,
+                "failures": self.failures,
+                "queued": len(self._pending),
+                "running": len(self._running),
+                "oldest_wait_seconds": round(now - min(self._since.values(), default=now), 3),
+                "mean_beat_seconds": round(self.beat_seconds / self.beats, 3) if self.beats else 0,
+            }
+
+    def wait(self, timeout=None):
+        """
+        Wait until no beats are waiting or running. Returns False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._running, timeout
+            )
+
+    def _next(self, now):
+        for session_id in self._pending:
+            if session_id not in self._running and self._not_before.get(session_id, 0) <= now:
+                return session_id
+        return None
+
+    def _retry_in(self, now):
+        retries = [self._not_before[session_id] for session_id in self._pending
+                   if session_id in self._not_before]
+        return max(min(retries) - now, 0) if retries else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    session_id = self._next(now)
+                    if session_id is not None:
+                        break
+                    self._condition.wait(self._retry_in(now))
+                reasons = self._pending.pop(session_id)
+                since = self._since.pop(session_id)
+                self._not_before.pop(session_id, None)
+                self._running.add(session_id)
+            if self.leases is not None and not self.leases.acquire(session_id):
+                with self._condition:
+                    self._running.discard(session_id)
+                    self._pending.setdefault(session_id, set()).update(reasons)
+                    self._since[session_id] = min(self._since.get(session_id, since), since)
+                    self._not_before[session_id] = time.monotonic() + self.leases.retry_seconds
+                    self._condition.notify_all()
+                continue
+            start = time.monotonic()
+            failed = False
+            try:
+                self.beat(session_id, reasons=reasons)
+            except Exception as e:
+                failed = True
+                print(f"Feedback beat for session {session_id} failed: {e}")
+            finally:
+                if self.leases is not None:
+                    self.leases.release(session_id)
+                with self._condition:
+                    self.beats += 1
+                    self.failures += failed
+                    self.beat_seconds += time.monotonic() - start
+                    self._running.discard(session_id)
+                    self._condition.notify_all()
+
+
+feedback_triggers = FeedbackTriggers(
+    lambda session_id, reasons: feedback_beat(session_id, reasons=reasons),
+    settings.FEEDBACK_WORKERS,
+)
+
+if settings.FEEDBACK_SHARDED:
+    # Beats run in run_scheduler's worker processes. Ones that fall back to
+    # this process take the session's lease, as the workers' beats do.
+    from core.feedback_workers import BeatLeases, ShardedTriggers
+
+    feedback_triggers.leases = BeatLeases()
+    feedback_triggers = ShardedTriggers(feedback_triggers)
+
+
+def feedback_beat_all():
+    """
+    Heartbeat: start a feedback beat for every recently active session that
+    hasn't had one in FEEDBACK_HEARTBEAT_SECONDS. Returns how many started.
+    """
+    session_ids = active_sessions()
+    last_beats = cache.get_many(
+        [session_key(session_id, "last_beat") for session_id in session_ids]
+    )
+    cutoff = time.time() - settings.FEEDBACK_HEARTBEAT_SECONDS
+    beats = 0
+    for session_id in session_ids:
+        if last_beats.get(session_key(session_id, "last_beat"), 0) > cutoff:
+            continue
+        feedback_triggers.fire(session_id, HEARTBEAT)
+        beats += 1
+    print(f"Heartbeat: {beats} of {len(session_ids)} active sessions were due a beat")
+    return beats
 
 
 class Command(BaseCommand):
@@ -207,7 +500,9 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         scheduler = BackgroundScheduler()
 
-        scheduler.add_job(feedback_beat, 'interval', seconds=30)
+        scheduler.add_job(
+            feedback_beat_all, 'interval', seconds=settings.FEEDBACK_HEARTBEAT_SECONDS
+        )
         scheduler.start()
 
         self.stdout.write("Scheduler started. Press Ctrl+C to exit.")
@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from core.sessions import session_key
+
+# Feedback beats can run in a pool of worker processes (run_scheduler
+# --workers N) instead of the web workers. Each session belongs to one
+# worker, picked by consistent hashing of its id over the live workers, so
+# its beats stay serialized while different sessions' beats run in
+# parallel across processes. Triggers reach a worker through its own
+# channel on the channel layer, so this needs REDIS_URL.
+
+# ----------------------------------------------------------
+# 1. CONSISTENT HASHING
+# ----------------------------------------------------------
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Maps keys to nodes. Each node owns `replicas` points on a ring of
+    64-bit hashes and a key goes to the next point after its own hash, so
+    adding or removing a node only moves the keys on that node's arcs.
+    """
+
+    def __init__(self, nodes, replicas):
+        self.nodes = sorted(nodes)
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        """
+        The node owning a key, or None if there are no nodes.
+        """
+        if not self._hashes:
+            return None
+        return self._nodes[bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+# ----------------------------------------------------------
+# 2. MEMBERSHIP
+# ----------------------------------------------------------
+# A worker holds one of FEEDBACK_MAX_WORKERS slots: a cache key it claims
+# with an atomic add and refreshes with its metrics while it is up. A
+# worker that dies drops out when the key expires.
+
+def worker_key(slot):
+    return f"feedback_workers:{slot}"
+
+
+def worker_channel(slot):
+    return f"feedback-worker-{slot}"
+
+
+def live_workers():
+    """
+    {slot: latest metrics} for every worker that is up.
+    """
+    keys = {worker_key(slot): slot for slot in range(settings.FEEDBACK_MAX_WORKERS)}
+    return {keys[key]: metrics for key, metrics in cache.get_many(list(keys)).items()}
+
+
+# ----------------------------------------------------------
+# 3. ROUTING
+# ----------------------------------------------------------
+
+class ShardedTriggers:
+    """
+    Stands in for FeedbackTriggers in processes that don't run beats: each
+    trigger is sent to the worker that owns the session. With no worker up,
+    or its channel full, the beat runs here on `local` instead.
+    """
+
+    def __init__(self, local):
+        self.local = local
+        self._ring = HashRing([], 0)
+        self._updated = None
+        self._lock = threading.Lock()
+
+    def ring(self):
+        # Membership is re-read at most every FEEDBACK_MEMBERSHIP_SECONDS
+        with self._lock:
+            now = time.monotonic()
+            if (self._updated is None
+                    or now - self._updated >= settings.FEEDBACK_MEMBERSHIP_SECONDS):
+                self._ring = HashRing(live_workers(), settings.FEEDBACK_RING_REPLICAS)
+                self._updated = now
+            return self._ring
+
+    def fire(self, session_id, reason):
+        slot = self.ring().node(session_id)
+        if slot is None:
+            self.local.fire(session_id, reason)
+            return
+        try:
+            async_to_sync(get_channel_layer().send)(worker_channel(slot), {
+                "type": "feedback.trigger", "session": session_id, "reason": reason,
+            })
+        except ChannelFull:
+            print(f"Feedback worker {slot} is full, running the beat here")
+            self.local.fire(session_id, reason)
+
+    def stats(self):
+        return self.local.stats()
+
+    def wait(self, timeout=None):
+        return self.local.wait(timeout)
+
+
+# ----------------------------------------------------------
+# 4. LEASES
+# ----------------------------------------------------------
+
+class BeatLeases:
+    """
+    The per-session beat leases one process holds: cache keys holding its
+    token, so a session never has two beats at once, even while it moves
+    between workers or falls back to a web worker. Held leases are renewed
+    every third of FEEDBACK_LEASE_SECONDS, so a long beat keeps its lease,
+    and a lease is only released while it is still ours.
+    """
+
+    # How soon FeedbackTriggers retries a session whose lease is taken
+    retry_seconds = 0.1
+
+    def __init__(self, token=None):
+        self.token = token or uuid.uuid4().hex
+        self.waits = 0
+        self._held = set()
+        self._lock = threading.Lock()
+        self._renewer = None
+
+    def acquire(self, session_id):
+        key = session_key(session_id, "beat_lease")
+        if not cache.add(key, self.token, settings.FEEDBACK_LEASE_SECONDS):
+            with self._lock:
+                self.waits += 1
+            return False
+        with self._lock:
+            self._held.add(key)
+            if self._renewer is None:
+                self._renewer = threading.Thread(
+                    target=self._renew, name="beat-leases", daemon=True
+                )
+                self._renewer.start()
+        return True
+
+    def release(self, session_id):
+        key = session_key(session_id, "beat_lease")
+        with self._lock:
+            self._held.discard(key)
+        # The cache has no compare-and-delete. Renewal keeps our lease from
+        # lapsing mid-beat, so another owner can only appear in between if
+        # this process stalled for most of FEEDBACK_LEASE_SECONDS.
+        if cache.get(key) == self.token:
+            cache.delete(key)
+
+    def _renew(self):
+        while True:
+            time.sleep(settings.FEEDBACK_LEASE_SECONDS / 3)
+            with self._lock:
+                held = list(self._held)
+            for key in held:
+                if cache.get(key) == self.token:
+                    cache.touch(key, settings.FEEDBACK_LEASE_SECONDS)
+                else:
+                    print(f"Beat lease {key} expired while held")
+
+
+# ----------------------------------------------------------
+# 5. WORKERS
+# ----------------------------------------------------------
+
+class FeedbackWorker:
+    """
+    One worker process: claims a slot, takes triggers off its channel and
+    runs them on a FeedbackTriggers pool, publishing its metrics in the
+    slot key. stop() leaves gracefully: the slot is released first, and
+    triggers already routed here are run before it exits.
+    """
+
+    def __init__(self, slot=0):
+        # core.feedback imports this module when FEEDBACK_SHARDED is set
+        from core import feedback
+
+        self.feedback = feedback
+        self.preferred_slot = slot
+        self.slot = None
+        self.token = uuid.uuid4().hex
+        self.received = 0
+        self.started = time.time()
+        # A session that just moved here after a rebalance may still be
+        # finishing a beat on its old worker
+        self.leases = BeatLeases(self.token)
+        self.triggers = feedback.FeedbackTriggers(
+            self.beat, settings.FEEDBACK_WORKERS, self.leases
+        )
+        self._stopping = threading.Event()
+
+    def claim(self):
+        """
+        Take the preferred slot if free, else the first free one.
+        """
+        slots = range(settings.FEEDBACK_MAX_WORKERS)
+        for slot in sorted(slots, key=lambda slot: slot != self.preferred_slot):
+            metrics = self.metrics(slot)
+            if cache.add(worker_key(slot), metrics, settings.FEEDBACK_WORKER_TTL_SECONDS):
+                self.slot = slot
+                return slot
+        raise RuntimeError(f"All {settings.FEEDBACK_MAX_WORKERS} feedback worker slots are taken")
+
+    def publish(self):
+        """
+        Refresh the slot key with current metrics, moving to another slot if
+        ours expired and was taken.
+        """
+        current = cache.get(worker_key(self.slot))
+        if current is not None and current["token"] != self.token:
+            print(f"Feedback worker slot {self.slot} was taken over, claiming another")
+            self.claim()
+            return
+        cache.set(
+            worker_key(self.slot), self.metrics(self.slot), settings.FEEDBACK_WORKER_TTL_SECONDS
+        )
+
+    def metrics(self, slot):
+        return {
+            "slot": slot,
+            "token": self.token,
+            "pid": os.getpid(),
+            "received": self.received,
+            "lease_waits": self.leases.waits,
+            "uptime_seconds": round(time.time() - self.started),
+            **self.triggers.stats(),
+        }
+
+    def beat(self, session_id, reasons):
+        self.feedback.feedback_beat(session_id, reasons=reasons)
+
+    def stop(self, *args):
+        self._stopping.set()
+
+    async def serve(self):
+        layer = get_channel_layer()
+        if self.slot is None:
+            self.claim()
+        channel = worker_channel(self.slot)
+        print(f"Feedback worker {self.slot} (pid {os.getpid()}) listening on {channel}")
+        published = time.monotonic()
+        leaving = None
+        # Cancelling a receive can drop a message it already popped, so one
+        # stays pending across the timeouts
+        receiving = None
+        while True:
+            now = time.monotonic()
+            if leaving is None and self._stopping.is_set():
+                # Routers stop sending here within FEEDBACK_MEMBERSHIP_SECONDS
+                cache.delete(worker_key(self.slot))
+                leaving = now + settings.FEEDBACK_MEMBERSHIP_SECONDS
+            elif leaving is None and now - published >= settings.FEEDBACK_WORKER_TTL_SECONDS / 5:
+                self.publish()
+                published = now
+                if worker_channel(self.slot) != channel:
+                    channel = worker_channel(self.slot)
+                    if receiving is not None:
+                        receiving.cancel()
+                        receiving = None
+            if receiving is None:
+                receiving = asyncio.ensure_future(layer.receive(channel))
+            done, _ = await asyncio.wait({receiving}, timeout=0.5)
+            if not done:
+                if leaving is not None and now >= leaving:
+                    receiving.cancel()
+                    break
+                continue
+            message = receiving.result()
+            receiving = None
+            self.received += 1
+            self.triggers.fire(message["session"], message["reason"])
+
+        await asyncio.to_thread(self.triggers.wait, settings.FEEDBACK_DRAIN_SECONDS)
+        print(f"Feedback worker {self.slot} stopped after {self.triggers.beats} beats")
+
+
+# ----------------------------------------------------------
+# 6. SUPERVISION
+# ----------------------------------------------------------
+
+def worker_command(slot):
+    return [sys.executable, str(settings.BASE_DIR / "manage.py"), "run_feedback_worker",
+            "--slot", str(slot)]
+
+
+class Supervisor:
+    """
+    Keeps a worker process running per slot, restarting any that exit.
+    Restarts back off from 1 s, doubling up to FEEDBACK_RESTART_MAX_SECONDS,
+    and reset once a worker has stayed up for a minute.
+    """
+
+    def __init__(self, count, command=worker_command):
+        self.command = command
+        self.processes = {}
+        self.restarts = 0
+        self._backoff = {}
+        self._restart_at = {}
+        self._started = {}
+        self.resize(count)
+
+    def spawn(self, slot):
+        self.processes[slot] = subprocess.Popen(self.command(slot))
+        self._started[slot] = time.monotonic()
+        self._restart_at.pop(slot, None)
+
+    def resize(self, count):
+        """
+        Start or gracefully stop workers so `count` are running. Sessions
+        are rebalanced as the workers join or leave the ring.
+        """
+        for slot in range(count):
+            if slot not in self.processes:
+                self.spawn(slot)
+        for slot in [slot for slot in self.processes if slot >= count]:
+            process = self.processes.pop(slot)
+            process.send_signal(signal.SIGTERM)
+            self._restart_at.pop(slot, None)
+            self._stopped(process)
+
+    def check(self):
+        """
+        Restart workers that have exited, once their backoff has passed.
+        """
+        now = time.monotonic()
+        for slot, process in self.processes.items():
+            if slot in self._restart_at:
+                if now >= self._restart_at[slot]:
+                    self.restarts += 1
+                    self.spawn(slot)
+                continue
+            if process.poll() is None:
+                continue
+            if now - self._started[slot] > 60:
+                self._backoff[slot] = 1
+            backoff = self._backoff.get(slot, 1)
+            self._backoff[slot] = min(backoff * 2, settings.FEEDBACK_RESTART_MAX_SECONDS)
+            self._restart_at[slot] = now + backoff
+            print(f"Feedback worker {slot} exited with {process.returncode}, "
+                  f"restarting in {backoff} s")
+
+    def _stopped(self, process):
+        try:
+            process.wait(settings.FEEDBACK_DRAIN_SECONDS + settings.FEEDBACK_MEMBERSHIP_SECONDS + 5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stop(self):
+        processes = list(self.processes.values())
+        self.processes.clear()
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in processes:
+            self._stopped(process)
+
+    @staticmethod
+    def report():
+        """
+        One line of metrics per live worker.
+        """
+        lines = []
+        for slot, metrics in sorted(live_workers().items()):
+            lines.append(
+                f"worker {slot} pid {metrics['pid']}: {metrics['received']} received, "
+                f"{metrics['beats']} beats ({metrics['failures']} failed, "
+                f"{metrics['mean_beat_seconds']} s mean), {metrics['queued']} queued, "
+                f"{metrics['running']} running, oldest waiting "
+                f"{metrics['oldest_wait_seconds']} s"
+            )
+        return lines
@@ -0,0 +1,605 @@
+import atexit
+import json
+import math
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from core.feedback import MANEUVER, OFF_PATH, START, feedback_triggers, session_navigator
+from core.models import LocationHistory
+from core.navigation import haversine_distance
+from core.sessions import ACTIVE_SESSION_TIMEOUT, session_key
+
+# ----------------------------------------------------------
+# BINARY LOCATION FRAMES
+# ----------------------------------------------------------
+# Uplink WebSocket frames carrying GPS fixes, all little-endian:
+#
+#   header: uint8 frame type (LOCATION_FRAME), uint8 fix count
+#   fix:    float64 timestamp (unix seconds), float64 lat, float64 lng,
+#           float32 accuracy (m), float32 heading (deg), float32 speed (m/s)
+#
+# Coordinates stay float64; float32 would only resolve ~0.5 m at airport
+# longitudes.
+
+LOCATION_FRAME = 0x01
+
+FRAME_HEADER = struct.Struct("<BB")
+FIX = struct.Struct("<dddfff")
+MAX_FIXES_PER_FRAME = 255
+
+# Fixes, in frames or bulk uploads, may be stamped at most this far in the
+# phone's future
+MAX_CLOCK_SKEW_SECONDS = 300
+
+LocationFix = namedtuple(
+    "LocationFix", ["timestamp", "lat", "lng", "accuracy", "heading", "speed"]
+)
+
+
+def encode_location_frame(fixes):
+    if not 0 < len(fixes) <= MAX_FIXES_PER_FRAME:
+        raise ValueError(f"A frame holds 1 to {MAX_FIXES_PER_FRAME} fixes.")
+    frame = bytearray(FRAME_HEADER.size + FIX.size * len(fixes))
+    FRAME_HEADER.pack_into(frame, 0, LOCATION_FRAME, len(fixes))
+    for i, fix in enumerate(fixes):
+        FIX.pack_into(frame, FRAME_HEADER.size + i * FIX.size, *fix)
+    return bytes(frame)
+
+
+def decode_location_frame(data):
+    """
+    Decode a location frame into a list of LocationFix, oldest first.
+    Raises ValueError for malformed frames.
+    """
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Location frame is too short.")
+    frame_type, count = FRAME_HEADER.unpack_from(data)
+    if frame_type != LOCATION_FRAME:
+        raise ValueError(f"Not a location frame: {frame_type:#x}")
+    if count == 0 or len(data) != FRAME_HEADER.size + count * FIX.size:
+        raise ValueError("Location frame length does not match its fix count.")
+
+    fixes = [
+        LocationFix._make(values)
+        for values in FIX.iter_unpack(memoryview(data)[FRAME_HEADER.size:])
+    ]
+    latest = time.time() + MAX_CLOCK_SKEW_SECONDS
+    for fix in fixes:
+        if not (-90 <= fix.lat <= 90 and -180 <= fix.lng <= 180):
+            raise ValueError("Location fix is out of range.")
+        if not 0 < fix.timestamp <= latest:
+            raise ValueError("Location fix timestamp is out of range.")
+    return fixes
+
+
+# ----------------------------------------------------------
+# BULK UPLOADS
+# ----------------------------------------------------------
+# Fixes buffered on the phone while offline are replayed as one JSON array:
+#
+#   [{"latitude": 47.44, "longitude": -122.30, "timestamp": 1737280000.5,
+#     "accuracy": 5, "heading": 90, "speed": 1.4}, ...]
+#
+# timestamp is unix seconds; accuracy, heading and speed are optional.
+
+def _number(item, name, index, default=None):
+    value = item.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"Fix {index}: {name} must be a number.")
+    return float(value)
+
+
+def parse_location_batch(data):
+    """
+    Validate a bulk upload into a list of LocationFix, oldest first.
+    Raises ValueError for malformed batches.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("Expected a non-empty array of fixes.")
+    if len(data) > settings.LOCATION_BULK_MAX_FIXES:
+        raise ValueError(f"A batch holds at most {settings.LOCATION_BULK_MAX_FIXES} fixes.")
+
+    latest = time.time() + MAX_CLOCK_SKEW_SECONDS
+    fixes = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise ValueError(f"Fix {index}: expected an object.")
+        fix = LocationFix(
+            _number(item, "timestamp", index),
+            _number(item, "latitude", index),
+            _number(item, "longitude", index),
+            _number(item, "accuracy", index, 0),
+            _number(item, "heading", index, 0),
+            _number(item, "speed", index, 0),
+        )
+        if not (-90 <= fix.lat <= 90 and -180 <= fix.lng <= 180):
+            raise ValueError(f"Fix {index}: location is out of range.")
+        if not 0 < fix.timestamp <= latest:
+            raise ValueError(f"Fix {index}: timestamp is out of range.")
+        fixes.append(fix)
+    fixes.sort(key=lambda fix: fix.timestamp)
+    return fixes
+
+
+# ----------------------------------------------------------
+# RECENT FIXES
+# ----------------------------------------------------------
+# Navigation reads a session's latest fixes from a fixed-size ring in this
+# process, never from the database. Rows are written behind, off the
+# request. The latest two fixes are also put in the cache for feedback
+# beats run by other processes, but speed, the next-fix interval and the
+# replay check only see the fixes this worker received. A session's fixes
+# must therefore all reach one worker: WebSocket frames do, as a connection
+# stays on its worker, while REST uploads need the load balancer to route
+# by session token.
+
+class FixRing:
+    """
+    The last `capacity` fixes of one session; the oldest is overwritten.
+    """
+
+    __slots__ = ("lats", "lngs", "times", "head", "size")
+
+    def __init__(self, capacity):
+        self.lats = array("d", bytes(8 * capacity))
+        self.lngs = array("d", bytes(8 * capacity))
+        self.times = array("d", bytes(8 * capacity))  # Unix seconds
+        self.head = 0  # Next slot to write
+        self.size = 0
+
+    def push(self, lat, lng, timestamp):
+        self.lats[self.head] = lat
+        self.lngs[self.head] = lng
+        self.times[self.head] = timestamp
+        self.head = (self.head + 1) % len(self.lats)
+        self.size = min(self.size + 1, len(self.lats))
+
+    @property
+    def newest_time(self):
+        return self.times[(self.head - 1) % len(self.times)] if self.size else None
+
+    def latest(self, count=2):
+        """
+        (lat, lng) of the latest `count` fixes, newest first.
+        """
+        capacity = len(self.lats)
+        return [
+            (self.lats[i], self.lngs[i])
+            for i in ((self.head - k) % capacity for k in range(1, min(count, self.size) + 1))
+        ]
+
+    def speed(self, window):
+        """
+        Metres per second from the newest fix back to the first one at least
+        `window` seconds older (or the oldest held), or None with fewer than
+        two fixes. Averaging over a window keeps GPS jitter out of it.
+        """
+        if self.size < 2:
+            return None
+        capacity = len(self.lats)
+        newest = (self.head - 1) % capacity
+        for k in range(2, self.size + 1):
+            older = (self.head - k) % capacity
+            if self.times[newest] - self.times[older] >= window:
+                break
+        elapsed = self.times[newest] - self.times[older]
+        if elapsed <= 0:
+            return None
+        return haversine_distance(
+            self.lats[older], self.lngs[older], self.lats[newest], self.lngs[newest]
+        ) / elapsed
+
+
+class FixRings:
+    """
+    A FixRing per session, for the FIX_RING_SESSIONS most recently updated.
+    """
+
+    def __init__(self, capacity, max_sessions):
+        self.capacity = capacity
+        self.max_sessions = max_sessions
+        self._rings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def push(self, session_id, coords, timestamps=None):
+        """
+        Add (lat, lng) fixes, oldest first, and return the session's two
+        latest, newest first. Fixes older than the session's newest, e.g.
+        replayed from an offline buffer, are left out so the latest
+        position never moves back in time.
+        """
+        if timestamps is None:
+            timestamps = [time.time()] * len(coords)
+        with self._lock:
+            ring = self._rings.get(session_id)
+            if ring is None:
+                ring = self._rings[session_id] = FixRing(self.capacity)
+                if len(self._rings) > self.max_sessions:
+                    self._rings.popitem(last=False)
+            self._rings.move_to_end(session_id)
+            for (lat, lng), timestamp in zip(coords, timestamps):
+                if ring.size and timestamp < ring.newest_time:
+                    continue
+                ring.push(lat, lng, timestamp)
+            return ring.latest(2)
+
+    def latest(self, session_id, count=2):
+        with self._lock:
+            ring = self._rings.get(session_id)
+            return [] if ring is None else ring.latest(count)
+
+    def speed(self, session_id, window):
+        with self._lock:
+            ring = self._rings.get(session_id)
+            return None if ring is None else ring.speed(window)
+
+
+fix_rings = FixRings(settings.FIX_RING_SIZE, settings.FIX_RING_SESSIONS)
+
+
+# ----------------------------------------------------------
+# WRITE-BEHIND
+# ----------------------------------------------------------
+
+class LocationWriter:
+    """
+    Buffers LocationHistory rows and inserts them from a background thread,
+    in one transaction per flush: once `flush_rows` are waiting or the
+    oldest has waited `flush_seconds`. Rows still buffered are flushed when
+    the process exits. If a flush fails its rows are kept for the next one,
+    up to `max_rows`; beyond that the oldest are dropped.
+    """
+
+    def __init__(self, flush_rows, flush_seconds, max_rows):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_rows = max_rows
+        self._rows = []
+        self._oldest = None  # time.monotonic() the oldest buffered row arrived
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def add(self, rows):
+        with self._condition:
+            if self._closed:
+                # Shutting down; nothing will flush these later
+                self._rows.extend(rows)
+            else:
+                if not self._rows:
+                    self._oldest = time.monotonic()
+                self._rows.extend(rows)
+                self._trim()
+                # Started on first use, so management commands don't run it
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="location-writer", daemon=True
+                    )
+                    self._thread.start()
+                if len(self._rows) >= self.flush_rows:
+                    self._condition.notify()
+                return
+        self.flush()
+
+    def pending(self):
+        with self._condition:
+            return len(self._rows)
+
+    def flush(self):
+        """
+        Insert everything buffered now. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._condition:
+                rows, self._rows = self._rows, []
+                self._oldest = None
+            if not rows:
+                return 0
+            try:
+                with transaction.atomic():
+                    LocationHistory.objects.bulk_create(
+                        rows, batch_size=settings.LOCATION_BULK_CHUNK_SIZE
+                    )
+            except Exception as e:
+                print(f"Failed to save {len(rows)} location fixes: {e}")
+                with self._condition:
+                    self._rows[:0] = rows
+                    self._trim()
+                    self._oldest = time.monotonic()
+                close_old_connections()
+                return 0
+            return len(rows)
+
+    def close(self):
+        """
+        Stop the background thread and flush what is left.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _trim(self):
+        if len(self._rows) > self.max_rows:
+            dropped = len(self._rows) - self.max_rows
+            del self._rows[:dropped]
+            print(f"Location buffer full, dropped {dropped} fixes")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._rows:
+                        due = self._oldest + self.flush_seconds - time.monotonic()
+                        if len(self._rows) >= self.flush_rows or due <= 0:
+                            break
+                    else:
+                        due = None
+                    self._condition.wait(due)
+                if self._closed:
+                    break
+            self.flush()
+        connection.close()
+
+
+location_writer = LocationWriter(
+    settings.LOCATION_FLUSH_ROWS,
+    settings.LOCATION_FLUSH_SECONDS,
+    settings.LOCATION_BUFFER_MAX_ROWS,
+)
+atexit.register(location_writer.close)
+
+
+# ----------------------------------------------------------
+# NAVIGATION PIPELINE
+# ----------------------------------------------------------
+
+def _reported(value):
+    # Phones send NaN (or a negative value) when they don't know it
+    return value if math.isfinite(value) and value >= 0 else None
+
+
+def location_rows(session_id, fixes):
+    return [
+        LocationHistory(
+            session_id=session_id,
+            latitude=fix.lat,
+            longitude=fix.lng,
+            timestamp=datetime.fromtimestamp(fix.timestamp, timezone.utc),
+            accuracy=_reported(fix.accuracy),
+            heading=_reported(fix.heading),
+            speed=_reported(fix.speed),
+        )
+        for fix in fixes
+    ]
+
+
+def save_location_fixes(session_id, fixes):
+    """
+    INSERT LocationFix rows, LOCATION_BULK_CHUNK_SIZE per statement, in
+    one transaction.
+    """
+    with transaction.atomic():
+        LocationHistory.objects.bulk_create(
+            location_rows(session_id, fixes), batch_size=settings.LOCATION_BULK_CHUNK_SIZE
+        )
+
+
+def write_location_fixes(session_id, fixes):
+    """
+    Save LocationFix rows through the write-behind buffer.
+    """
+    location_writer.add(location_rows(session_id, fixes))
+
+
+def queue_location(session_id, **fields):
+    """
+    Build a LocationHistory row and hand it to the write-behind buffer. Its
+    id stays None; the row is in the database within LOCATION_FLUSH_SECONDS.
+    """
+    location = LocationHistory(session_id=session_id, **fields)
+    location_writer.add([location])
+    return location
+
+
+def recent_fixes(session_id, count=2):
+    """
+    The session's latest (lat, lng) fixes, newest first: a range scan of
+    the (session, timestamp) index.
+    """
+    return list(
+        LocationHistory.objects.filter(session_id=session_id)
+        .order_by("-timestamp")
+        .values_list("latitude", "longitude")[:count]
+    )
+
+
+def process_location_fixes(session_id, coords, timestamps=None):
+    """
+    Feed new (lat, lng) fixes, oldest first, into the session's navigation,
+    starting a feedback beat if they leave the path or near a turn. Returns
+    the number of seconds the client should wait before its next fix.
+
+    It only touches the cache and the fix rings and hands beats to the
+    trigger threads, so async callers may run it on any thread
+    (thread_sensitive=False) rather than wait for the shared sync thread.
+    """
+    recent_coords = fix_rings.push(session_id, coords, timestamps)
+    cache.set(session_key(session_id, "recent_coords"), recent_coords, timeout=10)
+    speed = fix_rings.speed(session_id, settings.FIX_SPEED_WINDOW_SECONDS)
+
+    navigator = session_navigator(session_id)
+    if navigator is None:
+        # The first beat plans the route
+        feedback_triggers.fire(session_id, START)
+    position = navigator and navigator.route_position(*recent_coords[0])
+    if not position:
+        return next_fix_interval(speed, False, None)
+    distance_to_path, to_maneuver = position
+    off_path = distance_to_path > navigator.threshold_meters
+    route_events(session_id, off_path, to_maneuver <= settings.FEEDBACK_MANEUVER_METERS)
+    return next_fix_interval(speed, off_path, to_maneuver)
+
+
+def route_events(session_id, off_path, near_maneuver):
+    """
+    Start a feedback beat when a session leaves the path, or comes within
+    FEEDBACK_MANEUVER_METERS of a turn on it. Each fires once per change.
+    """
+    key = session_key(session_id, "route_state")
+    previous_off_path, previous_near_maneuver = cache.get(key, default=(False, False))
+    if (off_path, near_maneuver) == (previous_off_path, previous_near_maneuver):
+        return
+    cache.set(key, (off_path, near_maneuver), timeout=ACTIVE_SESSION_TIMEOUT)
+    if off_path != previous_off_path:
+        # Model call priority follows it
+        cache.set(session_key(session_id, "off_path"), off_path)
+    if off_path and not previous_off_path:
+        feedback_triggers.fire(session_id, OFF_PATH)
+    elif near_maneuver and not previous_near_maneuver and not off_path:
+        feedback_triggers.fire(session_id, MANEUVER)
+
+
+# ----------------------------------------------------------
+# SAMPLING
+# ----------------------------------------------------------
+# Clients are told how long to wait before their next fix: often near a
+# turn or off the path, rarely on a long straight or when standing still.
+
+def next_fix_interval(speed, off_path, to_maneuver):
+    """
+    Seconds until the next fix for a traveller moving at `speed` m/s (None
+    if unknown), `to_maneuver` metres along the path from the nearest turn
+    (None without a route).
+    """
+    if off_path:
+        return settings.FIX_INTERVAL_MIN_SECONDS
+    if to_maneuver is None or speed is None:
+        return settings.FIX_INTERVAL_DEFAULT_SECONDS
+    if speed < settings.FIX_STATIONARY_SPEED and to_maneuver > settings.FIX_MAX_TRAVEL_METERS:
+        return settings.FIX_INTERVAL_MAX_SECONDS
+    # At least two fixes on the way into a turn and out of it, and never
+    # more than FIX_MAX_TRAVEL_METERS unseen
+    seconds = min(settings.FIX_MAX_TRAVEL_METERS, to_maneuver / 2) / max(
+        speed, settings.FIX_WALKING_SPEED
+    )
+    return int(min(max(seconds, settings.FIX_INTERVAL_MIN_SECONDS),
+                   settings.FIX_INTERVAL_MAX_SECONDS))
+
+
+# ----------------------------------------------------------
+# HISTORY
+# ----------------------------------------------------------
+# Listing and exporting stored fixes, oldest first by (timestamp, id).
+# Exports stream rows from a server-side cursor, so memory stays flat
+# however many rows match.
+
+EXPORT_FIELDS = ("id", "session", "latitude", "longitude", "timestamp")
+
+
+def _history_time(value, name):
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except (ValueError, OverflowError):
+        pass
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"{name} must be an ISO 8601 time or unix seconds")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def filter_locations(queryset, params):
+    """
+    Narrow a LocationHistory queryset by ?session=, ?since= (inclusive) and
+    ?until= (exclusive). Raises ValueError for a malformed time.
+    """
+    if params.get("session"):
+        queryset = queryset.filter(session_id=params["session"])
+    if params.get("since"):
+        queryset = queryset.filter(timestamp__gte=_history_time(params["since"], "since"))
+    if params.get("until"):
+        queryset = queryset.filter(timestamp__lt=_history_time(params["until"], "until"))
+    return queryset
+
+
+def _export_rows(queryset):
+    rows = queryset.order_by("timestamp", "id").values_list(*EXPORT_FIELDS)
+    return rows.iterator(chunk_size=settings.LOCATION_EXPORT_CHUNK_SIZE)
+
+
+def _timestamp(value):
+    # As DRF renders DateTimeFields
+    return value.isoformat().replace("+00:00", "Z")
+
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == settings.LOCATION_EXPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def export_ndjson(queryset):
+    """
+    Yield fixes as newline-delimited JSON objects.
+    """
+    return _chunked(
+        json.dumps({
+            "id": id, "session": session, "latitude": lat, "longitude": lng,
+            "timestamp": _timestamp(timestamp),
+        }) + "\n"
+        for id, session, lat, lng, timestamp in _export_rows(queryset)
+    )
+
+
+def export_geojson(queryset):
+    """
+    Yield fixes as a GeoJSON FeatureCollection of Points.
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ""
+    for chunk in _chunked(
+        json.dumps({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lng, lat]},
+            "properties": {"id": id, "session": session, "timestamp": _timestamp(timestamp)},
+        }) + ","
+        for id, session, lat, lng, timestamp in _export_rows(queryset)
+    ):
+        yield separator + chunk[:-1]
+        separator = ","
+    yield "]}\n"
+
+
+async def aiterate(chunks):
+    """
+    Async iterator over an export's chunks, each pulled through
+    sync_to_async. Served over ASGI, a sync iterator would be read into a
+    list before the first byte goes out.
+    """
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
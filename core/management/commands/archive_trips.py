@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.trajectories import archive_completed_trips
+
+
+class Command(BaseCommand):
+    help = 'Compress the fixes of finished sessions into Trip rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-seconds', type=int, default=settings.TRIP_IDLE_SECONDS,
+            help='Sessions with no fixes for this long are archived',
+        )
+
+    def handle(self, *args, **options):
+        trips = archive_completed_trips(options['idle_seconds'])
+        fixes = sum(trip.fix_count for trip in trips)
+        self.stdout.write(f"Archived {len(trips)} trips, {fixes} fixes.")
@@ -0,0 +1,23 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.feedback_workers import FeedbackWorker
+
+
+class Command(BaseCommand):
+    help = 'Run one sharded feedback worker (run_scheduler --workers starts these)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--slot', type=int, default=0,
+            help='Worker slot to claim if it is free',
+        )
+
+    def handle(self, *args, **options):
+        worker = FeedbackWorker(options['slot'])
+        # Leave the ring and finish routed work before exiting
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        asyncio.run(worker.serve())
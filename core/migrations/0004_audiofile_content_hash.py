@@ -0,0 +1,49 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:09
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_audio(apps, schema_editor):
+    """
+    Hash archived uploads. Only the oldest copy of duplicate content keeps
+    the hash; later copies are left as they are.
+    """
+    AudioFile = apps.get_model("core", "AudioFile")
+    seen = set()
+    for audio_file in AudioFile.objects.order_by("timestamp", "id"):
+        digest = hashlib.sha256()
+        try:
+            with audio_file.file.open("rb") as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+        except (OSError, ValueError):
+            continue
+        content_hash = digest.hexdigest()
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        audio_file.content_hash = content_hash
+        audio_file.save(update_fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_audiofile_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiofile',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='audiofile',
+            name='language',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(hash_existing_audio, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_default_session(apps, schema_editor):
+    """
+    Existing fixes predate sessions and belong to the shared default one.
+    """
+    NavigationSession = apps.get_model("core", "NavigationSession")
+    NavigationSession.objects.get_or_create(id="default")
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_audiofile_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NavigationSession',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='locationhistory',
+            name='session',
+            field=models.ForeignKey(db_constraint=False, db_index=False, default='default', on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='core.navigationsession'),
+        ),
+        migrations.AddIndex(
+            model_name='locationhistory',
+            index=models.Index(fields=['session', 'timestamp'], name='location_session_time'),
+        ),
+        migrations.RunPython(create_default_session, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_location_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locationhistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
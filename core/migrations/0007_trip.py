@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_location_fix_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('ended', models.DateTimeField()),
+                ('fix_count', models.PositiveIntegerField()),
+                ('path', models.BinaryField()),
+                ('session', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='core.navigationsession')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_trip'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='locationhistory',
+            index=models.Index(fields=['timestamp'], name='location_time'),
+        ),
+    ]
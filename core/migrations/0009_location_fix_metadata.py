@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-19 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_location_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationhistory',
+            name='accuracy',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationhistory',
+            name='heading',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationhistory',
+            name='speed',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
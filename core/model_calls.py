@@ -0,0 +1,461 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+# ----------------------------------------------------------
+# 1. PRIORITY CLASSES
+# ----------------------------------------------------------
+# Lower runs first. Within a class, calls for the traveller closest to
+# departure go first, then first come first served.
+
+URGENT = 0       # Off the path, or departing within URGENT_DEPARTURE_MINUTES
+INTERACTIVE = 1  # Answering something the traveller asked
+BACKGROUND = 2   # Nobody is waiting on the result; shed when it waits too long
+
+PRIORITY_NAMES = {URGENT: "urgent", INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class ModelCallFailed(Exception):
+    """
+    A model call produced no result: it failed, missed its deadline, or the
+    model's circuit breaker is open. Callers fall back to a local response.
+    """
+
+
+class ModelCallShed(ModelCallFailed):
+    """
+    A call waited in the queue past its deadline, or a background call
+    waited longer than MODEL_CALL_BACKGROUND_MAX_WAIT.
+    """
+
+
+def departure_minutes(time_until_flight):
+    """
+    Minutes until departure from flight_data["time_until_flight"]
+    ("45 minutes"), or None if unknown.
+    """
+    try:
+        return float(str(time_until_flight).split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def call_priority(off_path=False, minutes=None, background=False):
+    if background:
+        return BACKGROUND
+    if off_path or (minutes is not None and minutes <= settings.URGENT_DEPARTURE_MINUTES):
+        return URGENT
+    return INTERACTIVE
+
+
+# ----------------------------------------------------------
+# 2. RATE LIMITING
+# ----------------------------------------------------------
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate    # Tokens added per second
+        self.burst = burst  # Most tokens held at once
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take a token if one is available. Returns 0, or the seconds until
+        the next token.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` failed calls in a row, so callers fall back at
+    once instead of waiting on a degraded upstream. After `reset_seconds`
+    one trial call is let through; its outcome closes or reopens it.
+    """
+
+    def __init__(self, failures, reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.failed = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial = True
+            return True
+
+    def release(self):
+        """
+        Give back a trial call that never reached the upstream.
+        """
+        with self.lock:
+            self.trial = False
+
+    def record(self, success):
+        with self.lock:
+            self.trial = False
+            if success:
+                self.failed = 0
+                self.opened_at = None
+                return
+            self.failed += 1
+            if self.opened_at is not None or self.failed >= self.failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def retry_after(self):
+        """
+        Seconds until a trial call would be let through; 0 when closed.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+
+
+# ----------------------------------------------------------
+# 3. SCHEDULER
+# ----------------------------------------------------------
+
+class ModelScheduler:
+    """
+    Admits upstream model calls in priority order, at most as fast as each
+    model's token bucket allows. Models without a configured limit are
+    admitted immediately. Limits apply per worker process.
+    """
+
+    def __init__(self, rate_limits, background_max_wait, deadlines=None, breaker_failures=5,
+                 breaker_reset_seconds=30, hedge_min_samples=20, stats_window=1000):
+        self.buckets = {
+            model: TokenBucket(rate, burst) for model, (rate, burst) in rate_limits.items()
+        }
+        self.background_max_wait = background_max_wait
+        self.deadlines = deadlines or {}
+        self.hedge_min_samples = hedge_min_samples
+        self.breakers = collections.defaultdict(
+            lambda: CircuitBreaker(breaker_failures, breaker_reset_seconds)
+        )
+        # Upstream latency of successful calls, per model, for hedging
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=200))
+        self._executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="model-call")
+        self._queues = collections.defaultdict(list)  # model -> heap of waiters
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        # (loop, asyncio.Event) per aadmit() waiter, set whenever the queues
+        # change, as notify_all() does for the threads in admit()
+        self._async_waiters = set()
+        self._waits = {p: collections.deque(maxlen=stats_window) for p in PRIORITY_NAMES}
+        self._admitted = collections.Counter()
+        self._shed = collections.Counter()
+
+    def call(self, model, priority, fn, /, *args, minutes=None, deadline=None,
+             hedge=False, **kwargs):
+        """
+        Wait for a slot for `model`, then return fn(*args, **kwargs).
+
+        With a `deadline` (seconds, including the queue wait; defaults to
+        the model's configured one), the call is abandoned when it passes.
+        With `hedge`, a second identical request is sent if the first is
+        slower than the model's recent p95, or fails, and the first
+        response wins. Raises ModelCallFailed, or ModelCallShed, when there
+        is no result.
+        """
+        with self._condition:
+            breaker = self.breakers[model]
+        if not breaker.allow():
+            raise ModelCallFailed(f"{model} circuit breaker is open")
+
+        deadline = self.deadlines.get(model) if deadline is None else deadline
+        expires = None if deadline is None else time.monotonic() + deadline
+        try:
+            self.admit(model, priority, minutes, expires)
+            if expires is None and not hedge:
+                result = self._timed(model, fn, args, kwargs)
+            else:
+                result = self._call_with_deadline(model, fn, args, kwargs, expires, hedge)
+        except ModelCallShed:
+            # Queueing says nothing about the upstream's health
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record(False)
+            if isinstance(e, ModelCallFailed):
+                raise
+            raise ModelCallFailed(f"{model} call failed: {e}") from e
+        breaker.record(True)
+        return result
+
+    async def acall(self, model, priority, fn, /, *args, minutes=None, deadline=None, **kwargs):
+        """
+        `call` for a coroutine function: awaits fn(*args, **kwargs) under
+        the same admission, circuit breaker and deadline, without hedging.
+        """
+        with self._condition:
+            breaker = self.breakers[model]
+        if not breaker.allow():
+            raise ModelCallFailed(f"{model} circuit breaker is open")
+
+        deadline = self.deadlines.get(model) if deadline is None else deadline
+        expires = None if deadline is None else time.monotonic() + deadline
+        try:
+            await self.aadmit(model, priority, minutes, expires)
+            start = time.monotonic()
+            timeout = None if expires is None else max(expires - start, 0)
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout)
+            with self._condition:
+                self._latencies[model].append(time.monotonic() - start)
+        except (ModelCallShed, asyncio.CancelledError):
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record(False)
+            if isinstance(e, ModelCallFailed):
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                raise ModelCallFailed(f"{model} call missed its deadline") from e
+            raise ModelCallFailed(f"{model} call failed: {e}") from e
+        breaker.record(True)
+        return result
+
+    def retry_after(self, model):
+        """
+        Seconds a client should wait before retrying a failed `model` call:
+        until its circuit breaker lets a trial through, and at least 1.
+        """
+        with self._condition:
+            breaker = self.breakers[model]
+        return max(math.ceil(breaker.retry_after()), 1)
+
+    def _call_with_deadline(self, model, fn, args, kwargs, expires, hedge):
+        pending = {self._executor.submit(self._timed, model, fn, args, kwargs)}
+        hedge_at = None
+        if hedge:
+            p95 = self.latency_p95(model)
+            if p95 is not None:
+                hedge_at = time.monotonic() + p95
+
+        error = None
+        while True:
+            wake = [t for t in (expires, hedge_at) if t is not None]
+            timeout = max(min(wake) - time.monotonic(), 0) if wake else None
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+
+            now = time.monotonic()
+            if expires is not None and now >= expires:
+                raise ModelCallFailed(f"{model} call missed its deadline")
+            # Send the hedge once the first request is overdue, or at once
+            # if it already failed; it never waits for a token
+            if hedge_at is not None and (now >= hedge_at or not pending):
+                hedge_at = None
+                if self.try_admit(model):
+                    pending.add(self._executor.submit(self._timed, model, fn, args, kwargs))
+            if not pending:
+                raise error
+
+    def _timed(self, model, fn, args, kwargs):
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        with self._condition:
+            self._latencies[model].append(time.monotonic() - start)
+        return result
+
+    def latency_p95(self, model):
+        """
+        p95 upstream latency of recent successful calls, or None until
+        there are enough of them.
+        """
+        with self._condition:
+            latencies = sorted(self._latencies[model])
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return _percentile(latencies, 0.95)
+
+    def try_admit(self, model):
+        """
+        Take a token only if nobody is queued for `model` and one is free.
+        """
+        bucket = self.buckets.get(model)
+        if bucket is None:
+            return True
+        with self._condition:
+            return not self._queues[model] and not bucket.take()
+
+    def admit(self, model, priority, minutes=None, expires=None):
+        """
+        Block until the call may go ahead. `expires` is a time.monotonic()
+        deadline for the wait.
+        """
+        bucket = self.buckets.get(model)
+        if bucket is None:
+            self._record(priority, 0)
+            return
+
+        start = time.monotonic()
+        waiter, expires = self._enqueue(model, priority, minutes, expires, start)
+        with self._condition:
+            while True:
+                admitted, timeout = self._poll(model, bucket, waiter, priority, expires, start)
+                if admitted:
+                    break
+                self._condition.wait(timeout)
+
+        self._record(priority, time.monotonic() - start)
+
+    async def aadmit(self, model, priority, minutes=None, expires=None):
+        """
+        `admit` for the event loop: waits in the same queue without holding
+        a thread.
+        """
+        bucket = self.buckets.get(model)
+        if bucket is None:
+            self._record(priority, 0)
+            return
+
+        start = time.monotonic()
+        woken = asyncio.Event()
+        entry = (asyncio.get_running_loop(), woken)
+        with self._condition:
+            self._async_waiters.add(entry)
+        waiter, expires = self._enqueue(model, priority, minutes, expires, start)
+        try:
+            while True:
+                with self._condition:
+                    woken.clear()
+                    admitted, timeout = self._poll(
+                        model, bucket, waiter, priority, expires, start
+                    )
+                if admitted:
+                    break
+                try:
+                    await asyncio.wait_for(woken.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # A cancelled waiter must not hold up the ones behind it
+            with self._condition:
+                queue = self._queues[model]
+                if waiter in queue:
+                    queue.remove(waiter)
+                    heapq.heapify(queue)
+                    self._wake()
+            raise
+        finally:
+            with self._condition:
+                self._async_waiters.discard(entry)
+
+        self._record(priority, time.monotonic() - start)
+
+    def _enqueue(self, model, priority, minutes, expires, start):
+        if priority == BACKGROUND:
+            background_expires = start + self.background_max_wait
+            expires = background_expires if expires is None else min(expires, background_expires)
+        waiter = (priority, math.inf if minutes is None else minutes, next(self._seq))
+        with self._condition:
+            heapq.heappush(self._queues[model], waiter)
+        return waiter, expires
+
+    def _poll(self, model, bucket, waiter, priority, expires, start):
+        """
+        One look at the queue, holding self._condition: (True, None) once
+        `waiter` is admitted, else (False, seconds to wait, or None until
+        woken). Raises ModelCallShed once `expires` has passed.
+        """
+        queue = self._queues[model]
+        timeout = None
+        if queue[0] == waiter:
+            timeout = bucket.take()
+            if not timeout:
+                heapq.heappop(queue)
+                # The next waiter may be able to go too
+                self._wake()
+                return True, None
+
+        if expires is not None:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                queue.remove(waiter)
+                heapq.heapify(queue)
+                self._wake()
+                self._shed[priority] += 1
+                raise ModelCallShed(
+                    f"{model} call shed after {time.monotonic() - start:.1f}s in the queue"
+                )
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return False, timeout
+
+    def _wake(self):
+        # Called holding self._condition
+        self._condition.notify_all()
+        for loop, woken in self._async_waiters:
+            loop.call_soon_threadsafe(woken.set)
+
+    def stats(self):
+        """
+        Queue wait per priority class, in milliseconds.
+        """
+        with self._condition:
+            waits = {p: sorted(w) for p, w in self._waits.items()}
+            admitted = dict(self._admitted)
+            shed = dict(self._shed)
+            queued = {model: len(queue) for model, queue in self._queues.items()}
+            breakers = {model: breaker.is_open for model, breaker in self.breakers.items()}
+        stats = {}
+        for priority, name in PRIORITY_NAMES.items():
+            window = waits[priority]
+            stats[name] = {
+                "admitted": admitted.get(priority, 0),
+                "shed": shed.get(priority, 0),
+                "wait_p50_ms": _percentile(window, 0.5) * 1000,
+                "wait_p95_ms": _percentile(window, 0.95) * 1000,
+                "wait_max_ms": (window[-1] if window else 0) * 1000,
+            }
+        stats["queued"] = queued
+        stats["breaker_open"] = breakers
+        return stats
+
+    def _record(self, priority, wait):
+        with self._condition:
+            self._waits[priority].append(wait)
+            self._admitted[priority] += 1
+
+
+def _percentile(values, q):
+    if not values:
+        return 0
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+model_scheduler = ModelScheduler(
+    settings.MODEL_RATE_LIMITS,
+    settings.MODEL_CALL_BACKGROUND_MAX_WAIT,
+    settings.MODEL_CALL_DEADLINES,
+    settings.MODEL_BREAKER_FAILURES,
+    settings.MODEL_BREAKER_RESET_SECONDS,
+)
@@ -1,15 +1,67 @@
 from django.db import models
+from django.utils import timezone
+
+from core.sessions import DEFAULT_SESSION_ID
 
 # Create your models here.
 
 
+class NavigationSession(models.Model):
+    # The id signed into the client's session token (core.sessions)
+    id = models.CharField(max_length=64, primary_key=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
 class LocationHistory(models.Model):
+    # Tokens are signed, not looked up, so a fix may arrive for a session
+    # whose row doesn't exist yet; the key is not enforced by the database
+    session = models.ForeignKey(
+        NavigationSession,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        db_index=False,
+        default=DEFAULT_SESSION_ID,
+        related_name="locations",
+    )
     latitude = models.FloatField()
     longitude = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the fix was taken; bulk replays and WebSocket frames carry it
+    timestamp = models.DateTimeField(default=timezone.now)
+    # As reported by the phone with bulk replays and WebSocket frames
+    accuracy = models.FloatField(null=True, blank=True)  # Metres
+    heading = models.FloatField(null=True, blank=True)  # Degrees from north
+    speed = models.FloatField(null=True, blank=True)  # Metres per second
+
+    class Meta:
+        indexes = [
+            # Recent fixes for a session are a range scan of this index
+            models.Index(fields=["session", "timestamp"], name="location_session_time"),
+            # Listing across sessions pages through this; the row id breaks
+            # ties, and SQLite keeps index entries in rowid order
+            models.Index(fields=["timestamp"], name="location_time"),
+        ]
+
+
+class Trip(models.Model):
+    # A finished session's fixes, archived by core.trajectories and removed
+    # from LocationHistory. Read them with core.trajectories.trip_fixes.
+    session = models.ForeignKey(
+        NavigationSession,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name="trips",
+    )
+    started = models.DateTimeField()
+    ended = models.DateTimeField()
+    fix_count = models.PositiveIntegerField()
+    # Polyline-encoded (lat, lng, time) deltas, see core.trajectories
+    path = models.BinaryField()
 
 
 class AudioFile(models.Model):
     file = models.FileField(upload_to="audio/")
     timestamp = models.DateTimeField(auto_now_add=True)
     translation = models.TextField()
+    language = models.CharField(max_length=32, blank=True)
+    # sha256 of the uploaded bytes, so retried uploads are stored once
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
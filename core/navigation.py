@@ -1,11 +1,21 @@
 import math
 import os
+from bisect import bisect_left
 from scipy.spatial import KDTree
 from googlemaps import convert
 #################################
 # If using the separate OpenAI client library:
 from openai import OpenAI
 #################################
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from core.model_calls import (
+    INTERACTIVE, call_priority, departure_minutes, model_scheduler
+)
+from core.prompts import (
+    NAVIGATION_SYSTEM_PROMPT, chat_messages, navigation_prompt, token_usage
+)
 # If using openai Python package, do: import openai
 
 # ----------------------------------------------------------
@@ -17,20 +27,33 @@ from openai import OpenAI
 #     raise ValueError("OpenAI API key not set. Please set 'OPENAI_API_KEY' env variable.")
 
 client = OpenAI()
+# Chat calls are hedged instead of retried, and time out at the model's
+# deadline (see MODEL_CALL_DEADLINES)
+chat_client = client.with_options(
+    timeout=settings.MODEL_CALL_DEADLINES["gpt-4o-mini"], max_retries=0
+)
 
-def generate_text(prompt):
+def generate_text(prompt, priority=INTERACTIVE, minutes=None, system=None, max_tokens=100):
     """
-    Call the LLM with a custom prompt, returning generated text.
+    Call the LLM with a custom prompt, returning generated text, or None if
+    it failed or missed its deadline.
     """
+    messages = chat_messages(prompt, system)
     try:
-        response = client.chat.completions.create(
+        response = model_scheduler.call(
+            "gpt-4o-mini",
+            priority,
+            chat_client.chat.completions.create,
+            minutes=minutes,
+            hedge=True,
             model="gpt-4o-mini",   # or whichever model ID you have
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=100,
+            messages=messages,
+            max_tokens=max_tokens,
             temperature=0,
             n=1,
             stop=None
         )
+        token_usage.record("gpt-4o-mini", messages, response)
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"An error occurred with the LLM: {e}")
@@ -55,6 +78,19 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
 
+def project_onto_segment(lat, lng, start, end):
+    """
+    (fraction of the way from start to end, metres away) of the point on a
+    short segment nearest (lat, lng), treating the earth as flat.
+    """
+    metres_per_degree = math.radians(6371000)
+    scale = math.cos(math.radians(start[0]))
+    seg_x, seg_y = (end[1] - start[1]) * scale, end[0] - start[0]
+    x, y = (lng - start[1]) * scale, lat - start[0]
+    length = seg_x * seg_x + seg_y * seg_y
+    fraction = min(max((x * seg_x + y * seg_y) / length, 0.0), 1.0) if length else 0.0
+    return fraction, math.hypot(x - fraction * seg_x, y - fraction * seg_y) * metres_per_degree
+
 def calculate_bearing(lat1, lon1, lat2, lon2):
     """
     Calculate the bearing between two points in degrees [0, 360).
@@ -119,6 +155,16 @@ def provide_instructions(relative_direction):
         return 'Movement direction undetermined.'
 
 
+def local_response(instruction, flight_status, time_until_flight):
+    """
+    Template answer used when the LLM is unavailable. It is in English,
+    like the instructions it wraps, even though the LLM replies in the
+    language NAVIGATION_SYSTEM_PROMPT asks for, so a traveller hears a
+    different language while the model is down.
+    """
+    return f"{instruction} Flight status: {flight_status}. Time until flight: {time_until_flight}."
+
+
 # ----------------------------------------------------------
 # 3. NAVIGATOR CLASS
 # ----------------------------------------------------------
@@ -133,9 +179,15 @@ class Navigator:
         """
         self.directions = directions
         self.location_history = []   # Keep at most 2 points
+        self.status = None           # Status from the latest update
         self.polyline_coords = []
         self.kd_tree = None
         self.threshold_meters = 15
+        # Metres along the path to each point, and to each turn (where a
+        # step begins) then the destination, with what to do there
+        self.route_distances = []
+        self.maneuver_distances = []
+        self.maneuver_instructions = []
 
         self.prepare_route()
 
@@ -144,6 +196,8 @@ class Navigator:
         Decode all polylines and build a KDTree for nearest-path lookups.
         """
         all_coords = []
+        maneuvers = []
+        instructions = []
         for direction in self.directions:
             for leg in direction.get('legs', []):
                 for step in leg.get('steps', []):
@@ -153,6 +207,14 @@ class Navigator:
                     try:
                         decoded = convert.decode_polyline(poly_str)
                         coords = [(pt['lat'], pt['lng']) for pt in decoded]
+                        if all_coords:
+                            # Steps usually start where the last one ended
+                            if coords and coords[0] == all_coords[-1]:
+                                coords = coords[1:]
+                                maneuvers.append(len(all_coords) - 1)
+                            else:
+                                maneuvers.append(len(all_coords))
+                            instructions.append(strip_tags(step.get('html_instructions', '')))
                         all_coords.extend(coords)
                     except Exception as e:
                         print(f"Error decoding polyline: {e}")
@@ -160,6 +222,15 @@ class Navigator:
         if all_coords:
             self.polyline_coords = all_coords
             self.kd_tree = KDTree(self.polyline_coords)
+            self.route_distances = [0.0]
+            for (lat1, lng1), (lat2, lng2) in zip(all_coords, all_coords[1:]):
+                self.route_distances.append(
+                    self.route_distances[-1] + haversine_distance(lat1, lng1, lat2, lng2)
+                )
+            self.maneuver_distances = [
+                self.route_distances[i] for i in maneuvers + [len(all_coords) - 1]
+            ]
+            self.maneuver_instructions = instructions + [""]
             print(f"KDTree built with {len(all_coords)} path points.")
         else:
             print("No valid path coordinates found. KDTree not built.")
@@ -237,14 +308,66 @@ class Navigator:
                 instruction = ("You are off the path at the start. "
                                "Not enough history for direction.")
 
+        self.status = status
         return status, instruction
 
+    def route_position(self, lat, lng):
+        """
+        (metres from the path, metres along it to the nearest turn or the
+        destination, ahead or behind) for a fix, or None without route data.
+        Leaves the location history alone.
+        """
+        position = self._nearest_maneuver(lat, lng)
+        return position and position[:2]
+
+    def maneuver_instruction(self, lat, lng):
+        """
+        The directions' instruction for the turn nearest a fix, or "" at the
+        destination or without route data.
+        """
+        position = self._nearest_maneuver(lat, lng)
+        return self.maneuver_instructions[position[2]] if position else ""
+
+    def _nearest_maneuver(self, lat, lng):
+        """
+        (metres from the path, metres along it to the nearest turn, its index).
+        """
+        if not self.kd_tree:
+            return None
+        _, nearest_index = self.kd_tree.query((lat, lng))
+        nearest_point = self.polyline_coords[nearest_index]
+        distance_to_path = haversine_distance(lat, lng, nearest_point[0], nearest_point[1])
+
+        # Polylines can be sparse on straights, so measure to the segments
+        # either side of the nearest point rather than the point itself
+        along = self.route_distances[nearest_index]
+        for start in (nearest_index - 1, nearest_index):
+            if 0 <= start < len(self.polyline_coords) - 1:
+                fraction, gap = project_onto_segment(
+                    lat, lng, self.polyline_coords[start], self.polyline_coords[start + 1]
+                )
+                if gap < distance_to_path:
+                    distance_to_path = gap
+                    along = self.route_distances[start] + fraction * (
+                        self.route_distances[start + 1] - self.route_distances[start]
+                    )
+        next_maneuver = min(
+            bisect_left(self.maneuver_distances, along), len(self.maneuver_distances) - 1
+        )
+        to_maneuver = max(self.maneuver_distances[next_maneuver] - along, 0.0)
+        # GPS error can put a fix just past a turn before it is taken
+        if next_maneuver and along - self.maneuver_distances[next_maneuver - 1] < to_maneuver:
+            next_maneuver -= 1
+            to_maneuver = along - self.maneuver_distances[next_maneuver]
+        return distance_to_path, to_maneuver, next_maneuver
+
 
 # ----------------------------------------------------------
 # 4. PROCESS SINGLE LOCATION UPDATE
 # ----------------------------------------------------------
 
-def process_location_update(navigator, loc, flight_status, time_until_flight, transcription):
+def process_location_update(navigator, loc, flight_status, time_until_flight, transcription,
+                            background=False):
     """
     Handle a single new location update. If OFF the path, 
     call the LLM with Nepali instructions.
@@ -254,30 +377,36 @@ def process_location_update(navigator, loc, flight_status, time_until_flight, tr
     - flight_status: e.g. "On time", "Delayed", ...
     - time_until_flight: e.g. "2 hours", "45 minutes" ...
     - transcription: an object with .text indicating what the user asked
+    - background: nobody will hear the result, so the LLM call may be shed
     """
     status, instruction = navigator.get_navigation_instructions(loc['lat'], loc['lng'])
     print(f"Location: {loc}")
     print(f"Status: {status}")
 
     if status == "OFF the path":
-        # Build prompt in Nepali
-        prompt = (
-            f"Give output in Nepali language. A person is travelling on a path and give instruction to the person based on "
-            f"the following information in nepali language. Person's status: {status}, Instruction: {instruction}. "
-            f"Flight status: {flight_status}. Time until flight: {time_until_flight}. "
-            f"Transcription of what person is asking: {transcription.text}. "
-            f"Answer person's query based on their status, instruction and flight status and nothing else. "
-            f"Be specific and don't tell anything more than what is asked."
+        # The Nepali instructions live in the shared system prompt
+        prompt = navigation_prompt(
+            status, instruction, flight_status, time_until_flight, transcription.text
+        )
+        minutes = departure_minutes(time_until_flight)
+        result = generate_text(
+            prompt,
+            call_priority(off_path=True, minutes=minutes, background=background),
+            minutes,
+            system=NAVIGATION_SYSTEM_PROMPT,
+            max_tokens=settings.NAVIGATION_MAX_OUTPUT_TOKENS,
         )
-        result = generate_text(prompt)
         if result:
             pass
             # print(f"LLM Instruction (Nepali): {result}\n")
         else:
-            print("No LLM response.\n")
+            # Failed, too slow, or the circuit breaker is open
+            print("No LLM response, using the local template.\n")
+            result = local_response(instruction, flight_status, time_until_flight)
 
-    elif status == "On the path":
-        # Just print the local instruction; no LLM call needed
+    else:
+        # Just use the local instruction; no LLM call needed
+        result = instruction
         print(f"Instruction: {result}\n")
 
     return result
@@ -0,0 +1,144 @@
+import collections
+import math
+import re
+import threading
+
+from django.conf import settings
+
+from core.model_calls import _percentile
+
+# ----------------------------------------------------------
+# 1. PROMPTS
+# ----------------------------------------------------------
+# The system message never changes, so it is sent byte for byte the same on
+# every call and can be served from the upstream prompt cache. Everything
+# that varies goes in a short user message after it.
+
+NAVIGATION_SYSTEM_PROMPT = (
+    "You guide a traveller walking to their flight. Reply in Nepali. "
+    "Answer only what the traveller asks, using their status, the navigation "
+    "instruction and the flight details. Be specific and brief."
+)
+
+
+def navigation_prompt(status, instruction, flight_status, time_until_flight, question):
+    """
+    User message for an off-path location update. The question is cut to
+    fit the token budgets.
+    """
+    prompt = (
+        f"Status: {status}\n"
+        f"Instruction: {instruction}\n"
+        f"Flight: {flight_status}, departs in {time_until_flight}"
+    )
+    question = " ".join((question or "").split())
+    if not question:
+        return prompt
+
+    used = count_message_tokens(chat_messages(prompt + "\nQuestion: ", NAVIGATION_SYSTEM_PROMPT))
+    budget = min(settings.NAVIGATION_QUESTION_TOKENS, settings.NAVIGATION_INPUT_TOKENS - used)
+    return f"{prompt}\nQuestion: {truncate_tokens(question, budget)}"
+
+
+def chat_messages(prompt, system=None):
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    return messages
+
+
+# ----------------------------------------------------------
+# 2. TOKEN COUNTING
+# ----------------------------------------------------------
+# An estimate, so budgets can be enforced without a tokenizer download.
+# It errs high: about one token per short English word, one per 6
+# letters of longer ones, and one per 2 characters of Devanagari.
+
+TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+# Tokens the chat format adds around each message, and to prime the reply
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+
+def _piece_tokens(piece):
+    if piece.isascii():
+        return max(1, math.ceil(len(piece) / 6))
+    return math.ceil(len(piece) / 2)
+
+
+def count_tokens(text):
+    return sum(_piece_tokens(piece) for piece in TOKEN_PIECES.findall(text))
+
+
+def count_message_tokens(messages):
+    return REPLY_OVERHEAD + sum(
+        MESSAGE_OVERHEAD + count_tokens(message["content"]) for message in messages
+    )
+
+
+def truncate_tokens(text, budget):
+    """
+    The end of `text` that fits in `budget` tokens, marked with a leading
+    ellipsis if anything was cut. A rambling transcription usually ends
+    with the actual question, so the end is kept.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    budget -= 1  # The ellipsis
+    kept = len(text)
+    for match in reversed(list(TOKEN_PIECES.finditer(text))):
+        budget -= _piece_tokens(match.group())
+        if budget < 0:
+            break
+        kept = match.start()
+    return "…" + text[kept:]
+
+
+# ----------------------------------------------------------
+# 3. TOKEN METRICS
+# ----------------------------------------------------------
+
+class TokenUsage:
+    """
+    Input and output tokens of recent calls, per model. Counts come from
+    the response's usage when the upstream reports it, else the estimate.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.input = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.output = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def record(self, model, messages, response):
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "prompt_tokens", 0) or count_message_tokens(messages)
+        output_tokens = getattr(usage, "completion_tokens", 0) or count_tokens(
+            response.choices[0].message.content or ""
+        )
+        with self.lock:
+            self.calls[model] += 1
+            self.input[model].append(input_tokens)
+            self.output[model].append(output_tokens)
+
+    def stats(self):
+        with self.lock:
+            windows = {
+                model: (sorted(self.input[model]), sorted(self.output[model]))
+                for model in self.calls
+            }
+            calls = dict(self.calls)
+        return {
+            model: {
+                "calls": calls[model],
+                "input_mean": sum(input_tokens) / len(input_tokens),
+                "input_p95": _percentile(input_tokens, 0.95),
+                "output_mean": sum(output_tokens) / len(output_tokens),
+                "output_p95": _percentile(output_tokens, 0.95),
+            }
+            for model, (input_tokens, output_tokens) in windows.items()
+        }
+
+
+token_usage = TokenUsage()
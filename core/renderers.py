@@ -0,0 +1,70 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.json import strict_constant
+
+# Shortcuts for the high-rate location endpoints. Each handles the common
+# case itself and leaves anything else to the DRF class it extends, so
+# responses are byte-for-byte the same.
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer for plain JSON data, encoded by the json module's C encoder
+    without a custom encoder class. Data it can't encode (datetimes,
+    Decimals, ...), NaN and indented output go through JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or accepted_media_type != self.media_type or (
+            renderer_context and renderer_context.get("indent") is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = json.dumps(
+                data, ensure_ascii=self.ensure_ascii, allow_nan=not self.strict,
+                separators=(",", ":") if self.compact else (", ", ": "),
+            )
+        except (TypeError, ValueError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if "\u2028" in ret or "\u2029" in ret:
+            ret = ret.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+        return ret.encode()
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser reading the body in one go rather than through a codecs
+    stream reader. Errors are reported the same way.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        try:
+            return json.loads(
+                stream.read().decode(encoding),
+                parse_constant=strict_constant if self.strict else None,
+            )
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
+
+
+class FastContentNegotiation(DefaultContentNegotiation):
+    """
+    Requests with no query string and an Accept header of */*, the first
+    renderer's media type or none at all get the first renderer without
+    parsing the header.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        if not format_suffix and not request.META.get("QUERY_STRING") and (
+            request.META.get("HTTP_ACCEPT", "*/*") in ("*/*", renderer.media_type)
+        ):
+            return renderer, renderer.media_type
+        return super().select_renderer(request, renderers, format_suffix)
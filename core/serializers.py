@@ -1,3 +1,7 @@
+import math
+
+from django.utils import timezone
+
 from core.models import LocationHistory
 
 from rest_framework import serializers
@@ -6,4 +10,48 @@ from rest_framework import serializers
 class LocationHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = LocationHistory
-        fields = "__all__"
+        # The session comes from the request's token, not the payload
+        fields = ["id", "latitude", "longitude", "timestamp"]
+        read_only_fields = ["timestamp"]
+
+
+# Fast path for LocationHistorySerializer on a single posted fix, which
+# builds its fields from the model on every request. Only payloads it
+# can't fail on are handled here; everything else returns None and goes
+# through the serializer, so errors are reported the same way.
+LOCATION_FIX_FIELDS = ("latitude", "longitude")
+
+
+def parse_location_fix(data):
+    """
+    {"latitude": float, "longitude": float} from a JSON object with finite
+    numbers for both, or None.
+    """
+    if type(data) is not dict:
+        return None
+    fields = {}
+    for name in LOCATION_FIX_FIELDS:
+        value = data.get(name)
+        # bool is an int, and strings are parsed by the serializer
+        if type(value) is not float and type(value) is not int:
+            return None
+        value = float(value)
+        if not math.isfinite(value):
+            return None
+        fields[name] = value
+    return fields
+
+
+def location_data(location):
+    """
+    LocationHistorySerializer(location).data
+    """
+    timestamp = timezone.localtime(location.timestamp).isoformat()
+    if timestamp.endswith("+00:00"):
+        timestamp = timestamp[:-6] + "Z"
+    return {
+        "id": location.id,
+        "latitude": location.latitude,
+        "longitude": location.longitude,
+        "timestamp": timestamp,
+    }
@@ -0,0 +1,135 @@
+import functools
+import uuid
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+# Clients that don't present a token share this session, which keeps the
+# single-user demo app working unchanged, unless SESSION_TOKEN_REQUIRED
+DEFAULT_SESSION_ID = "default"
+
+SESSION_TOKEN_SALT = "core.sessions"
+SESSION_TOKEN_HEADER = "X-Session-Token"
+# The header as it appears in request.META; reading request.headers would
+# copy every header on each request
+SESSION_TOKEN_META = "HTTP_X_SESSION_TOKEN"
+SESSION_TOKEN_PARAM = "token"
+
+ACTIVE_SESSIONS_KEY = "active_sessions"
+ACTIVE_SESSION_TIMEOUT = 60 * 60
+
+
+def new_session():
+    """
+    Create a session id and the signed token a client presents for it.
+    """
+    session_id = uuid.uuid4().hex
+    return session_id, signing.dumps(session_id, salt=SESSION_TOKEN_SALT)
+
+
+# Tokens don't expire, so a verified one stays valid; clients send the
+# same token with every fix
+@functools.lru_cache(maxsize=10000)
+def load_session_token(token):
+    """
+    Return the session id signed into a token, or None if it is invalid.
+    """
+    try:
+        return signing.loads(token, salt=SESSION_TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def session_id_for_token(token):
+    if not token:
+        return None if settings.SESSION_TOKEN_REQUIRED else DEFAULT_SESSION_ID
+    return load_session_token(token)
+
+
+def get_request_session_id(request):
+    """
+    Session id for a REST request, from the X-Session-Token header or the
+    `token` query parameter. Returns None if the token is invalid, or
+    missing while SESSION_TOKEN_REQUIRED.
+    """
+    token = request.META.get(SESSION_TOKEN_META) or request.GET.get(
+        SESSION_TOKEN_PARAM
+    )
+    return session_id_for_token(token)
+
+
+def get_scope_session_id(scope):
+    """
+    Session id for a WebSocket connection, from the `token` query parameter.
+    Returns None if the token is invalid, or missing while
+    SESSION_TOKEN_REQUIRED.
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return session_id_for_token(query.get(SESSION_TOKEN_PARAM, [None])[0])
+
+
+def session_group_name(session_id):
+    return f"session_{session_id}"
+
+
+def session_key(session_id, name):
+    """
+    Cache key for a piece of per-session navigation state.
+    """
+    return f"{session_id}:{name}"
+
+
+def touch_session(session_id):
+    """
+    Mark a session as active. Only atomic cache operations (add, incr, touch)
+    are used, so workers sharing the cache don't overwrite each other.
+    """
+    member_key = f"{ACTIVE_SESSIONS_KEY}:member:{session_id}"
+    floor_key = f"{ACTIVE_SESSIONS_KEY}:floor"
+    found = cache.get_many([member_key, floor_key])
+    slot = found.get(member_key)
+    if slot is not None:
+        cache.touch(member_key, ACTIVE_SESSION_TIMEOUT)
+        # A slot of 0 is being registered by another request right now
+        if not slot:
+            return
+        if slot >= found.get(floor_key, 1) and cache.touch(
+            _active_slot_key(slot), ACTIVE_SESSION_TIMEOUT
+        ):
+            return
+        # The slot expired or was skipped; register the session again
+        cache.delete(member_key)
+
+    if cache.add(member_key, 0, timeout=ACTIVE_SESSION_TIMEOUT):
+        cache.add(f"{ACTIVE_SESSIONS_KEY}:count", 0, timeout=None)
+        slot = cache.incr(f"{ACTIVE_SESSIONS_KEY}:count")
+        cache.set(_active_slot_key(slot), session_id, timeout=ACTIVE_SESSION_TIMEOUT)
+        cache.set(member_key, slot, timeout=ACTIVE_SESSION_TIMEOUT)
+
+
+def active_sessions():
+    """
+    Session ids touched within ACTIVE_SESSION_TIMEOUT seconds.
+    """
+    count = cache.get(f"{ACTIVE_SESSIONS_KEY}:count", default=0)
+    floor = cache.get(f"{ACTIVE_SESSIONS_KEY}:floor", default=1)
+    slot_keys = [_active_slot_key(slot) for slot in range(floor, count + 1)]
+    found = cache.get_many(slot_keys)
+
+    # Skip expired slots before the oldest live one so later scans stay
+    # short; with none live, skip every slot scanned
+    new_floor = count + 1
+    if found:
+        new_floor = floor
+        while _active_slot_key(new_floor) not in found:
+            new_floor += 1
+    if new_floor != floor:
+        cache.set(f"{ACTIVE_SESSIONS_KEY}:floor", new_floor, timeout=None)
+
+    return [found[key] for key in slot_keys if key in found]
+
+
+def _active_slot_key(slot):
+    return f"{ACTIVE_SESSIONS_KEY}:slot:{slot}"
@@ -0,0 +1,336 @@
+import asyncio
+import collections
+import io
+import struct
+
+import av
+import numpy as np
+import webrtcvad
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+from core.model_calls import INTERACTIVE, model_scheduler
+
+# ----------------------------------------------------------
+# 1. AUDIO PARAMETERS
+# ----------------------------------------------------------
+
+RATE = 16000            # Sample rate Whisper and the VAD both work at
+CHUNK_DURATION_MS = 30  # Duration of a VAD frame in ms
+CHUNK_SIZE = int(RATE * CHUNK_DURATION_MS / 1000)  # Samples per VAD frame
+
+VAD_AGGRESSIVENESS = 2  # VAD aggressiveness (0-3). 3 is the most aggressive
+PADDING_MS = 300        # Audio kept on either side of detected speech
+TRIGGER_WINDOW = 10     # VAD frames considered when deciding speech started
+TRIGGER_RATIO = 0.9     # Share of speech frames in the window that triggers
+
+# Trimming a whole upload can look ahead, so its VAD is first run once over
+# the clip to learn the background before frames are classified. Without
+# that, the VAD's first second or so on a noisy clip reads as speech.
+TRIM_VAD_AGGRESSIVENESS = 3
+TRIM_TRIGGER_WINDOW = 5   # 150 ms, so a one-word answer still counts
+TRIM_TRIGGER_RATIO = 0.8
+
+OPUS_BIT_RATE = 24000   # Plenty for speech recognition
+
+ENDPOINT_SILENCE_MS = 700   # Silence after speech that ends an utterance
+MAX_UTTERANCE_MS = 30000    # Longest utterance buffered before it is cut
+
+# Timed out at the model's deadline (see MODEL_CALL_DEADLINES)
+client = OpenAI(timeout=settings.MODEL_CALL_DEADLINES["whisper-1"])
+async_client = AsyncOpenAI(timeout=settings.MODEL_CALL_DEADLINES["whisper-1"])
+
+_openai_slots = None
+
+
+def translate_speech(file, priority=INTERACTIVE, minutes=None):
+    """
+    Whisper translation of a clip to English. `file` is anything the OpenAI
+    client accepts, e.g. a (name, data, content_type) tuple. `priority` and
+    `minutes` (until departure) order the call in the model scheduler.
+
+    The plain response only has `text`; verbose_json adds `language` (the
+    language of the translation, so always English).
+    """
+    return model_scheduler.call(
+        "whisper-1",
+        priority,
+        client.audio.translations.create,
+        model="whisper-1",
+        file=file,
+        response_format="verbose_json",
+        minutes=minutes,
+    )
+
+
+def openai_slots():
+    """
+    Semaphore bounding concurrent async OpenAI requests at OPENAI_CONCURRENCY.
+    """
+    global _openai_slots
+    if _openai_slots is None:
+        _openai_slots = asyncio.Semaphore(settings.OPENAI_CONCURRENCY)
+    return _openai_slots
+
+
+async def atranslate_speech(file, priority=INTERACTIVE, minutes=None):
+    """
+    Async `translate_speech`, under the same scheduling, circuit breaker and
+    deadline, waiting for an OpenAI slot before the request goes out.
+    """
+    async def translate():
+        async with openai_slots():
+            return await async_client.audio.translations.create(
+                model="whisper-1",
+                file=file,
+                response_format="verbose_json",
+            )
+
+    return await model_scheduler.acall("whisper-1", priority, translate, minutes=minutes)
+
+
+# ----------------------------------------------------------
+# 2. DECODING & ENCODING
+# ----------------------------------------------------------
+
+def decode_pcm(audio_file):
+    """
+    Decode any container/codec PyAV understands into 16 kHz mono 16-bit PCM.
+    """
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=RATE)
+    chunks = []
+    with av.open(audio_file) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                chunks.append(out.to_ndarray().reshape(-1))
+    for out in resampler.resample(None):
+        chunks.append(out.to_ndarray().reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(chunks)
+
+
+def encode_opus(pcm, rate=RATE, bit_rate=OPUS_BIT_RATE):
+    """
+    Encode mono 16-bit PCM samples as Opus in an Ogg container.
+    """
+    out = io.BytesIO()
+    with av.open(out, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=rate)
+        stream.bit_rate = bit_rate
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+# ----------------------------------------------------------
+# 3. VOICE ACTIVITY TRIMMING
+# ----------------------------------------------------------
+
+def speech_bounds(pcm, vad=None):
+    """
+    Return (start, end) sample offsets spanning the detected speech plus
+    PADDING_MS on either side, or None if there is no speech at all.
+
+    The VAD is primed with one pass over the clip, then speech counts only
+    where TRIM_TRIGGER_RATIO of a TRIM_TRIGGER_WINDOW run of frames is
+    voiced, so clicks and codec start-up noise don't extend the clip.
+    """
+    vad = vad or webrtcvad.Vad(TRIM_VAD_AGGRESSIVENESS)
+    frames = [
+        pcm[i:i + CHUNK_SIZE].tobytes()
+        for i in range(0, len(pcm) - CHUNK_SIZE + 1, CHUNK_SIZE)
+    ]
+    for frame in frames:
+        vad.is_speech(frame, RATE)
+    flags = np.array([vad.is_speech(frame, RATE) for frame in frames], dtype=np.int32)
+    window = min(TRIM_TRIGGER_WINDOW, len(flags))
+    if window == 0:
+        return None
+
+    voiced = np.convolve(flags, np.ones(window, dtype=np.int32), mode="valid")
+    triggered = np.flatnonzero(voiced >= TRIM_TRIGGER_RATIO * window)
+    if not len(triggered):
+        return None
+
+    padding = int(RATE * PADDING_MS / 1000)
+    start = max(int(triggered[0]) * CHUNK_SIZE - padding, 0)
+    end = min((int(triggered[-1]) + window) * CHUNK_SIZE + padding, len(pcm))
+    return start, end
+
+
+def trim_silence(audio_file):
+    """
+    Decode a clip, cut leading and trailing non-speech, and re-encode it as
+    Opus. Returns the encoded bytes, or None if the clip couldn't be decoded
+    or holds no speech, in which case the original should be sent as-is.
+    """
+    try:
+        pcm = decode_pcm(audio_file)
+    except (av.error.FFmpegError, ValueError) as e:
+        print(f"Could not decode audio for trimming: {e}")
+        return None
+
+    bounds = speech_bounds(pcm)
+    if bounds is None:
+        return None
+    start, end = bounds
+    return encode_opus(pcm[start:end])
+
+
+# ----------------------------------------------------------
+# 4. STREAMING ENDPOINTING
+# ----------------------------------------------------------
+# Uplink WebSocket frames carrying live microphone audio:
+#
+#   header:  uint8 frame type (AUDIO_FRAME), uint8 codec
+#   payload: 16 kHz mono little-endian int16 PCM (CODEC_PCM) or one
+#            16 kHz mono Opus packet (CODEC_OPUS)
+#
+# A frame with an empty payload ends the current utterance immediately.
+
+AUDIO_FRAME = 0x02
+AUDIO_FRAME_HEADER = struct.Struct("<BB")
+CODEC_PCM = 0
+CODEC_OPUS = 1
+
+
+def parse_audio_frame(data):
+    """
+    Split an audio frame into (codec, payload). Raises ValueError if malformed.
+    """
+    if len(data) < AUDIO_FRAME_HEADER.size:
+        raise ValueError("Audio frame is too short.")
+    frame_type, codec = AUDIO_FRAME_HEADER.unpack_from(data)
+    if frame_type != AUDIO_FRAME:
+        raise ValueError(f"Not an audio frame: {frame_type:#x}")
+    if codec not in (CODEC_PCM, CODEC_OPUS):
+        raise ValueError(f"Unknown audio codec: {codec}")
+    payload = data[AUDIO_FRAME_HEADER.size:]
+    if codec == CODEC_PCM and len(payload) % 2:
+        raise ValueError("PCM payload must hold whole 16-bit samples.")
+    return codec, payload
+
+
+class Endpointer:
+    """
+    Push-based version of the VAD state machine in
+    sandbox/live_speech_translate_v1.py. Audio is fed in as it arrives
+    instead of being pulled from a busy-waiting generator, and each
+    utterance is returned as soon as ENDPOINT_SILENCE_MS of silence follows
+    it. Triggering uses the same windowed rule as `speech_bounds`.
+    """
+
+    def __init__(self, silence_ms=ENDPOINT_SILENCE_MS, max_utterance_ms=MAX_UTTERANCE_MS):
+        self.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+        self.silence_ms = silence_ms
+        self.max_frames = max_utterance_ms // CHUNK_DURATION_MS
+        self.padding_frames = PADDING_MS // CHUNK_DURATION_MS
+        self.triggered = False
+
+        self._pending = np.zeros(0, dtype=np.int16)  # Partial VAD frame
+        # Frames before the trigger, kept as pre-roll: (frame, is_speech)
+        self._recent = collections.deque(maxlen=TRIGGER_WINDOW + self.padding_frames)
+        self._frames = []
+        self._silent_ms = 0
+
+    def feed(self, pcm):
+        """
+        Add 16 kHz mono samples; return the list of utterances they completed.
+        """
+        samples = np.concatenate([self._pending, pcm])
+        whole = len(samples) // CHUNK_SIZE * CHUNK_SIZE
+        self._pending = samples[whole:]
+
+        utterances = []
+        for i in range(0, whole, CHUNK_SIZE):
+            utterance = self._push(samples[i:i + CHUNK_SIZE])
+            if utterance is not None:
+                utterances.append(utterance)
+        return utterances
+
+    def flush(self):
+        """
+        End the current utterance now. Returns it, or None if no speech
+        has started.
+        """
+        if not self.triggered:
+            self._recent.clear()
+            return None
+
+        # Keep PADDING_MS of the trailing silence, like `speech_bounds`
+        frames = self._frames
+        trailing = self._silent_ms // CHUNK_DURATION_MS - self.padding_frames
+        if trailing > 0:
+            frames = frames[:-trailing]
+
+        self.triggered = False
+        self._frames = []
+        self._silent_ms = 0
+        return np.concatenate(frames)
+
+    def _push(self, frame):
+        is_speech = self.vad.is_speech(frame.tobytes(), RATE)
+
+        if not self.triggered:
+            self._recent.append((frame, is_speech))
+            window = list(self._recent)[-TRIGGER_WINDOW:]
+            voiced = sum(speech for _, speech in window)
+            if len(window) == TRIGGER_WINDOW and voiced >= TRIGGER_RATIO * TRIGGER_WINDOW:
+                self.triggered = True
+                self._frames = [f for f, _ in self._recent]
+                self._recent.clear()
+                self._silent_ms = 0
+            return None
+
+        self._frames.append(frame)
+        if is_speech:
+            self._silent_ms = 0
+        else:
+            self._silent_ms += CHUNK_DURATION_MS
+
+        if self._silent_ms >= self.silence_ms or len(self._frames) >= self.max_frames:
+            return self.flush()
+        return None
+
+
+class SpeechStream:
+    """
+    Decodes one connection's audio frames and runs them through an Endpointer.
+    """
+
+    def __init__(self):
+        self.endpointer = Endpointer()
+        self._opus = None
+        self._resampler = None
+
+    def feed(self, codec, payload):
+        if codec == CODEC_PCM:
+            pcm = np.frombuffer(payload, dtype="<i2")
+        else:
+            pcm = self._decode_opus(payload)
+        return self.endpointer.feed(pcm)
+
+    def flush(self):
+        return self.endpointer.flush()
+
+    def _decode_opus(self, packet):
+        if self._opus is None:
+            self._opus = av.CodecContext.create("opus", "r")
+            self._opus.sample_rate = RATE
+            self._opus.layout = "mono"
+            self._resampler = av.AudioResampler(format="s16", layout="mono", rate=RATE)
+
+        chunks = [np.zeros(0, dtype=np.int16)]
+        try:
+            for frame in self._opus.decode(av.Packet(packet)):
+                for out in self._resampler.resample(frame):
+                    chunks.append(out.to_ndarray().reshape(-1))
+        except av.error.FFmpegError as e:
+            raise ValueError(f"Invalid Opus packet: {e}")
+        return np.concatenate(chunks)
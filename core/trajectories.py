@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone as django_timezone
+
+from core.models import LocationHistory, NavigationSession, Trip
+
+# ----------------------------------------------------------
+# 1. PATH ENCODING
+# ----------------------------------------------------------
+# A trip's fixes are stored as one polyline-encoded string (the Google
+# Maps algorithm): each fix is three zigzag varints of 5 bits per ASCII
+# character, the change in latitude and longitude in millionths of a
+# degree (~11 cm) and the change in time in milliseconds since the
+# previous fix. The first fix is relative to zero.
+
+COORD_SCALE = 1e6
+TIME_SCALE = 1000
+
+
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append((0x20 | (value & 0x1F)) + 63)
+        value >>= 5
+    out.append(value + 63)
+
+
+def encode_path(fixes):
+    """
+    Encode (lat, lng, unix seconds) fixes, oldest first, as bytes.
+    """
+    out = bytearray()
+    last_lat = last_lng = last_time = 0
+    for lat, lng, timestamp in fixes:
+        lat = round(lat * COORD_SCALE)
+        lng = round(lng * COORD_SCALE)
+        timestamp = round(timestamp * TIME_SCALE)
+        _encode_value(lat - last_lat, out)
+        _encode_value(lng - last_lng, out)
+        _encode_value(timestamp - last_time, out)
+        last_lat, last_lng, last_time = lat, lng, timestamp
+    return bytes(out)
+
+
+def decode_path(data):
+    """
+    Yield the (lat, lng, unix seconds) fixes of an encoded path one at a
+    time, without decoding the rest of it.
+    """
+    totals = [0, 0, 0]
+    field = shift = value = 0
+    for byte in data:
+        byte -= 63
+        value |= (byte & 0x1F) << shift
+        if byte & 0x20:
+            shift += 5
+            continue
+        totals[field] += ~(value >> 1) if value & 1 else value >> 1
+        shift = value = 0
+        if field == 2:
+            yield totals[0] / COORD_SCALE, totals[1] / COORD_SCALE, totals[2] / TIME_SCALE
+            field = 0
+        else:
+            field += 1
+    if field or shift:
+        raise ValueError("Truncated path")
+
+
+def trip_fixes(trip):
+    """
+    Yield a Trip's fixes as (lat, lng, datetime), oldest first.
+    """
+    for lat, lng, timestamp in decode_path(trip.path):
+        yield lat, lng, datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+# ----------------------------------------------------------
+# 2. ARCHIVAL
+# ----------------------------------------------------------
+
+def completed_sessions(idle_seconds, now=None):
+    """
+    Sessions with stored fixes, none of them newer than `idle_seconds`.
+    """
+    cutoff = (now or django_timezone.now()) - timedelta(seconds=idle_seconds)
+    return list(
+        LocationHistory.objects.values("session")
+        .annotate(last=Max("timestamp"))
+        .filter(last__lt=cutoff)
+        .values_list("session", "last")
+    )
+
+
+def archive_session(session_id, until):
+    """
+    Replace a session's fixes up to `until` with one Trip. Returns the Trip,
+    or None if there were no fixes.
+    """
+    with transaction.atomic():
+        rows = LocationHistory.objects.filter(session_id=session_id, timestamp__lte=until)
+        first = last = None
+        count = 0
+
+        def fixes():
+            nonlocal first, last, count
+            for lat, lng, timestamp in rows.order_by("timestamp", "id").values_list(
+                "latitude", "longitude", "timestamp"
+            ).iterator(chunk_size=settings.TRIP_ARCHIVE_CHUNK_SIZE):
+                first = first or timestamp
+                last = timestamp
+                count += 1
+                yield lat, lng, timestamp.timestamp()
+
+        path = encode_path(fixes())
+        if not count:
+            return None
+        # Fixes may belong to a session whose row was never created
+        NavigationSession.objects.get_or_create(id=session_id)
+        trip = Trip.objects.create(
+            session_id=session_id, started=first, ended=last, fix_count=count, path=path
+        )
+        rows.delete()
+    return trip
+
+
+def archive_completed_trips(idle_seconds=None, now=None):
+    """
+    Archive every session that has had no fixes for `idle_seconds`
+    (TRIP_IDLE_SECONDS by default). Returns the Trips created.
+    """
+    if idle_seconds is None:
+        idle_seconds = settings.TRIP_IDLE_SECONDS
+    trips = []
+    for session_id, last in completed_sessions(idle_seconds, now):
+        try:
+            trip = archive_session(session_id, last)
+        except Exception as e:
+            print(f"Failed to archive trip for session {session_id}: {e}")
+            continue
+        if trip is not None:
+            trips.append(trip)
+    return trips
@@ -0,0 +1,202 @@
+import hashlib
+import io
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from openai import OpenAI
+
+from core.model_calls import INTERACTIVE, model_scheduler
+from core.sessions import session_key
+from core.speech import RATE, decode_pcm, encode_opus
+
+# Timed out at the model's deadline (see MODEL_CALL_DEADLINES)
+client = OpenAI(timeout=settings.MODEL_CALL_DEADLINES["tts-1"])
+
+# Shared by every response in the process, so a burst of long answers
+# queues here instead of flooding the upstream
+tts_executor = ThreadPoolExecutor(
+    max_workers=settings.TTS_CONCURRENCY, thread_name_prefix="tts"
+)
+
+# ----------------------------------------------------------
+# 1. SPLITTING
+# ----------------------------------------------------------
+
+# A danda ends a Nepali sentence with or without a following space; Latin
+# punctuation only before whitespace, so "3.5" stays whole
+SENTENCE_END = re.compile(r"(?<=[।॥])\s*|(?<=[.!?])\s+")
+# Shorter fragments ("ठीक छ।") are not worth a request of their own
+MIN_SENTENCE_CHARS = 12
+
+
+def split_sentences(text):
+    sentences = []
+    for piece in SENTENCE_END.split(text.strip()):
+        if not piece:
+            continue
+        if sentences and len(sentences[-1]) < MIN_SENTENCE_CHARS:
+            sentences[-1] += " " + piece
+        else:
+            sentences.append(piece)
+    if len(sentences) > 1 and len(sentences[-1]) < MIN_SENTENCE_CHARS:
+        last = sentences.pop()
+        sentences[-1] += " " + last
+    return sentences
+
+
+def speech_parts(text, max_parts=None):
+    """
+    Split a response into at most `max_parts` texts to synthesize: the
+    first sentence on its own, so it can play as early as possible, then
+    the remaining sentences in groups of similar length.
+    """
+    max_parts = settings.TTS_MAX_PARTS if max_parts is None else max_parts
+    sentences = split_sentences(text)
+    if len(sentences) <= max_parts:
+        return sentences
+    if max_parts <= 1:
+        return [" ".join(sentences)]
+
+    rest = sentences[1:]
+    target = sum(len(sentence) for sentence in rest) / (max_parts - 1)
+    parts, group, size = [sentences[0]], [], 0
+    for sentence in rest:
+        group.append(sentence)
+        size += len(sentence)
+        if size >= target and len(parts) < max_parts - 1:
+            parts.append(" ".join(group))
+            group, size = [], 0
+    if group:
+        parts.append(" ".join(group))
+    return parts
+
+
+# ----------------------------------------------------------
+# 2. OUTPUT FORMATS
+# ----------------------------------------------------------
+# WebSocket clients list the codecs they can play, and optionally a
+# bitrate, when they connect: ?codecs=opus,aac,mp3&kbps=24. Each session
+# gets the smallest acceptable format; clients that say nothing get mp3.
+
+AudioFormat = namedtuple("AudioFormat", ["codec", "kbps"])
+
+# codec -> (response_format asked of the TTS, extension it is stored under).
+# The TTS sends Opus in Ogg; it is only re-encoded here for a client that
+# asked for a lower bitrate.
+CODECS = {
+    "opus": ("opus", "ogg"),
+    "aac": ("aac", "aac"),
+    "mp3": ("mp3", "mp3"),
+}
+# Smallest for speech first
+CODEC_PREFERENCE = ("opus", "aac", "mp3")
+DEFAULT_FORMAT = AudioFormat("mp3", None)
+OPUS_MIN_KBPS = 8
+
+
+def negotiate_format(codecs, kbps=None):
+    """
+    The first codec in CODEC_PREFERENCE the client accepts. Opus is sent
+    as the TTS encodes it unless the client asked for a bitrate, which is
+    capped at TTS_OPUS_KBPS.
+    """
+    for codec in CODEC_PREFERENCE:
+        if codec not in codecs:
+            continue
+        if codec != "opus" or kbps is None:
+            return AudioFormat(codec, None)
+        return AudioFormat(codec, max(OPUS_MIN_KBPS, min(kbps, settings.TTS_OPUS_KBPS)))
+    return DEFAULT_FORMAT
+
+
+def scope_audio_format(scope):
+    """
+    Format for a WebSocket connection from its `codecs` and `kbps` query
+    parameters, or None if it did not declare any.
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    codecs = query.get("codecs", [""])[0]
+    if not codecs:
+        return None
+    try:
+        kbps = int(query["kbps"][0])
+    except (KeyError, ValueError):
+        kbps = None
+    return negotiate_format([codec.strip().lower() for codec in codecs.split(",")], kbps)
+
+
+def set_session_audio_format(session_id, audio_format):
+    cache.set(session_key(session_id, "audio_format"), tuple(audio_format))
+
+
+def session_audio_format(session_id):
+    """
+    Format the session's client last declared. With several connections
+    on one session, the latest one wins.
+    """
+    found = cache.get(session_key(session_id, "audio_format"))
+    return DEFAULT_FORMAT if found is None else AudioFormat(*found)
+
+
+def audio_extension(audio_format):
+    return CODECS[audio_format.codec][1]
+
+
+# ----------------------------------------------------------
+# 3. SYNTHESIS
+# ----------------------------------------------------------
+
+def _audio_cache_key(text, audio_format):
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return f"tts:{audio_format.codec}:{audio_format.kbps}:{digest}"
+
+
+def synthesize(text, priority=INTERACTIVE, minutes=None, audio_format=DEFAULT_FORMAT):
+    """
+    Audio for `text` from a single TTS request, or from the cache if the
+    same text was recently synthesized in the same format. Raises
+    ModelCallFailed.
+    """
+    key = _audio_cache_key(text, audio_format)
+    audio = caches["audio"].get(key)
+    if audio is not None:
+        return audio
+
+    response = model_scheduler.call(
+        "tts-1",
+        priority,
+        client.audio.speech.create,
+        minutes=minutes,
+        model="tts-1",
+        voice="nova",
+        input=text,
+        response_format=CODECS[audio_format.codec][0],
+    )
+    audio = response.content
+    if audio_format.codec == "opus" and audio_format.kbps is not None:
+        audio = encode_opus(decode_pcm(io.BytesIO(audio)), RATE, audio_format.kbps * 1000)
+    caches["audio"].set(key, audio, timeout=settings.TTS_CACHE_TIMEOUT)
+    return audio
+
+
+def synthesize_in_order(texts, priority=INTERACTIVE, minutes=None,
+                        audio_format=DEFAULT_FORMAT):
+    """
+    Synthesize the texts concurrently and yield their audio in order, each
+    as soon as it and every part before it is ready. Raises
+    ModelCallFailed when a part fails; the parts after it are abandoned.
+    """
+    futures = [
+        tts_executor.submit(synthesize, text, priority, minutes, audio_format)
+        for text in texts
+    ]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
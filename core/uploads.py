@@ -0,0 +1,153 @@
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, close_old_connections
+
+from core.models import AudioFile
+from core.speech import trim_silence
+
+# Archival copies of uploads are written off the request path
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-archive")
+
+
+class DetachedUpload(File):
+    """
+    A spooled upload hard-linked away from Django's temporary file, which is
+    deleted when the request finishes. Storage moves it rather than copying.
+    """
+
+    def __init__(self, path, name):
+        super().__init__(open(path, "rb"), name=name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def upload_hash(uploaded_file):
+    """
+    sha256 of an upload, read in chunks from wherever Django buffered it.
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def cached_transcription(content_hash):
+    """
+    (text, language) already produced for this content, or None. Falls back
+    to the archived AudioFile when the cache entry has expired.
+    """
+    cached = caches["audio"].get(_transcription_key(content_hash))
+    if cached is not None:
+        return cached
+
+    archived = (
+        AudioFile.objects.filter(content_hash=content_hash)
+        .values_list("translation", "language")
+        .first()
+    )
+    if archived is not None:
+        cache_transcription(content_hash, *archived)
+    return archived
+
+
+async def acached_transcription(content_hash):
+    cached = await caches["audio"].aget(_transcription_key(content_hash))
+    if cached is not None:
+        return cached
+
+    archived = await (
+        AudioFile.objects.filter(content_hash=content_hash)
+        .values_list("translation", "language")
+        .afirst()
+    )
+    if archived is not None:
+        await acache_transcription(content_hash, *archived)
+    return archived
+
+
+def cache_transcription(content_hash, text, language):
+    caches["audio"].set(
+        _transcription_key(content_hash),
+        (text, language),
+        timeout=settings.TRANSCRIPTION_CACHE_TIMEOUT,
+    )
+
+
+async def acache_transcription(content_hash, text, language):
+    await caches["audio"].aset(
+        _transcription_key(content_hash),
+        (text, language),
+        timeout=settings.TRANSCRIPTION_CACHE_TIMEOUT,
+    )
+
+
+def _transcription_key(content_hash):
+    return f"transcription:{content_hash}"
+
+
+def transcription_file(uploaded_file):
+    """
+    (name, file, content_type) for the OpenAI client. With VAD_TRIM_UPLOADS
+    this is the clip with silence cut and re-encoded as Opus; otherwise, or
+    if that doesn't make it smaller, the upload is streamed from wherever
+    Django buffered it: memory for small files, a spooled temporary file for
+    large ones (FILE_UPLOAD_MAX_MEMORY_SIZE).
+    """
+    if settings.VAD_TRIM_UPLOADS:
+        uploaded_file.seek(0)
+        trimmed = trim_silence(uploaded_file.file)
+        if trimmed is not None and len(trimmed) < uploaded_file.size:
+            name = f"{os.path.splitext(uploaded_file.name)[0]}.ogg"
+            return (name, trimmed, "audio/ogg")
+
+    uploaded_file.seek(0)
+    return (uploaded_file.name, uploaded_file.file, uploaded_file.content_type)
+
+
+def archive_upload(uploaded_file, translation, language="", content_hash=None):
+    """
+    Save the AudioFile copy of an upload in the background.
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        temp_path = uploaded_file.temporary_file_path()
+        link_path = os.path.join(os.path.dirname(temp_path), f"{uuid.uuid4().hex}.upload")
+        os.link(temp_path, link_path)
+        content = DetachedUpload(link_path, uploaded_file.name)
+    else:
+        content = ContentFile(uploaded_file.file.getvalue(), name=uploaded_file.name)
+
+    return archive_executor.submit(
+        save_archive, content, translation, language, content_hash
+    )
+
+
+def save_archive(content, translation, language="", content_hash=None):
+    audio_file = AudioFile(
+        translation=translation, language=language, content_hash=content_hash
+    )
+    try:
+        audio_file.file.save(content.name, content, save=True)
+    except IntegrityError:
+        # A concurrent retry of the same upload was archived first
+        audio_file.file.delete(save=False)
+    except Exception as e:
+        print(f"Failed to archive audio upload {content.name}: {e}")
+    finally:
+        if isinstance(content, DetachedUpload):
+            content.discard()
+        close_old_connections()
@@ -1,12 +1,30 @@
+from django.conf import settings
 from django.urls import include, path
-from .views import AudioViewSet, LocationHistoryViewSet, GPSViewSet
+from .views import (
+    AudioViewSet, LocationHistoryViewSet, GPSViewSet, ModelCallViewSet, SessionViewSet
+)
 from rest_framework.routers import DefaultRouter, SimpleRouter
 
+from core import async_views
+
 router = DefaultRouter()
 
+router.register(r"sessions", SessionViewSet, basename="sessions")
 router.register(r"audio", AudioViewSet, basename="audio")
+router.register(r"model-calls", ModelCallViewSet, basename="model-calls")
 router.register(
     r"location-history", LocationHistoryViewSet, basename="location-history"
 )
 app_name = "core"
 urlpatterns = [] + router.urls
+
+# The async views take over the OpenAI-bound list routes
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+        path("audio/", async_views.audio, name="audio-list"),
+        path(
+            "location-history/",
+            async_views.location_history,
+            name="location-history-list",
+        ),
+    ] + urlpatterns
@@ -6,18 +6,67 @@ from django.core.files.storage import FileSystemStorage
 from django.core.cache import cache
 from django.conf import settings
 from rest_framework.response import Response
+from rest_framework import status
 
 # Create your views here.
 from rest_framework import viewsets, mixins
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 
-from core.models import LocationHistory
-from core.serializers import LocationHistorySerializer
+from core.models import LocationHistory, NavigationSession
+from core.renderers import FastContentNegotiation, FastJSONParser, FastJSONRenderer
+from core.serializers import LocationHistorySerializer, location_data, parse_location_fix
 from core.models import AudioFile
-from openai import OpenAI
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from core.feedback import feedback_beat
-client = OpenAI()
+from core.feedback import session_call_priority, set_user_input
+from core.locations import (
+    aiterate, export_geojson, export_ndjson, filter_locations, fix_rings,
+    parse_location_batch, process_location_fixes, queue_location, recent_fixes,
+    save_location_fixes,
+)
+from core.model_calls import ModelCallFailed, model_scheduler
+from core.prompts import token_usage
+from core.speech import translate_speech
+from core.uploads import (
+    archive_upload, cache_transcription, cached_transcription, transcription_file,
+    upload_hash,
+)
+from core.sessions import get_request_session_id, new_session, session_key, touch_session
+
+
+def invalid_session_response():
+    return Response(
+        {"detail": "Invalid session token."}, status=status.HTTP_403_FORBIDDEN
+    )
+
+
+def model_unavailable_response(model):
+    return Response(
+        {"detail": "Speech translation is unavailable, please try again shortly."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(model_scheduler.retry_after(model))},
+    )
+
+
+class SessionViewSet(viewsets.ViewSet):
+    def create(self, request):
+        """
+        Start a navigation session. The returned token identifies the client
+        on REST calls (X-Session-Token header) and on the WebSocket (?token=).
+        """
+        session_id, token = new_session()
+        NavigationSession.objects.create(id=session_id)
+        touch_session(session_id)
+        return Response(
+            {"session_id": session_id, "token": token},
+            status=status.HTTP_201_CREATED,
+        )
 
 class AudioViewSet(viewsets.ViewSet):
     def list(self, request):
@@ -28,29 +77,40 @@ class AudioViewSet(viewsets.ViewSet):
         """
         Speech audio file posted
         """
+        session_id = get_request_session_id(request)
+        if session_id is None:
+            return invalid_session_response()
+        touch_session(session_id)
+
         # get file from request
         print(request.FILES)
         uploaded_file = request.FILES["file"]
-        AudioFile.objects.create(file=uploaded_file)
 
-        temp_storage = FileSystemStorage(location=settings.MEDIA_ROOT)
-        file_path = temp_storage.save(f"temp/{uploaded_file.name}", uploaded_file)
-        full_path = os.path.join(settings.MEDIA_ROOT, file_path)
+        # Retried uploads are answered from the cache without calling
+        # Whisper or archiving another copy
+        content_hash = upload_hash(uploaded_file)
+        cached = cached_transcription(content_hash)
+        if cached is not None:
+            text, language = cached
+            set_user_input(session_id, text, language)
+            return Response({"message": "Audio Received."})
 
-        with open(full_path, "rb") as f:
-            response = client.audio.translations.create(
-                model="whisper-1",
-                file=f,
-            )
+        # Stream the upload straight from Django's buffer
+        priority, minutes = session_call_priority(session_id)
+        try:
+            response = translate_speech(transcription_file(uploaded_file), priority, minutes)
+        except ModelCallFailed as e:
+            print(f"Speech translation failed: {e}")
+            return model_unavailable_response("whisper-1")
 
         print(response.text)
 
         # Save user input in cache
-        cache.set("user_input_text", response.text, timeout=30)
-        cache.set("user_input_lang", response.language, timeout=30)
+        set_user_input(session_id, response.text, response.language)
+        cache_transcription(content_hash, response.text, response.language)
 
-        # Clean up: Remove the temporary file
-        temp_storage.delete(file_path)
+        # The archival copy is written in the background
+        archive_upload(uploaded_file, response.text, response.language, content_hash)
 
         # print(request.data)
         # print(request.FILES)
@@ -60,6 +120,27 @@ class AudioViewSet(viewsets.ViewSet):
         return Response({"message": "Audio Received."})
 
 
+class ModelCallViewSet(viewsets.ViewSet):
+    def list(self, request):
+        """
+        Model scheduler queue wait per priority class, and tokens per call
+        """
+        return Response({**model_scheduler.stats(), "tokens": token_usage.stats()})
+
+
+class LocationCursorPagination(CursorPagination):
+    ordering = ("timestamp", "id")
+    page_size = settings.LOCATION_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.LOCATION_MAX_PAGE_SIZE
+
+
+LOCATION_EXPORTS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "geojson": (export_geojson, "application/geo+json"),
+}
+
+
 class LocationHistoryViewSet(
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
@@ -67,14 +148,57 @@ class LocationHistoryViewSet(
 ):
     queryset = LocationHistory.objects.all()
     serializer_class = LocationHistorySerializer
+    pagination_class = LocationCursorPagination
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    content_negotiation_class = FastContentNegotiation
+
+    def get_queryset(self):
+        """
+        Fixes filtered by ?session=, ?since= and ?until=
+        """
+        try:
+            return filter_locations(super().get_queryset(), self.request.query_params)
+        except ValueError as e:
+            raise ParseError(str(e))
 
     def create(self, request, *args, **kwargs):
-        response = super().create(request, *args, **kwargs)
+        session_id = get_request_session_id(request)
+        if session_id is None:
+            return invalid_session_response()
+        touch_session(session_id)
+
+        # Well-formed JSON fixes skip the serializer. The browsable API keeps
+        # it, since its forms read the serializer off the response data.
+        fields = None
+        if request.accepted_renderer.format == "json":
+            fields = parse_location_fix(request.data)
+        if fields is None:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            fields = serializer.validated_data
+            if settings.LOCATION_WRITE_BEHIND:
+                serializer.instance = queue_location(session_id, **fields)
+            else:
+                serializer.save(session_id=session_id)
+            data = serializer.data
+        elif settings.LOCATION_WRITE_BEHIND:
+            data = location_data(queue_location(session_id, **fields))
+        else:
+            data = location_data(LocationHistory.objects.create(session_id=session_id, **fields))
+        response = Response(
+            data,
+            status=status.HTTP_201_CREATED,
+            headers=self.get_success_headers(data),
+        )
         # room_name = "room1"
         # file_path = "/Users/anepal/workspace/navpal-backend/audio_recording.m4a"
         # Notify the WebSocket consumer
         # channel_layer = get_channel_layer()
-        feedback_beat()
+        # The client schedules its next fix by this
+        response.data["next_fix_seconds"] = process_location_fixes(
+            session_id, [(response.data["latitude"], response.data["longitude"])]
+        )
 
         # async_to_sync(channel_layer.group_send)(
         #     f"file_transfer_{room_name}",
@@ -82,6 +206,49 @@ class LocationHistoryViewSet(
         # )
         return response
 
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Every matching fix, streamed oldest first as NDJSON, or as GeoJSON
+        with ?type=geojson. Takes the same filters as the list.
+        """
+        kind = request.query_params.get("type", "ndjson")
+        if kind not in LOCATION_EXPORTS:
+            raise ParseError(f"type must be one of {', '.join(LOCATION_EXPORTS)}")
+        export, content_type = LOCATION_EXPORTS[kind]
+        chunks = export(self.get_queryset())
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+        return StreamingHttpResponse(chunks, content_type=content_type)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Fixes buffered offline, replayed as one array. They are saved before
+        the response, so the client may drop them once it gets a 201, and
+        navigation evaluates them as one batch.
+        """
+        session_id = get_request_session_id(request)
+        if session_id is None:
+            return invalid_session_response()
+        touch_session(session_id)
+
+        try:
+            fixes = parse_location_batch(request.data)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        save_location_fixes(session_id, fixes)
+        interval = process_location_fixes(
+            session_id,
+            [(fix.lat, fix.lng) for fix in fixes],
+            [fix.timestamp for fix in fixes],
+        )
+        return Response(
+            {"received": len(fixes), "next_fix_seconds": interval},
+            status=status.HTTP_201_CREATED,
+        )
+
 
 class GPSViewSet(viewsets.ViewSet):
     def list(self, request):
@@ -92,16 +259,16 @@ class GPSViewSet(viewsets.ViewSet):
         """
         Updated user location posted, added
         """
+        session_id = get_request_session_id(request)
+        if session_id is None:
+            return invalid_session_response()
+
         # get file from request
         print(request.data)
         print(request.FILES)
 
-        recent_entries = LocationHistory.objects.order_by('-timestamp')[:2]
-        recent_coords = [
-            (entry.latitude, entry.longitude)
-            for entry in recent_entries
-        ]
-        cache.set("recent_coords", recent_coords, timeout=10)
+        recent_coords = fix_rings.latest(session_id) or recent_fixes(session_id)
+        cache.set(session_key(session_id, "recent_coords"), recent_coords, timeout=10)
 
         for filename, file in request.FILES.iteritems():
             name = request.FILES[filename].name
@@ -0,0 +1,139 @@
+"""
+Concurrent voice queries against Daphne with the sync DRF AudioViewSet
+(ASYNC_VIEWS=0) and the async view (ASYNC_VIEWS=1). Every query uploads a
+distinct clip, so none is answered from the transcription cache, and
+Whisper is fake_openai_server.py with a fixed latency. Daphne runs with
+sandbox/bench_settings.py, on a throwaway database. Run from the repo root:
+
+    python sandbox/bench_async_views.py --concurrency 50 200 --latency-ms 1000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+PORT = 8110
+FAKE_OPENAI_PORT = 8905
+
+
+def wait_for_port(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=5)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_daphne(async_views, env):
+    env = dict(env, ASYNC_VIEWS="1" if async_views else "0")
+    daphne = subprocess.Popen(
+        [sys.executable, "-m", "daphne", "-p", str(PORT), "server.asgi:application"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(f"http://127.0.0.1:{PORT}/api/")
+    return daphne
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def sample_process(pid, peak):
+    """
+    Track the peak thread count and RSS (KiB) of the Daphne process.
+    """
+    while True:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f.read().splitlines())
+        peak["threads"] = max(peak["threads"], int(fields["Threads"]))
+        peak["rss"] = max(peak["rss"], int(fields["VmRSS"].split()[0]))
+        await asyncio.sleep(0.05)
+
+
+async def voice_queries(concurrency, clip, pid):
+    url = f"http://127.0.0.1:{PORT}/api/audio/"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as http:
+
+        async def query(i):
+            payload = clip + os.urandom(8)
+            start = time.perf_counter()
+            response = await http.post(
+                url, files={"file": (f"clip{i}.m4a", payload, "audio/mp4")}
+            )
+            assert response.status_code == 200, response.text
+            return time.perf_counter() - start
+
+        peak = {"threads": 0, "rss": 0}
+        sampler = asyncio.create_task(sample_process(pid, peak))
+        cpu = cpu_seconds(pid)
+        start = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(query(i) for i in range(concurrency))))
+        wall = time.perf_counter() - start
+        peak["cpu"] = (cpu_seconds(pid) - cpu) / concurrency
+        sampler.cancel()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    return wall, p50, p99, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--latency-ms", type=float, default=1000)
+    parser.add_argument("--vad-trim", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="sandbox.bench_settings",
+        BENCH_DB=os.path.join(workdir, "bench.sqlite3"),
+        BENCH_MEDIA_ROOT=os.path.join(workdir, "media"),
+        BENCH_VAD_TRIM="1" if args.vad_trim else "0",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{FAKE_OPENAI_PORT}/v1",
+    )
+    subprocess.run(
+        [sys.executable, "manage.py", "migrate", "-v", "0"], cwd=ROOT, env=env, check=True
+    )
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", str(FAKE_OPENAI_PORT), "--latency-ms", str(args.latency_ms)],
+        stdout=subprocess.DEVNULL)
+    clip = open(os.path.join(ROOT, "audio_recording.m4a"), "rb").read()
+
+    print(f"{'mode':>6} {'clients':>8} {'wall s':>8} {'queries/s':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'CPU ms/q':>9} {'threads':>8} {'RSS MiB':>8}")
+    try:
+        for async_views in (False, True):
+            daphne = start_daphne(async_views, env)
+            try:
+                for concurrency in args.concurrency:
+                    wall, p50, p99, peak = asyncio.run(
+                        voice_queries(concurrency, clip, daphne.pid)
+                    )
+                    print(f"{'async' if async_views else 'sync':>6} {concurrency:>8} "
+                          f"{wall:>8.2f} {concurrency / wall:>10.1f} "
+                          f"{p50 * 1000:>8.0f} {p99 * 1000:>8.0f} "
+                          f"{peak['cpu'] * 1000:>9.1f} "
+                          f"{peak['threads']:>8} {peak['rss'] / 1024:>8.0f}")
+            finally:
+                daphne.terminate()
+                daphne.wait()
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+A client that reads audio slower than it is sent, against Daphne. It asks
+for the sample clip (audio_recording.m4a, ~77 KB) --requests times, one
+every --every seconds, while reading at --kbps through a small socket
+receive buffer. Reports how many responses reached it, how long after the
+last request the last response finished, and the peak RSS of the Daphne
+process. The client connects with acks=1 and acks the audio bytes it has
+read. It answers Daphne's pings, but a pong can only go out once the ping
+has been read.
+
+With an unlimited window (BENCH_AUDIO_SEND_WINDOW very large) the sender
+never waits, so every response is written into Daphne's buffer at once
+and none is ever dropped. With AUDIO_SEND_WINDOW_BYTES the sender waits
+for the client's acks, responses queue in the consumer and the stalest
+are dropped. Run from the repo root:
+
+    python sandbox/bench_audio_backpressure.py --requests 20 --every 0.5 --kbps 512
+"""
+import argparse
+import base64
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8131
+
+
+def wait_for_port(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_daphne(send_window, workdir):
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="sandbox.bench_settings",
+        BENCH_DB=os.path.join(workdir, "bench.sqlite3"),
+        BENCH_MEDIA_ROOT=os.path.join(workdir, "media"),
+        BENCH_AUDIO_SEND_WINDOW=str(send_window),
+    )
+    daphne = subprocess.Popen(
+        [sys.executable, "-m", "daphne", "-p", str(PORT), "server.asgi:application"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(f"http://127.0.0.1:{PORT}/api/")
+    return daphne
+
+
+def rss_kib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def client_frame(opcode, payload):
+    # Client frames are masked; a zero mask leaves the payload as it is
+    return struct.pack("!BB", 0x80 | opcode, 0x80 | len(payload)) + bytes(4) + payload
+
+
+def read_frames(buffer):
+    """
+    Split complete server frames off the buffer: ([(opcode, payload)], rest).
+    """
+    frames = []
+    while len(buffer) >= 2:
+        opcode, length = buffer[0] & 0x0F, buffer[1] & 0x7F
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                break
+            length, offset = struct.unpack("!H", buffer[2:4])[0], 4
+        elif length == 127:
+            if len(buffer) < 10:
+                break
+            length, offset = struct.unpack("!Q", buffer[2:10])[0], 10
+        if len(buffer) < offset + length:
+            break
+        frames.append((opcode, buffer[offset:offset + length]))
+        buffer = buffer[offset + length:]
+    return frames, buffer
+
+
+def slow_client(count, every, kbps, settle):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+    sock.connect(("127.0.0.1", PORT))
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((
+        f"GET /ws/voice-assistant/?acks=1 HTTP/1.1\r\nHost: 127.0.0.1:{PORT}\r\n"
+        "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+    ).encode())
+    response = b""
+    while b"\r\n\r\n" not in response:
+        response += sock.recv(1024)
+    buffer = response.split(b"\r\n\r\n", 1)[1]
+
+    start = time.perf_counter()
+    sent = 0
+    completed, finished = 0, None
+    received = 0
+    audio_bytes = 0
+    reset = False
+    while True:
+        now = time.perf_counter() - start
+        while sent < count and now >= sent * every:
+            sock.sendall(client_frame(1, b"send_audio_file"))
+            sent += 1
+        sock.settimeout(every if sent < count else settle)
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            if sent < count:
+                continue
+            break
+        except ConnectionResetError:
+            # Its pongs were stuck behind the audio, so Daphne timed it out
+            reset = True
+            break
+        if not data:
+            break
+        received += len(data)
+        buffer += data
+        frames, buffer = read_frames(buffer)
+        for opcode, payload in frames:
+            if opcode == 9:
+                # Daphne drops clients that don't answer its pings
+                sock.sendall(client_frame(10, payload))
+            elif opcode == 2:
+                audio_bytes += len(payload)
+                ack = f'{{"type": "audio_ack", "bytes": {audio_bytes}}}'
+                sock.sendall(client_frame(1, ack.encode()))
+            elif opcode == 1 and b'"audio_end"' in payload:
+                completed += 1
+                finished = time.perf_counter() - start
+        # Read no faster than the client's link
+        behind = received / (kbps * 128) - (time.perf_counter() - start)
+        if behind > 0:
+            time.sleep(behind)
+    sock.close()
+    return completed, finished - (count - 1) * every, reset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--every", type=float, default=0.5)
+    parser.add_argument("--kbps", type=float, default=512)
+    parser.add_argument("--settle", type=float, default=3, help="idle seconds that end a run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    print(f"{args.requests} responses, one every {args.every} s, to a "
+          f"{args.kbps:.0f} kbps client")
+    print(f"{'send window':>14} {'delivered':>10} {'last lag s':>11} {'peak RSS MiB':>13}")
+    for name, send_window in (("unlimited", 1 << 40), ("256 KiB", 256 * 1024)):
+        daphne = start_daphne(send_window, workdir)
+        try:
+            idle = rss_kib(daphne.pid)
+            completed, finished, reset = slow_client(
+                args.requests, args.every, args.kbps, args.settle
+            )
+            peak = 0
+            with open(f"/proc/{daphne.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = int(line.split()[1])
+        finally:
+            daphne.terminate()
+            daphne.wait()
+        print(f"{name:>14} {completed:>4}/{args.requests:<5} {finished:>11.1f} "
+              f"{peak / 1024:>13.0f}   (idle {idle / 1024:.0f})"
+              + ("  connection reset" if reset else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Retried voice uploads: latency, Whisper calls and archived copies when the
+same clip is POSTed several times, as clients do on flaky Wi-Fi. Whisper is
+served by fake_openai_server.py. Run from the repo root:
+
+    python sandbox/bench_audio_dedup.py --clips 10 --retries 3
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8903/v1"
+
+import django
+
+django.setup()
+
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIRequestFactory
+
+from core import speech, views
+from core.models import AudioFile
+from core.uploads import archive_executor
+
+whisper_calls = 0
+translate_speech = speech.translate_speech
+
+
+def counting_translate_speech(file, *args):
+    global whisper_calls
+    whisper_calls += 1
+    return translate_speech(file, *args)
+
+
+views.translate_speech = counting_translate_speech
+
+
+def post(view, name, payload):
+    request = APIRequestFactory().post(
+        "/api/audio/",
+        {"file": SimpleUploadedFile(name, payload, "audio/mp4")},
+        format="multipart",
+    )
+    start = time.perf_counter()
+    response = view(request)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clips", type=int, default=10)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8903", "--latency-ms", str(args.latency_ms)],
+        stdout=subprocess.DEVNULL)
+    time.sleep(1)
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    caches["audio"].clear()
+    clip = open(os.path.join(ROOT, "audio_recording.m4a"), "rb").read()
+    view = views.AudioViewSet.as_view({"post": "create"})
+    first, retried = [], []
+    try:
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            for i in range(args.clips):
+                # Distinct clips: the same recording with a different tail
+                payload = clip + i.to_bytes(4, "little")
+                first.append(post(view, f"clip{i}.m4a", payload))
+                archive_executor.submit(lambda: None).result()
+                for _ in range(args.retries):
+                    retried.append(post(view, f"clip{i}.m4a", payload))
+            archive_executor.submit(lambda: None).result()
+            archived = AudioFile.objects.count()
+    finally:
+        fake.terminate()
+
+    uploads = args.clips * (1 + args.retries)
+    print(f"uploads          {uploads}")
+    print(f"whisper calls    {whisper_calls}")
+    print(f"AudioFile rows   {archived}")
+    print(f"first p50        {statistics.median(first) * 1000:.1f} ms")
+    print(f"retry p50        {statistics.median(retried) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Throughput of delivering synthesized audio to many concurrent sessions.
+
+Compares the old approach (every response written to one shared nova.mp3 and
+read back by path) with the content-addressed AudioStore passed by handle.
+Run from the repo root:
+
+    python sandbox/bench_audio_store.py --sessions 64 --responses 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from core.audio_store import AudioStore
+
+
+def make_response(session, i, size):
+    # Distinct payload per session/response so corruption is detectable
+    header = f"{session}:{i}:".encode()
+    return header + os.urandom(size - len(header))
+
+
+def run_shared_file(sessions, responses, size, workdir):
+    path = os.path.join(workdir, "nova.mp3")
+    corrupted = 0
+    lock = threading.Lock()
+
+    def session_worker(session):
+        nonlocal corrupted
+        for i in range(responses):
+            data = make_response(session, i, size)
+            with open(path, "wb") as f:
+                f.write(data)
+            with open(path, "rb") as f:
+                received = f.read()
+            if received != data:
+                with lock:
+                    corrupted += 1
+
+    return run_threads(session_worker, sessions), corrupted
+
+
+def run_audio_store(sessions, responses, size, workdir, max_memory_bytes):
+    store = AudioStore(
+        max_memory_bytes=max_memory_bytes,
+        spool_dir=os.path.join(workdir, "spool"),
+        linger_seconds=0,
+    )
+    corrupted = 0
+    lock = threading.Lock()
+
+    def session_worker(session):
+        nonlocal corrupted
+        for i in range(responses):
+            data = make_response(session, i, size)
+            # Producer side: put, hand off the handle, drop its reference
+            handle = store.put(data)
+            # Consumer side: retain, read, release after delivery
+            store.retain(handle)
+            store.release(handle)
+            received = store.read(handle)
+            store.release(handle)
+            if received != data:
+                with lock:
+                    corrupted += 1
+
+    elapsed = run_threads(session_worker, sessions)
+    # Trigger a final sweep so nothing is left behind
+    store.release(store.put(b"sweep"))
+    return elapsed, corrupted, len(store)
+
+
+def run_threads(target, sessions):
+    threads = [threading.Thread(target=target, args=(s,)) for s in range(sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--responses", type=int, default=50)
+    parser.add_argument("--size", type=int, default=24 * 1024)
+    args = parser.parse_args()
+
+    total = args.sessions * args.responses
+    with tempfile.TemporaryDirectory() as workdir:
+        elapsed, corrupted = run_shared_file(
+            args.sessions, args.responses, args.size, workdir)
+        print(f"shared nova.mp3:   {total / elapsed:9.0f} responses/s, "
+              f"{corrupted}/{total} corrupted")
+
+        elapsed, corrupted, left = run_audio_store(
+            args.sessions, args.responses, args.size, workdir,
+            max_memory_bytes=args.size)
+        print(f"store (memory):    {total / elapsed:9.0f} responses/s, "
+              f"{corrupted}/{total} corrupted, {left} entries left")
+
+        elapsed, corrupted, left = run_audio_store(
+            args.sessions, args.responses, args.size, workdir,
+            max_memory_bytes=0)
+        print(f"store (spooled):   {total / elapsed:9.0f} responses/s, "
+              f"{corrupted}/{total} corrupted, {left} entries left")
+
+
+if __name__ == "__main__":
+    main()
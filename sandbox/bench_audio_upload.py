@@ -0,0 +1,126 @@
+"""
+Latency and disk I/O of AudioViewSet.create: the old path (save AudioFile,
+save a second copy to media/temp, re-open it for Whisper, delete it) versus
+streaming the upload buffer to Whisper and archiving in the background.
+Whisper is served by fake_openai_server.py. I/O is read from
+/proc/self/task/<tid>/io for the request thread only. Run from the repo root:
+
+    python sandbox/bench_audio_upload.py --requests 50
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8901/v1"
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from core import speech, views
+from core.models import AudioFile
+from core.sessions import session_key
+from core.uploads import archive_executor
+
+
+class LegacyAudioViewSet(views.AudioViewSet):
+    def create(self, request):
+        uploaded_file = request.FILES["file"]
+        AudioFile.objects.create(file=uploaded_file)
+
+        temp_storage = FileSystemStorage(location=settings.MEDIA_ROOT)
+        file_path = temp_storage.save(f"temp/{uploaded_file.name}", uploaded_file)
+        full_path = os.path.join(settings.MEDIA_ROOT, file_path)
+
+        with open(full_path, "rb") as f:
+            response = speech.client.audio.translations.create(model="whisper-1", file=f)
+
+        cache.set(session_key("default", "user_input_text"), response.text, timeout=30)
+        cache.set(session_key("default", "user_input_lang"), response.language, timeout=30)
+        temp_storage.delete(file_path)
+        return Response({"message": "Audio Received."})
+
+
+def thread_io():
+    with open(f"/proc/self/task/{threading.get_native_id()}/io") as f:
+        fields = dict(line.split(": ") for line in f.read().splitlines())
+    return int(fields["rchar"]), int(fields["wchar"])
+
+
+def bench(viewset, payload, requests):
+    view = viewset.as_view({"post": "create"})
+    factory = APIRequestFactory()
+    latencies = []
+    read = written = 0
+    for i in range(requests):
+        request = factory.post(
+            "/api/audio/",
+            {"file": SimpleUploadedFile(f"clip{i}.m4a", payload, "audio/mp4")},
+            format="multipart",
+        )
+        rchar, wchar = thread_io()
+        start = time.perf_counter()
+        response = view(request)
+        latencies.append(time.perf_counter() - start)
+        after_rchar, after_wchar = thread_io()
+        assert response.status_code == 200
+        read += after_rchar - rchar
+        written += after_wchar - wchar
+        # Keep background archiving out of the next measurement
+        archive_executor.submit(lambda: None).result()
+    return statistics.median(latencies), read / requests, written / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8901"], stdout=subprocess.DEVNULL)
+    time.sleep(1)
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            clip = open(os.path.join(ROOT, "audio_recording.m4a"), "rb").read()
+            # Above FILE_UPLOAD_MAX_MEMORY_SIZE, so Django spools it to disk
+            large = os.urandom(4 * 1024 * 1024)
+            print(f"{'upload':>10} {'path':>8} {'p50 ms':>8} "
+                  f"{'read KiB':>9} {'written KiB':>12}")
+            for label, payload in (("77 KiB", clip), ("4 MiB", large)):
+                for name, viewset in (("old", LegacyAudioViewSet), ("new", views.AudioViewSet)):
+                    try:
+                        p50, read, written = bench(viewset, payload, args.requests)
+                    except FileNotFoundError:
+                        # The first save moves Django's spooled temp file away
+                        print(f"{label:>10} {name:>8}   fails: temp file moved by first save")
+                        continue
+                    print(f"{label:>10} {name:>8} {p50 * 1000:>8.2f} "
+                          f"{read / 1024:>9.0f} {written / 1024:>12.0f}")
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
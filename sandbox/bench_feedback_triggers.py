@@ -0,0 +1,221 @@
+"""
+Feedback beats per trip, idle beats and question-to-answer latency for:
+
+- clock: run_scheduler's global feedback_beat every 30 s
+- fix + clock: that plus a beat on every fix (the tree before triggers)
+- triggers: beats on questions, leaving the path and nearing a turn, with
+  a FEEDBACK_HEARTBEAT_SECONDS heartbeat
+
+Sessions walk the route from bench_fix_interval.py in simulated time,
+sending fixes as next_fix_seconds asks, through the real
+process_location_fixes; a beat is idle if there was no question, route
+event or first fix since the session's last one. Latency is until the
+beat starts; the answer's LLM and speech time is the same for all three.
+For triggers it is measured in real time through FeedbackTriggers, with
+other sessions' beats taking --beat-ms. Run from the repo root:
+
+    python sandbox/bench_feedback_triggers.py --sessions 50
+"""
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from django.conf import settings
+
+from bench_fix_interval import make_route, to_latlng, walk
+
+from core import locations
+from core.feedback import QUESTION, FeedbackTriggers
+from core.navigation import Navigator
+
+CLOCK_SECONDS = 30
+QUESTION_EVERY_SECONDS = 180
+
+
+class Recorder:
+    """
+    Stands in for feedback_triggers, noting when each trigger fired.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = {}
+
+    def fire(self, session_id, reason):
+        self.events.setdefault(session_id, []).append((self.now, reason))
+
+
+def simulate(sessions, navigator, corners, rng):
+    """
+    Walk every session once; returns {session: (fix times, question times,
+    route event times, (start, end))}.
+    """
+    recorder = Recorder()
+    trips = {}
+    queue = []
+    for i in range(sessions):
+        session_id = f"bench-{i}"
+        start = rng.uniform(0, 600)
+        heapq.heappush(queue, (start, i, session_id, walk(corners, rng), start))
+        trips[session_id] = ([], start)
+    with mock.patch.object(locations, "session_navigator", return_value=navigator), \
+            mock.patch.object(locations, "feedback_triggers", recorder):
+        while queue:
+            due, i, session_id, steps, start = heapq.heappop(queue)
+            for t, _, (x, y), _ in steps:
+                if start + t >= due:
+                    break
+            else:
+                continue
+            recorder.now = start + t
+            interval = locations.process_location_fixes(
+                session_id, [to_latlng(x, y)], [recorder.now]
+            )
+            trips[session_id][0].append(recorder.now)
+            heapq.heappush(queue, (recorder.now + interval, i, session_id, steps, start))
+
+    results = {}
+    for session_id, (fixes, start) in trips.items():
+        end = fixes[-1]
+        questions = []
+        t = start + rng.expovariate(1 / QUESTION_EVERY_SECONDS)
+        while t < end:
+            questions.append(t)
+            t += rng.expovariate(1 / QUESTION_EVERY_SECONDS)
+        events = [t for t, _ in recorder.events.get(session_id, [])]
+        results[session_id] = (fixes, questions, events, (start, end))
+    return results
+
+
+def clock_ticks(start, end, every):
+    tick = (start // every + 1) * every
+    while tick <= end:
+        yield tick
+        tick += every
+
+
+def score(beats, questions, events, first):
+    """
+    (beats, idle beats, question latencies) for a session's beat times.
+    """
+    beats = sorted(beats)
+    work = sorted([first] + questions + events)
+    idle = 0
+    w = 0
+    for beat in beats:
+        if w < len(work) and work[w] <= beat:
+            while w < len(work) and work[w] <= beat:
+                w += 1
+        else:
+            idle += 1
+    latencies = []
+    for question in questions:
+        after = [beat for beat in beats if beat >= question]
+        if after:
+            latencies.append(after[0] - question)
+    return len(beats), idle, latencies
+
+
+def trigger_latency(questions, busy_sessions, beat_ms):
+    """
+    Median and p99 seconds from set_user_input's trigger to its beat
+    starting, with busy_sessions others' beats taking beat_ms each.
+    """
+    latencies = []
+    fired = {}
+
+    def beat(session_id, reasons):
+        if QUESTION in reasons:
+            latencies.append(time.perf_counter() - fired[session_id])
+        else:
+            time.sleep(beat_ms / 1000)
+
+    triggers = FeedbackTriggers(beat, settings.FEEDBACK_WORKERS)
+    stop = threading.Event()
+
+    def background():
+        i = 0
+        while not stop.is_set():
+            triggers.fire(f"busy-{i % busy_sessions}", "maneuver")
+            i += 1
+            time.sleep(beat_ms / 1000 / settings.FEEDBACK_WORKERS)
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    for i in range(questions):
+        session_id = f"asker-{i}"
+        fired[session_id] = time.perf_counter()
+        triggers.fire(session_id, QUESTION)
+        time.sleep(0.005)
+    triggers.wait(10)
+    stop.set()
+    thread.join()
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--beat-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    corners, directions = make_route()
+    navigator = Navigator(directions)
+    trips = simulate(args.sessions, navigator, corners, random.Random(0))
+    heartbeat = settings.FEEDBACK_HEARTBEAT_SECONDS
+
+    rows = {"clock": [0, 0, []], "fix + clock": [0, 0, []], "triggers": [0, 0, []]}
+    for fixes, questions, events, (start, end) in trips.values():
+        ticks = list(clock_ticks(start, end, CLOCK_SECONDS))
+        schemes = {
+            "clock": ticks,
+            "fix + clock": fixes + ticks,
+        }
+        # Triggered beats, then heartbeats for sessions quiet that long
+        triggered = sorted([fixes[0]] + questions + events)
+        beats = list(triggered)
+        for tick in clock_ticks(start, end, heartbeat):
+            last = max((beat for beat in beats if beat <= tick), default=start)
+            if tick - last >= heartbeat:
+                beats.append(tick)
+        schemes["triggers"] = beats
+        for name, times in schemes.items():
+            count, idle, latencies = score(times, questions, events, fixes[0])
+            rows[name][0] += count
+            rows[name][1] += idle
+            rows[name][2] += latencies
+
+    median, p99 = trigger_latency(500, args.sessions, args.beat_ms)
+    questions = len(rows["clock"][2])
+    print(f"{args.sessions} sessions, {questions} questions, "
+          f"{sum(len(t[0]) for t in trips.values()) / len(trips):.0f} fixes/trip")
+    print(f"{'beats':>12} {'beats/trip':>11} {'idle/trip':>10} "
+          f"{'median latency s':>17} {'p99 s':>8}")
+    for name, (count, idle, latencies) in rows.items():
+        latencies.sort()
+        if name == "triggers":
+            lat_median, lat_p99 = median, p99
+        else:
+            lat_median = statistics.median(latencies)
+            lat_p99 = latencies[int(len(latencies) * 0.99)]
+        print(f"{name:>12} {count / len(trips):>11.1f} {idle / len(trips):>10.1f} "
+              f"{lat_median:>17.4f} {lat_p99:>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
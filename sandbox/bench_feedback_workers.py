@@ -0,0 +1,242 @@
+"""
+Answers per second and question-to-answer latency with feedback beats run
+by 1 vs N worker processes (run_scheduler --workers N), sharded by session.
+Starts a fake Redis (see fake_redis_server.py) and a fake OpenAI with
+--latency-ms per call, a --slow-rate share of them taking --slow-ms. Every
+simulated session is 40 m off the route from bench_fix_interval.py, so
+its answers need an LLM call, and asks one question per round through the
+real set_user_input; an answer counts when its last speech part reaches the
+session's group. A question still queued after 30 s has expired in the
+cache and is never answered.
+
+Configurations are WORKERSxTHREADS, THREADS being FEEDBACK_WORKERS in each
+worker; 1x1 is the old single scheduler thread. The last one is run again
+with a worker leaving and rejoining mid-round. Model rate limits are lifted
+(they are per process, so more workers would otherwise mean more
+upstream quota). Run from the repo root:
+
+    python sandbox/bench_feedback_workers.py --sessions 200 --configs 1x1 1x4 2x4 4x4
+"""
+import argparse
+import asyncio
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "sandbox"))
+WORK_DIR = tempfile.mkdtemp(prefix="bench_feedback_workers_")
+os.environ.update(
+    DJANGO_SETTINGS_MODULE="sandbox.bench_settings",
+    BENCH_DB=os.path.join(WORK_DIR, "bench.sqlite3"),
+    BENCH_MEDIA_ROOT=WORK_DIR,
+    BENCH_MODEL_RATE="1000",
+    PYTHONPATH=ROOT,
+    REDIS_URL="redis://127.0.0.1:6398/0",
+    OPENAI_BASE_URL="http://127.0.0.1:8907/v1",
+    FEEDBACK_SHARDED="1",
+)
+
+import django
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+def start_upstreams(args):
+    fakes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "sandbox", "fake_redis_server.py"),
+             "--port", "6398"], stdout=subprocess.DEVNULL),
+        subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+             "--port", "8907", "--latency-ms", str(args.latency_ms),
+             "--slow-rate", str(args.slow_rate), "--slow-ms", str(args.slow_ms)],
+            stdout=subprocess.DEVNULL),
+    ]
+    time.sleep(1.5)
+    return fakes
+
+
+def seed_sessions(count):
+    from django.core.cache import cache
+
+    from bench_fix_interval import make_route, to_latlng
+    from core.sessions import session_key
+
+    _, directions = make_route()
+    session_ids = [uuid.uuid4().hex for _ in range(count)]
+    values = {}
+    for i, session_id in enumerate(session_ids):
+        values.update({
+            session_key(session_id, "flight_num"): "AS133",
+            session_key(session_id, "directions"): directions,
+            session_key(session_id, "flight_data"): {
+                "flight_status": "On time", "time_until_flight": "45 minutes",
+                "gate_str": "N12",
+            },
+            session_key(session_id, "recent_coords"): [to_latlng(40, 50 + i % 250)],
+        })
+    cache.set_many(values, timeout=None)
+    return session_ids
+
+
+class Listener:
+    """
+    Joins every session's group on one channel and notes when each
+    session's answer has fully arrived.
+    """
+
+    def __init__(self, session_ids):
+        from core.sessions import session_group_name
+
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        for session_id in session_ids:
+            async_to_sync(self.layer.group_add)(session_group_name(session_id), self.channel)
+        self.answered = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.listen()))
+        self.thread.start()
+
+    async def listen(self):
+        # Each answer's parts are sent in order, ending with part ==
+        # parts - 1. As in FeedbackWorker.serve, a pending receive is never
+        # cancelled until the end.
+        receiving = None
+        while not self.stopping.is_set():
+            if receiving is None:
+                receiving = asyncio.ensure_future(self.layer.receive(self.channel))
+            done, _ = await asyncio.wait({receiving}, timeout=0.5)
+            if not done:
+                continue
+            message = receiving.result()
+            receiving = None
+            if message["part"] == message["parts"] - 1:
+                self.answered[message["response"]] = time.perf_counter()
+        if receiving is not None:
+            receiving.cancel()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+def run_round(session_ids, listener, timeout):
+    """
+    One question per session, all at once. Returns (answers, seconds,
+    answer latencies).
+    """
+    from core.feedback import set_user_input
+
+    before = set(listener.answered)
+    start = time.perf_counter()
+    for session_id in session_ids:
+        set_user_input(session_id, "How long until I reach my gate?", "en")
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        if len(listener.answered) - len(before) >= len(session_ids):
+            break
+        time.sleep(0.2)
+    times = sorted(t for response, t in listener.answered.items() if response not in before)
+    latencies = [t - start for t in times]
+    seconds = (times[-1] if times else time.perf_counter()) - start
+    return len(times), seconds, latencies
+
+
+def run_config(workers, threads, session_ids, listener, args, rebalance=False):
+    from django.conf import settings
+
+    from core import feedback_workers
+    from core.feedback_workers import Supervisor, live_workers
+
+    os.environ["BENCH_FEEDBACK_WORKERS"] = str(threads)
+    log = os.path.join(WORK_DIR, "workers.log")
+
+    def command(slot):
+        argv = shlex.join(feedback_workers.worker_command(slot))
+        return ["sh", "-c", f"exec {argv} >>{shlex.quote(log)} 2>&1"]
+
+    supervisor = Supervisor(workers, command=command)
+    try:
+        while len(live_workers()) < workers:
+            time.sleep(0.2)
+        time.sleep(settings.FEEDBACK_MEMBERSHIP_SECONDS + 0.1)
+        answers, seconds, latencies = 0, 0.0, []
+        for _ in range(args.rounds):
+            resizer = None
+            if rebalance:
+                def resize():
+                    time.sleep(1)
+                    supervisor.resize(workers - 1)
+                    supervisor.resize(workers)
+                resizer = threading.Thread(target=resize)
+                resizer.start()
+            n, s, l = run_round(session_ids, listener, args.timeout)
+            if resizer is not None:
+                resizer.join()
+            answers += n
+            seconds += s
+            latencies += l
+            time.sleep(2)
+        report = Supervisor.report()
+    finally:
+        supervisor.stop()
+    return answers, seconds, sorted(latencies), report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--configs", nargs="+", default=["1x1", "1x4", "2x4", "4x4"])
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--verbose", action="store_true", help="print per-worker metrics")
+    args = parser.parse_args()
+
+    fakes = start_upstreams(args)
+    os.chdir(WORK_DIR)
+    django.setup()
+    listener = None
+    try:
+        session_ids = seed_sessions(args.sessions)
+        listener = Listener(session_ids)
+        asked = args.sessions * args.rounds
+        print(f"{args.sessions} sessions x {args.rounds} rounds, upstream "
+              f"{args.latency_ms:.0f} ms ({args.slow_rate:.0%} at {args.slow_ms:.0f} ms)")
+        print(f"{'workers':>16} {'answered':>9} {'answers/s':>10} "
+              f"{'median s':>9} {'p99 s':>7}")
+        runs = [(config, False) for config in args.configs] + [(args.configs[-1], True)]
+        for config, rebalance in runs:
+            workers, threads = map(int, config.split("x"))
+            if rebalance and workers < 2:
+                continue
+            answers, seconds, latencies, report = run_config(
+                workers, threads, session_ids, listener, args, rebalance
+            )
+            name = config + (" rebalanced" if rebalance else "")
+            median = statistics.median(latencies) if latencies else float("nan")
+            p99 = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+            print(f"{name:>16} {answers:>4}/{asked:<4} {answers / seconds:>10.1f} "
+                  f"{median:>9.2f} {p99:>7.2f}")
+            if args.verbose:
+                for line in report:
+                    print("    " + line)
+    finally:
+        if listener is not None:
+            listener.stop()
+        for fake in fakes:
+            fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+GPS fixes a walking trip sends at a fixed 1 Hz versus following the
+next_fix_seconds the server advertises. A walker at 1.4 m/s follows a
+synthetic route of long straights and short legs between turns, with one
+detour 30 m off the path and a stop. Only the sampling decision is run
+(Navigator.route_position, FixRing.speed, next_fix_interval), not the
+HTTP round trip. Run from the repo root:
+
+    python sandbox/bench_fix_interval.py --walks 20
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from django.conf import settings
+
+from core.locations import FixRing, next_fix_interval
+from core.navigation import Navigator, convert, haversine_distance
+
+ORIGIN = (47.4463, -122.3042)
+METRES_PER_DEGREE = 111195
+SPEED = 1.4
+STEP = 0.1
+# Straights between right-angle turns, in metres
+LEGS = [300, 40, 250, 25, 400, 60]
+
+
+def to_latlng(x, y):
+    lat = ORIGIN[0] + y / METRES_PER_DEGREE
+    return lat, ORIGIN[1] + x / (METRES_PER_DEGREE * math.cos(math.radians(ORIGIN[0])))
+
+
+def make_route():
+    """
+    Corner points in metres, and directions with one step per leg.
+    """
+    corners = [(0.0, 0.0)]
+    heading = 0
+    for i, length in enumerate(LEGS):
+        dx, dy = ((0, 1), (1, 0), (0, -1), (-1, 0))[heading]
+        x, y = corners[-1]
+        corners.append((x + dx * length, y + dy * length))
+        heading = (heading + (1 if i % 2 == 0 else 3)) % 4
+    steps = []
+    for (x1, y1), (x2, y2) in zip(corners, corners[1:]):
+        count = max(int(math.hypot(x2 - x1, y2 - y1) // 10), 1)
+        points = [to_latlng(x1 + (x2 - x1) * k / count, y1 + (y2 - y1) * k / count)
+                  for k in range(count + 1)]
+        steps.append({"polyline": {"points": convert.encode_polyline(points)}})
+    return corners, [{"legs": [{"steps": steps}]}]
+
+
+def walk(corners, rng):
+    """
+    Yield (seconds, true (x, y), GPS (x, y), off_path) every STEP seconds
+    along the route, with a detour on the third leg and a stop on the fifth.
+    """
+    t = 0.0
+    for leg, ((x1, y1), (x2, y2)) in enumerate(zip(corners, corners[1:])):
+        length = math.hypot(x2 - x1, y2 - y1)
+        ux, uy = (x2 - x1) / length, (y2 - y1) / length
+        travelled = 0.0
+        while travelled < length:
+            side = 0.0
+            if leg == 2 and 0.4 * length < travelled < 0.7 * length:
+                side = 30.0
+            if leg == 4 and abs(travelled - length / 2) < SPEED * STEP:
+                # Stand still for a minute
+                for _ in range(int(60 / STEP)):
+                    t += STEP
+                    x, y = x1 + ux * travelled, y1 + uy * travelled
+                    yield t, (x, y), (x + rng.gauss(0, 2), y + rng.gauss(0, 2)), False
+            x, y = x1 + ux * travelled - uy * side, y1 + uy * travelled + ux * side
+            yield t, (x, y), (x + rng.gauss(0, 2), y + rng.gauss(0, 2)), side > 0
+            travelled += SPEED * STEP
+            t += STEP
+
+
+def run(navigator, corners, rng, adaptive):
+    ring = FixRing(settings.FIX_RING_SIZE)
+    next_fix = 0.0
+    fixes = 0
+    last = None
+    max_gap = 0.0
+    off_path_since = None
+    max_off_path_wait = 0.0
+    turns = corners[1:-1]
+    turned_at = None
+    max_past_turn = 0.0
+    for t, position, (x, y), off_path in walk(corners, rng):
+        lat, lng = to_latlng(x, y)
+        if off_path and off_path_since is None:
+            off_path_since = t
+        if turns and math.dist(position, turns[0]) < SPEED * STEP:
+            turns.pop(0)
+            turned_at = turned_at if turned_at is not None else t
+        if t + 1e-9 < next_fix:
+            continue
+        fixes += 1
+        if last is not None:
+            max_gap = max(max_gap, haversine_distance(lat, lng, *last))
+        last = (lat, lng)
+        if turned_at is not None:
+            max_past_turn = max(max_past_turn, (t - turned_at) * SPEED)
+            turned_at = None
+        if off_path_since is not None:
+            max_off_path_wait = max(max_off_path_wait, t - off_path_since)
+            off_path_since = None
+        ring.push(lat, lng, t)
+        interval = 1
+        if adaptive:
+            distance_to_path, to_maneuver = navigator.route_position(lat, lng)
+            interval = next_fix_interval(
+                ring.speed(settings.FIX_SPEED_WINDOW_SECONDS),
+                distance_to_path > navigator.threshold_meters, to_maneuver,
+            )
+        next_fix = t + interval
+    return fixes, t, max_gap, max_past_turn, max_off_path_wait
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--walks", type=int, default=20)
+    args = parser.parse_args()
+
+    corners, directions = make_route()
+    navigator = Navigator(directions)
+    print(f"route {sum(LEGS)} m, {len(LEGS) - 1} turns, {args.walks} walks")
+    print(f"{'sampling':>9} {'fixes/trip':>11} {'fixes/min':>10} "
+          f"{'max gap m':>10} {'past turn m':>12} {'off-path wait s':>16}")
+    baseline = None
+    for name, adaptive in (("1 Hz", False), ("adaptive", True)):
+        rng = random.Random(0)
+        totals = [0, 0.0, 0.0, 0.0, 0.0]
+        for _ in range(args.walks):
+            fixes, seconds, *worst = run(navigator, corners, rng, adaptive)
+            totals[0] += fixes
+            totals[1] += seconds
+            totals[2:] = map(max, totals[2:], worst)
+        per_trip = totals[0] / args.walks
+        baseline = baseline or per_trip
+        print(f"{name:>9} {per_trip:>11.0f} {totals[0] / totals[1] * 60:>10.1f} "
+              f"{totals[2]:>10.1f} {totals[3]:>12.1f} {totals[4]:>16.1f}   {baseline / per_trip:.1f}x fewer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Per-fix cost of getting a GPS fix to navigation: the old path (INSERT the
+row, read the session's latest fixes back from the database, merge them
+through the cache) versus the ring buffer with a write-behind INSERT.
+Counts database queries made on the request thread; the write-behind
+uses its own connection. The feedback beat itself is left out. Run from
+the repo root:
+
+    python sandbox/bench_fix_ring.py --fixes 5000 --rows 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from core import locations
+from core.locations import LocationFix, recent_fixes, save_location_fixes
+from core.models import LocationHistory
+from core.sessions import session_key
+
+SESSIONS = 100
+
+
+def old_path(session_id, fix):
+    save_location_fixes(session_id, [fix])
+    recent_coords = recent_fixes(session_id)
+    cache.set(session_key(session_id, "recent_coords"), recent_coords, timeout=10)
+
+
+def new_path(session_id, fix):
+    locations.write_location_fixes(session_id, [fix])
+    locations.process_location_fixes(session_id, [(fix.lat, fix.lng)], [fix.timestamp])
+
+
+def run(path, fixes):
+    rng = random.Random(0)
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        for i in range(fixes):
+            fix = LocationFix(time.time(), 47.44 + rng.random() / 100, -122.30, 5, 0, 1)
+            path(f"session{rng.randrange(SESSIONS)}", fix)
+    request = time.perf_counter() - start
+    # Wait for the write-behind to catch up
+    locations.location_writer.flush()
+    total = time.perf_counter() - start
+    return request / fixes * 1e6, total / fixes * 1e6, queries / fixes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixes", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=200000, help="existing history rows")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    LocationHistory.objects.bulk_create(
+        (LocationHistory(session_id=f"session{i % SESSIONS}", latitude=47.44, longitude=-122.3)
+         for i in range(args.rows)),
+        batch_size=5000,
+    )
+    # Only the ingest is measured
+    locations.feedback_triggers.beat = lambda session_id, reasons: None
+
+    print(f"{'path':>6} {'request us/fix':>15} {'with writes us/fix':>19} {'queries/fix':>12}")
+    for name, path in (("old", old_path), ("ring", new_path)):
+        request, total, queries = run(path, args.fixes)
+        print(f"{name:>6} {request:>15.0f} {total:>19.0f} {queries:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
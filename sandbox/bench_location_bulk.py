@@ -0,0 +1,94 @@
+"""
+Replaying fixes buffered offline: one POST per fix to
+/api/location-history/ versus batches to /api/location-history/bulk/.
+Requests go through Django's test client, so this is server throughput
+with no network, navigation included. Run from the repo root:
+
+    python sandbox/bench_location_bulk.py --fixes 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from core.models import LocationHistory
+from core.sessions import DEFAULT_SESSION_ID, session_key
+
+
+def make_fixes(count):
+    start = time.time() - count
+    return [
+        {"latitude": 47.4463 + i * 1e-6, "longitude": -122.3042, "timestamp": start + i}
+        for i in range(count)
+    ]
+
+
+def single(client, fixes):
+    for fix in fixes:
+        response = client.post(
+            "/api/location-history/",
+            {"latitude": fix["latitude"], "longitude": fix["longitude"]},
+            content_type="application/json",
+        )
+        assert response.status_code == 201
+
+
+def bulk(batch):
+    def run(client, fixes):
+        for i in range(0, len(fixes), batch):
+            response = client.post(
+                "/api/location-history/bulk/",
+                json.dumps(fixes[i:i + batch]),
+                content_type="application/json",
+            )
+            assert response.status_code == 201, response.content
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixes", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    # feedback_beat appends to test.txt in the working directory
+    os.chdir(tempfile.mkdtemp())
+    cache.set(session_key(DEFAULT_SESSION_ID, "flight_num"), "AS133")
+
+    client = Client()
+    fixes = make_fixes(args.fixes)
+    print(f"{'path':>14} {'fixes/s':>9} {'speedup':>8}")
+    baseline = None
+    for name, run in (
+        ("single POST", single),
+        ("bulk x50", bulk(50)),
+        ("bulk x500", bulk(500)),
+        ("bulk x5000", bulk(5000)),
+    ):
+        LocationHistory.objects.all().delete()
+        start = time.perf_counter()
+        run(client, fixes)
+        rate = args.fixes / (time.perf_counter() - start)
+        assert LocationHistory.objects.count() == args.fixes
+        baseline = baseline or rate
+        print(f"{name:>14} {rate:>9.0f} {rate / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
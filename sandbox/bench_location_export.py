@@ -0,0 +1,115 @@
+"""
+Memory and time to read location history as the table grows: the old
+unpaginated list (every row through LocationHistorySerializer), one
+cursor page, and the streaming NDJSON/GeoJSON exports. Peak memory is
+Python allocations seen by tracemalloc, which also slows everything down
+about 2x. Rows are loaded with raw SQL into a throwaway database. Run
+from the repo root:
+
+    python sandbox/bench_location_export.py --rows 100000 1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORK_DIR = tempfile.mkdtemp()
+os.environ["DJANGO_SETTINGS_MODULE"] = "sandbox.bench_settings"
+os.environ["BENCH_DB"] = os.path.join(WORK_DIR, "bench.sqlite3")
+os.environ["BENCH_MEDIA_ROOT"] = WORK_DIR
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from core.models import LocationHistory
+from core.serializers import LocationHistorySerializer
+
+START = datetime(2025, 1, 1)
+BATCH = 100000
+
+
+def load(start, stop, rng):
+    with connection.cursor() as cursor:
+        for first in range(start, stop, BATCH):
+            cursor.executemany(
+                "INSERT INTO core_locationhistory (session_id, latitude, longitude, timestamp)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (f"{rng.randrange(1000):032x}", 47.44 + rng.random() / 100,
+                     -122.30 + rng.random() / 100,
+                     (START + timedelta(milliseconds=i * 100)).isoformat(" "))
+                    for i in range(first, min(first + BATCH, stop))
+                ],
+            )
+
+
+def old_list(client):
+    return len(JSONRenderer().render(
+        LocationHistorySerializer(LocationHistory.objects.all(), many=True).data
+    ))
+
+
+def page(client):
+    return len(client.get("/api/location-history/", {"page_size": 1000}).content)
+
+
+def export(kind):
+    def run(client):
+        response = client.get("/api/location-history/export/", {"type": kind})
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return run
+
+
+def measure(fn, client):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn(client)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command("migrate", verbosity=0)
+    client = Client()
+    # The first request imports and sets up the URLconf and DRF
+    client.get("/api/location-history/")
+    rng = random.Random(0)
+    loaded = 0
+    print(f"{'rows':>9} {'read':>15} {'seconds':>8} {'peak MB':>8} {'output MB':>10}")
+    for rows in args.rows:
+        load(loaded, rows, rng)
+        loaded = rows
+        # The first read after a bulk load pays for checkpointing the WAL
+        page(client)
+        for name, fn in (("one page", page), ("old list", old_list),
+                         ("export ndjson", export("ndjson")),
+                         ("export geojson", export("geojson"))):
+            elapsed, peak, size = measure(fn, client)
+            print(f"{rows:>9} {name:>15} {elapsed:>8.2f} {peak / 1e6:>8.1f} {size / 1e6:>10.1f}")
+    connection.close()
+    shutil.rmtree(WORK_DIR)
+
+
+if __name__ == "__main__":
+    main()
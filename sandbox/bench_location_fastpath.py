@@ -0,0 +1,102 @@
+"""
+Requests per second on one core for POST /api/location-history/, through
+Django's WSGI handler with no server or network in front: the DRF
+serializer, parser, renderer and content negotiation versus the fast
+path in core.renderers and core.serializers. Navigation is stubbed out
+and fixes go to the write-behind buffer (LOCATION_WRITE_BEHIND=1), so
+only request handling is measured. Run from the repo root:
+
+    python sandbox/bench_location_fastpath.py --requests 20000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["LOCATION_WRITE_BEHIND"] = "1"
+
+import django
+
+django.setup()
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from rest_framework.settings import api_settings
+
+from core import views
+from core.sessions import new_session
+
+BODY = b'{"latitude": 47.4463438, "longitude": -122.3042077}'
+
+
+def drf_path():
+    """
+    The viewset as it was: every fix through LocationHistorySerializer and
+    DRF's default parser, renderer and negotiation.
+    """
+    stack = ExitStack()
+    viewset = views.LocationHistoryViewSet
+    stack.enter_context(mock.patch.object(views, "parse_location_fix", return_value=None))
+    for name, value in (
+        ("renderer_classes", api_settings.DEFAULT_RENDERER_CLASSES),
+        ("parser_classes", api_settings.DEFAULT_PARSER_CLASSES),
+        ("content_negotiation_class", api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS),
+    ):
+        stack.enter_context(mock.patch.object(viewset, name, value))
+    return stack
+
+
+def run(handler, count, token):
+    def start_response(status, headers):
+        assert status.startswith("201"), status
+
+    start = time.perf_counter()
+    for _ in range(count):
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": "/api/location-history/",
+            "QUERY_STRING": "",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(BODY)),
+            "HTTP_HOST": "localhost",
+            "HTTP_ACCEPT": "*/*",
+            "HTTP_X_SESSION_TOKEN": token,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(BODY),
+        }
+        response = handler(environ, start_response)
+        b"".join(response)
+        response.close()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    connection.creation.create_test_db(verbosity=0)
+    views.process_location_fixes = lambda session_id, coords, timestamps=None: None
+    handler = WSGIHandler()
+    _, token = new_session()
+    run(handler, 500, token)
+
+    print(f"{'path':>10} {'req/s':>8} {'us/req':>8}")
+    baseline = None
+    for name, patches in (("DRF", drf_path), ("fast path", ExitStack)):
+        with patches():
+            rate = run(handler, args.requests, token)
+        baseline = baseline or rate
+        print(f"{name:>10} {rate:>8.0f} {1e6 / rate:>8.0f}  {rate / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Server CPU per GPS fix: REST POST to location-history versus binary frames
+on the WebSocket, single and batched. Both paths persist the fix and run
+the same navigation step. The session is seeded as already navigating, so
+feedback_beat makes no upstream calls. Run from the repo root:
+
+    python sandbox/bench_location_frames.py --fixes 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from core.locations import (
+    LocationFix, decode_location_frame, encode_location_frame,
+    process_location_fixes, save_location_fixes,
+)
+from core.sessions import DEFAULT_SESSION_ID, session_key
+
+
+def make_fix(i):
+    return LocationFix(time.time(), 47.4463 + i * 1e-6, -122.3042, 5.0, 90.0, 1.4)
+
+
+def bench_rest(fixes):
+    client = Client()
+    start = time.process_time()
+    for i in range(fixes):
+        fix = make_fix(i)
+        response = client.post(
+            "/api/location-history/",
+            {"latitude": fix.lat, "longitude": fix.lng},
+            content_type="application/json",
+        )
+        assert response.status_code == 201
+    return (time.process_time() - start) / fixes
+
+
+def bench_frames(fixes, batch):
+    frames = [
+        encode_location_frame([make_fix(i + j) for j in range(batch)])
+        for i in range(0, fixes, batch)
+    ]
+    start = time.process_time()
+    for frame in frames:
+        # Same work as VoiceAssistantWebsocketConsumer.receive_location_frame
+        decoded = decode_location_frame(frame)
+        save_location_fixes(DEFAULT_SESSION_ID, decoded)
+        process_location_fixes(DEFAULT_SESSION_ID, [(f.lat, f.lng) for f in decoded])
+    return (time.process_time() - start) / (len(frames) * batch)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixes", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    # feedback_beat appends to test.txt in the working directory
+    os.chdir(tempfile.mkdtemp())
+    cache.set(session_key(DEFAULT_SESSION_ID, "flight_num"), "AS133")
+
+    rest = bench_rest(args.fixes)
+    print(f"REST POST          {rest * 1e6:8.1f} us CPU/fix")
+    for batch in (1, 10, 50):
+        frame = bench_frames(args.fixes, batch)
+        print(f"WS frame, batch {batch:<3}{frame * 1e6:8.1f} us CPU/fix "
+              f"({rest / frame:.1f}x less)")
+
+
+if __name__ == "__main__":
+    main()
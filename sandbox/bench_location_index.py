@@ -0,0 +1,110 @@
+"""
+Recent-fix lookups as LocationHistory grows to 10M rows spread over 10k
+sessions: the old query (latest two fixes of the whole table, ordered by
+the unindexed timestamp) versus core.locations.recent_fixes, which scans
+the (session, timestamp) index. Rows are loaded with raw SQL into a
+throwaway database. Run from the repo root:
+
+    python sandbox/bench_location_index.py --rows 10000000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORK_DIR = tempfile.mkdtemp()
+os.environ["DJANGO_SETTINGS_MODULE"] = "sandbox.bench_settings"
+os.environ["BENCH_DB"] = os.path.join(WORK_DIR, "bench.sqlite3")
+os.environ["BENCH_MEDIA_ROOT"] = WORK_DIR
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+
+from core.locations import recent_fixes
+from core.models import LocationHistory
+
+SESSIONS = 10000
+BATCH = 100000
+START = datetime(2025, 1, 1)
+
+
+def old_recent_fixes():
+    return [
+        (entry.latitude, entry.longitude)
+        for entry in LocationHistory.objects.order_by("-timestamp")[:2]
+    ]
+
+
+def load(cursor, start, stop, rng):
+    for first in range(start, stop, BATCH):
+        rows = [
+            (
+                f"{rng.randrange(SESSIONS):032x}",
+                47.44 + rng.random() / 100,
+                -122.30 + rng.random() / 100,
+                (START + timedelta(milliseconds=i * 100)).isoformat(" "),
+            )
+            for i in range(first, min(first + BATCH, stop))
+        ]
+        cursor.executemany(
+            "INSERT INTO core_locationhistory (session_id, latitude, longitude, timestamp)"
+            " VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    rng = random.Random(0)
+    sizes = [n for n in (10_000, 100_000, 1_000_000, 10_000_000) if n < args.rows]
+    sizes.append(args.rows)
+
+    print(f"{'rows':>10} {'old query ms':>13} {'recent_fixes ms':>16}")
+    loaded = 0
+    with connection.cursor() as cursor:
+        # Bulk load only: nothing here needs to survive a crash
+        cursor.execute("PRAGMA journal_mode = OFF")
+        cursor.execute("PRAGMA synchronous = OFF")
+        for size in sizes:
+            load(cursor, loaded, size, rng)
+            loaded = size
+            cursor.execute("ANALYZE")
+            old = timed(old_recent_fixes, 3)
+            sessions = [f"{rng.randrange(SESSIONS):032x}" for _ in range(args.lookups)]
+            lookups = iter(sessions)
+            new = timed(lambda: recent_fixes(next(lookups)), args.lookups)
+            print(f"{size:>10} {old:>13.2f} {new:>16.3f}")
+
+        query = LocationHistory.objects.filter(session_id="x").order_by("-timestamp")[:2]
+        sql, params = query.query.sql_with_params()
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        print("\nrecent_fixes plan:", [row[-1] for row in cursor.fetchall()])
+    print(f"database: {os.path.getsize(os.environ['BENCH_DB']) / 1e9:.2f} GB")
+    connection.close()
+    shutil.rmtree(WORK_DIR)
+
+
+if __name__ == "__main__":
+    main()
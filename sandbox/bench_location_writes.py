@@ -0,0 +1,146 @@
+"""
+Concurrent single-fix POSTs to /api/location-history/ from several Daphne
+workers sharing one SQLite file: the old setup (default journal, an INSERT
+per request) versus WAL with busy_timeout, with and without the
+write-behind buffer. Navigation is stubbed out in the workers so only
+persistence is measured. Each configuration gets a fresh database; after
+the workers are stopped with SIGTERM the rows are counted, to check that
+fixes still buffered at shutdown were flushed. Run from the repo root:
+
+    python sandbox/bench_location_writes.py --workers 4 --clients 32
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_PORT = 8100
+
+CONFIGS = [
+    ("default journal", {"BENCH_SQLITE_TUNED": "0", "LOCATION_WRITE_BEHIND": "0"}),
+    ("WAL", {"BENCH_SQLITE_TUNED": "1", "LOCATION_WRITE_BEHIND": "0"}),
+    ("WAL + write-behind", {"BENCH_SQLITE_TUNED": "1", "LOCATION_WRITE_BEHIND": "1"}),
+]
+
+
+def wait_for_port(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_workers(count, env, work_dir):
+    workers = []
+    for i in range(count):
+        port = BASE_PORT + i
+        workers.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+            cwd=work_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+    for i, worker in enumerate(workers):
+        wait_for_port(f"http://127.0.0.1:{BASE_PORT + i}/api/")
+        if worker.poll() is not None:
+            raise RuntimeError(f"worker on port {BASE_PORT + i} exited; is the port taken?")
+    return workers
+
+
+def drive(count, clients, duration):
+    """
+    Returns (fixes accepted/s, p99 latency, accepted, failed).
+    """
+    urls = [f"http://127.0.0.1:{BASE_PORT + i}/api/location-history/" for i in range(count)]
+    latencies = []
+    failed = 0
+    lock = threading.Lock()
+    stop = time.time() + duration
+
+    def client(n):
+        nonlocal failed
+        http = requests.Session()
+        i = n
+        while time.time() < stop:
+            start = time.perf_counter()
+            response = http.post(urls[i % count], json={
+                "latitude": 47.4463 + (i % 1000) * 1e-6, "longitude": -122.3042,
+            })
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 201:
+                    latencies.append(elapsed)
+                else:
+                    failed += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+    return len(latencies) / duration, p99, len(latencies), failed
+
+
+def serve(port):
+    import django
+
+    django.setup()
+    from daphne.cli import CommandLineInterface
+
+    from core import views
+
+    views.process_location_fixes = lambda session_id, coords, timestamps=None: None
+    CommandLineInterface().run(["-p", str(port), "server.asgi:application"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve)
+
+    print(f"{'config':>20} {'fixes/s':>8} {'p99 ms':>8} {'failed':>7} {'rows':>13}")
+    for name, overrides in CONFIGS:
+        work_dir = tempfile.mkdtemp()
+        db = os.path.join(work_dir, "bench.sqlite3")
+        env = dict(
+            os.environ, **overrides,
+            DJANGO_SETTINGS_MODULE="sandbox.bench_settings",
+            BENCH_DB=db, BENCH_MEDIA_ROOT=work_dir, PYTHONPATH=ROOT,
+        )
+        subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"],
+                       cwd=ROOT, env=env, check=True)
+        workers = start_workers(args.workers, env, work_dir)
+        try:
+            rate, p99, accepted, failed = drive(args.workers, args.clients, args.duration)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.wait()
+        with sqlite3.connect(db) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM core_locationhistory").fetchone()[0]
+        print(f"{name:>20} {rate:>8.0f} {p99 * 1000:>8.1f} {failed:>7} "
+              f"{rows:>6}/{accepted:<6}")
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Chat call latency against a faulty upstream: the old generate_text (one
+call through the default client: 10 minute timeout, two retries) versus
+ModelScheduler.call with the configured deadline, hedging and the circuit
+breaker. A call with no LLM answer falls back to the local template, so its
+latency is the time until the traveller hears something. Scenarios run
+against fake_openai_server.py with fault injection. Run from the repo root:
+
+    python sandbox/bench_model_deadlines.py --calls 300 --concurrency 8
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+PORT = 8907
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from openai import OpenAI
+
+from core.model_calls import INTERACTIVE, ModelCallFailed, ModelScheduler
+
+SCENARIOS = {
+    # 2% of calls hit a 5 s stall and 5% fail
+    "degraded": ["--latency-ms", "300", "--slow-rate", "0.02", "--slow-ms", "5000",
+                 "--error-rate", "0.05"],
+    # Every call fails
+    "outage": ["--latency-ms", "300", "--error-rate", "1"],
+}
+
+
+def chat(client):
+    return client.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": "Where is my gate?"}]
+    )
+
+
+def before(client):
+    try:
+        return chat(client)
+    except Exception:
+        return None
+
+
+def after(scheduler, client):
+    try:
+        return scheduler.call("gpt-4o-mini", INTERACTIVE, chat, client, hedge=True)
+    except ModelCallFailed:
+        return None
+
+
+def run(fn, calls, concurrency):
+    latencies = []
+    fallbacks = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal fallbacks
+        start = time.perf_counter()
+        result = fn()
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            fallbacks += result is None
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(calls)))
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], fallbacks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{PORT}/v1"
+    deadline = settings.MODEL_CALL_DEADLINES["gpt-4o-mini"]
+    print(f"{'scenario':>10} {'path':>7} {'p50 ms':>8} {'p99 ms':>8} {'fallbacks':>10}")
+    for scenario, fake_args in SCENARIOS.items():
+        fake = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+             "--port", str(PORT), *fake_args],
+            # Abandoned hedges close their connections early
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1)
+        try:
+            old_client = OpenAI(base_url=base_url)
+            new_client = OpenAI(base_url=base_url, timeout=deadline, max_retries=0)
+            scheduler = ModelScheduler(
+                {}, 5, settings.MODEL_CALL_DEADLINES,
+                settings.MODEL_BREAKER_FAILURES, settings.MODEL_BREAKER_RESET_SECONDS,
+            )
+            for name, fn in (
+                ("before", lambda: before(old_client)),
+                ("after", lambda: after(scheduler, new_client)),
+            ):
+                p50, p99, fallbacks = run(fn, args.calls, args.concurrency)
+                print(f"{scenario:>10} {name:>7} {p50 * 1000:>8.0f} {p99 * 1000:>8.0f} "
+                      f"{fallbacks:>10}")
+        finally:
+            fake.terminate()
+            fake.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Chat calls arriving faster than the upstream rate limit, fired directly
+(the OpenAI client retries 429s with backoff) versus admitted by
+core.model_calls.ModelScheduler. Calls are a mix of urgent (off the path),
+interactive and background work for travellers 5-120 minutes from
+departure. The upstream is fake_openai_server.py with --rate-limit. Run
+from the repo root:
+
+    python sandbox/bench_model_scheduler.py --rate 10 --arrivals 20 --seconds 10
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8906/v1"
+
+import django
+
+django.setup()
+
+from openai import OpenAI
+
+from core.model_calls import (
+    BACKGROUND, INTERACTIVE, PRIORITY_NAMES, URGENT, ModelCallShed, ModelScheduler,
+)
+
+MIX = [URGENT] * 2 + [INTERACTIVE] * 5 + [BACKGROUND] * 3
+
+
+def chat(client):
+    return client.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": "Where is my gate?"}]
+    )
+
+
+def run(calls, scheduler, arrivals):
+    client = OpenAI()
+    results = {p: {"latencies": [], "failed": 0, "shed": 0} for p in PRIORITY_NAMES}
+    lock = threading.Lock()
+
+    def call(priority, minutes):
+        start = time.perf_counter()
+        try:
+            if scheduler is None:
+                chat(client)
+            else:
+                scheduler.call("gpt-4o-mini", priority, chat, client, minutes=minutes)
+        except ModelCallShed:
+            outcome = "shed"
+        except Exception:
+            outcome = "failed"
+        else:
+            outcome = None
+        with lock:
+            if outcome:
+                results[priority][outcome] += 1
+            else:
+                results[priority]["latencies"].append(time.perf_counter() - start)
+
+    threads = []
+    start = time.perf_counter()
+    for i, (priority, minutes) in enumerate(calls):
+        delay = start + i / arrivals - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=call, args=(priority, minutes))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(name, results, scheduler=None):
+    print(name)
+    print(f"  {'class':>12} {'done':>5} {'failed':>7} {'shed':>5} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'queue p95 ms':>13}")
+    stats = scheduler.stats() if scheduler else {}
+    for priority, label in PRIORITY_NAMES.items():
+        result = results[priority]
+        latencies = sorted(result["latencies"])
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+        queue = f"{stats[label]['wait_p95_ms']:.0f}" if stats else "-"
+        print(f"  {label:>12} {len(latencies):>5} {result['failed']:>7} "
+              f"{result['shed']:>5} {p50:>8.0f} {p95:>8.0f} {queue:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=10, help="upstream requests/s")
+    parser.add_argument("--arrivals", type=float, default=20, help="calls/s offered")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8906", "--latency-ms", str(args.latency_ms),
+         "--rate-limit", str(args.rate)], stdout=subprocess.DEVNULL)
+    time.sleep(1)
+
+    rng = random.Random(0)
+    calls = [
+        (rng.choice(MIX), rng.uniform(5, 120))
+        for _ in range(int(args.arrivals * args.seconds))
+    ]
+    try:
+        report("direct", run(calls, None, args.arrivals))
+        time.sleep(2)
+        # A little under the upstream limit, which counts fixed one-second windows
+        scheduler = ModelScheduler({"gpt-4o-mini": (args.rate * 0.9, 1)}, 5)
+        report("scheduled", run(calls, scheduler, args.arrivals), scheduler)
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Throughput of the REST API with 1 vs N Daphne workers sharing a Redis
+channel layer and cache. Starts a fake Redis (see fake_redis_server.py)
+unless --redis-url is given, then for each worker count starts that many
+Daphne processes and drives them round-robin. Run from the repo root:
+
+    python sandbox/bench_multi_node.py --workers 1 2 4 --clients 16
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import django
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+BASE_PORT = 8100
+
+
+def wait_for_port(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_workers(count, env):
+    workers = []
+    for i in range(count):
+        port = BASE_PORT + i
+        workers.append(subprocess.Popen(
+            [sys.executable, "-m", "daphne", "-p", str(port), "server.asgi:application"],
+            cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        wait_for_port(f"http://127.0.0.1:{port}/api/")
+    return workers
+
+
+def drive(count, clients, duration):
+    """
+    Clients create sessions round-robin across the workers. Returns
+    (requests/s, p99 latency, created session ids).
+    """
+    urls = [f"http://127.0.0.1:{BASE_PORT + i}/api" for i in range(count)]
+    created = []
+    latencies = []
+    lock = threading.Lock()
+    stop = time.time() + duration
+
+    def client(n):
+        http = requests.Session()
+        i = n
+        while time.time() < stop:
+            start = time.perf_counter()
+            session_id = http.post(f"{urls[i % count]}/sessions/").json()["session_id"]
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                created.append(session_id)
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return len(latencies) / duration, latencies[int(len(latencies) * 0.99)], created
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    fake_redis = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        fake_redis = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "sandbox", "fake_redis_server.py"),
+             "--port", "6399"],
+            stdout=subprocess.DEVNULL)
+        time.sleep(1)
+        redis_url = "redis://127.0.0.1:6399/0"
+
+    env = dict(os.environ, REDIS_URL=redis_url)
+    os.environ["REDIS_URL"] = redis_url
+    django.setup()
+    from core.sessions import active_sessions
+
+    try:
+        print(f"{'workers':>8} {'req/s':>8} {'p99 ms':>8} {'registered':>11}")
+        for count in args.workers:
+            workers = start_workers(count, env)
+            try:
+                throughput, p99, created = drive(count, args.clients, args.duration)
+            finally:
+                for worker in workers:
+                    worker.terminate()
+                    worker.wait()
+            # Sessions created on any worker must be visible to every other
+            active = set(active_sessions())
+            registered = sum(1 for session_id in created if session_id in active)
+            print(f"{count:>8} {throughput:>8.0f} {p99 * 1000:>8.1f} "
+                  f"{registered:>5}/{len(created)}")
+    finally:
+        if fake_redis is not None:
+            fake_redis.terminate()
+
+
+if __name__ == "__main__":
+    main()
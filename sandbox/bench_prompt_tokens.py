@@ -0,0 +1,71 @@
+"""
+Input tokens per off-path event: the old single-paragraph prompt versus
+core.prompts (shared system prefix, compact suffix, question budget), for
+a mix of traveller questions. Tokens are core.prompts' estimate for both.
+Cost uses gpt-4o-mini list prices. Run from the repo root:
+
+    python sandbox/bench_prompt_tokens.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from core.prompts import (
+    NAVIGATION_SYSTEM_PROMPT, chat_messages, count_message_tokens, navigation_prompt,
+)
+
+# USD per million input tokens
+INPUT_PRICE = 0.15
+
+STATUS = "OFF the path"
+INSTRUCTION = "You have deviated from the path. Please go back and turn left to rejoin the path."
+QUESTIONS = {
+    "none": "",
+    "short": "Which way is my gate?",
+    "nepali": "मेरो गेट कता छ? म हराएँ जस्तो लाग्छ।",
+    "rambling": " ".join(
+        ["Sorry, I was looking at the shops and the signs are confusing and"] * 20
+        + ["which way is gate B12?"]
+    ),
+}
+
+
+def old_prompt(question):
+    return (
+        f"Give output in Nepali language. A person is travelling on a path and give instruction to the person based on "
+        f"the following information in nepali language. Person's status: {STATUS}, Instruction: {INSTRUCTION}. "
+        f"Flight status: On time. Time until flight: 45 minutes. "
+        f"Transcription of what person is asking: {question}. "
+        f"Answer person's query based on their status, instruction and flight status and nothing else. "
+        f"Be specific and don't tell anything more than what is asked."
+    )
+
+
+def main():
+    print(f"{'question':>10} {'old tokens':>11} {'new tokens':>11} {'saved':>6}")
+    old_total = new_total = 0
+    for name, question in QUESTIONS.items():
+        old = count_message_tokens(chat_messages(old_prompt(question)))
+        new = count_message_tokens(chat_messages(
+            navigation_prompt(STATUS, INSTRUCTION, "On time", "45 minutes", question),
+            NAVIGATION_SYSTEM_PROMPT,
+        ))
+        old_total += old
+        new_total += new
+        print(f"{name:>10} {old:>11} {new:>11} {1 - new / old:>6.0%}")
+
+    events = len(QUESTIONS)
+    print("\ninput cost per 1k off-path events, uniform mix of the questions above:")
+    print(f"  old  ${old_total / events * 1000 * INPUT_PRICE / 1e6:.5f}")
+    print(f"  new  ${new_total / events * 1000 * INPUT_PRICE / 1e6:.5f}")
+
+
+if __name__ == "__main__":
+    main()
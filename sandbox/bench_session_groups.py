@@ -0,0 +1,89 @@
+"""
+Cost of delivering one feedback message as the number of connected clients
+grows, with every client in the shared room1 group versus one group per
+session. Run from the repo root:
+
+    python sandbox/bench_session_groups.py --clients 1 10 50 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+
+import django
+
+django.setup()
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from core.audio_store import audio_store
+from core.consumers import VoiceAssistantWebsocketConsumer
+from core.sessions import DEFAULT_SESSION_ID, new_session, session_group_name
+
+
+async def connect_clients(count, shared):
+    # Clients without a token all share the default session, which is how
+    # every client used to share room1
+    clients = []
+    for _ in range(count):
+        session_id, token = new_session()
+        path = "/ws/voice-assistant/" if shared else f"/ws/voice-assistant/?token={token}"
+        communicator = WebsocketCommunicator(VoiceAssistantWebsocketConsumer.as_asgi(), path)
+        connected, _ = await communicator.connect()
+        assert connected
+        clients.append((DEFAULT_SESSION_ID if shared else session_id, communicator))
+    return clients
+
+
+async def measure(clients, messages):
+    """
+    Send feedback to the first client's session and wait until every
+    recipient has received it. Returns (ms per message, recipients).
+    """
+    channel_layer = get_channel_layer()
+    target = clients[0][0]
+    recipients = [c for session_id, c in clients if session_id == target]
+
+    handle = audio_store.put(os.urandom(16 * 1024))
+    start = time.perf_counter()
+    for _ in range(messages):
+        await channel_layer.group_send(
+            session_group_name(target),
+            {"type": "send_audio_file", "audio_handle": handle},
+        )
+        # audio_start, one binary chunk, audio_end
+        for communicator in recipients:
+            for _ in range(3):
+                await communicator.receive_output(timeout=5)
+    elapsed = time.perf_counter() - start
+    audio_store.release(handle)
+
+    for session_id, communicator in clients:
+        assert await communicator.receive_nothing(timeout=0.001)
+    return elapsed / messages * 1000, len(recipients)
+
+
+async def main(client_counts, messages):
+    print(f"{'clients':>8} {'shared ms/msg':>14} {'recipients':>11} "
+          f"{'session ms/msg':>15} {'recipients':>11}")
+    for count in client_counts:
+        row = [count]
+        for shared in (True, False):
+            clients = await connect_clients(count, shared)
+            row.extend(await measure(clients, messages))
+            for _, communicator in clients:
+                await communicator.disconnect()
+        print(f"{row[0]:>8} {row[1]:>14.2f} {row[2]:>11} {row[3]:>15.2f} {row[4]:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.messages))
@@ -0,0 +1,24 @@
+"""
+Settings for benchmarks that run Daphne as a subprocess: the project
+settings with a throwaway database and media directory, so load tests
+don't write into db.sqlite3 or media/.
+"""
+import os
+
+from server.settings import *  # noqa: F401,F403
+
+DATABASES["default"]["NAME"] = os.environ["BENCH_DB"]
+MEDIA_ROOT = os.environ["BENCH_MEDIA_ROOT"]
+AUDIO_STORE_SPOOL_DIR = os.path.join(MEDIA_ROOT, "spool")
+VAD_TRIM_UPLOADS = os.getenv("BENCH_VAD_TRIM", "1") == "1"
+# BENCH_SQLITE_TUNED=0 drops the WAL/busy_timeout/IMMEDIATE options
+if os.getenv("BENCH_SQLITE_TUNED", "1") != "1":
+    DATABASES["default"]["OPTIONS"] = {}
+# BENCH_MODEL_RATE lifts every model's per-process limit to that many
+# requests/s, for benchmarks that aren't about the upstream limits
+if os.getenv("BENCH_MODEL_RATE"):
+    MODEL_RATE_LIMITS = {
+        model: (float(os.environ["BENCH_MODEL_RATE"]), 100) for model in MODEL_RATE_LIMITS
+    }
+FEEDBACK_WORKERS = int(os.getenv("BENCH_FEEDBACK_WORKERS", FEEDBACK_WORKERS))
+AUDIO_SEND_WINDOW_BYTES = int(os.getenv("BENCH_AUDIO_SEND_WINDOW", AUDIO_SEND_WINDOW_BYTES))
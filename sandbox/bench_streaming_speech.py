@@ -0,0 +1,202 @@
+"""
+End-of-speech to transcript latency: streaming microphone audio over the
+WebSocket with server-side endpointing, versus the client recording a clip,
+stopping where the same endpointer would and POSTing it to /api/audio/. The
+utterance is audio_recording.m4a with background noise either side, sent
+as 20 ms frames in real time. Whisper is fake_openai_server.py. Run from
+the repo root:
+
+    python sandbox/bench_streaming_speech.py --runs 5 --uplink-kbps 1000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import av
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8902/v1"
+
+import django
+
+django.setup()
+
+from channels.testing import WebsocketCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIRequestFactory
+
+from core import views
+from core.speech import (
+    AUDIO_FRAME, AUDIO_FRAME_HEADER, CODEC_OPUS, CODEC_PCM, Endpointer, RATE,
+    decode_pcm,
+)
+from core.uploads import archive_executor
+from server.asgi import application
+
+FRAME_MS = 20
+FRAME_SAMPLES = RATE * FRAME_MS // 1000
+
+
+def build_utterance():
+    speech = decode_pcm(os.path.join(ROOT, "audio_recording.m4a"))
+    rng = np.random.default_rng(0)
+    noise = lambda seconds: rng.normal(0, 40, int(seconds * RATE)).astype(np.int16)
+    lead, tail = noise(0.5), noise(1.5)
+    return np.concatenate([lead, speech, tail]), len(lead) + len(speech)
+
+
+def opus_packets(pcm):
+    codec = av.CodecContext.create("libopus", "w")
+    codec.sample_rate = RATE
+    codec.layout = "mono"
+    codec.format = "s16"
+    codec.bit_rate = 24000
+    packets = []
+    for i in range(0, len(pcm) - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        frame = av.AudioFrame.from_ndarray(
+            pcm[i:i + FRAME_SAMPLES].reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.sample_rate = RATE
+        frame.pts = i
+        packets.append(b"".join(bytes(p) for p in codec.encode(frame)))
+    return packets
+
+
+def encode_m4a(pcm):
+    out = io.BytesIO()
+    with av.open(out, "w", format="ipod") as container:
+        stream = container.add_stream("aac", rate=RATE)
+        stream.layout = "mono"
+        stream.bit_rate = 64000
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = RATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+async def stream_once(pcm, speech_end, codec):
+    if codec == CODEC_OPUS:
+        payloads = opus_packets(pcm)
+    else:
+        payloads = [
+            pcm[i:i + FRAME_SAMPLES].tobytes()
+            for i in range(0, len(pcm) - FRAME_SAMPLES + 1, FRAME_SAMPLES)
+        ]
+    header = AUDIO_FRAME_HEADER.pack(AUDIO_FRAME, codec)
+
+    communicator = WebsocketCommunicator(application, "/ws/voice-assistant/")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    async def receive_transcript():
+        while True:
+            message = json.loads(await communicator.receive_from(timeout=30))
+            if message["type"] == "transcript":
+                return time.perf_counter()
+
+    receiver = asyncio.create_task(receive_transcript())
+    start = time.perf_counter()
+    end_sent = None
+    for i, payload in enumerate(payloads):
+        # Send each frame when the microphone would have captured it
+        delay = start + (i + 1) * FRAME_MS / 1000 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await communicator.send_to(bytes_data=header + payload)
+        if end_sent is None and (i + 1) * FRAME_SAMPLES >= speech_end:
+            end_sent = time.perf_counter()
+        if receiver.done():
+            break
+
+    received = await receiver
+    await communicator.disconnect()
+    return received - end_sent
+
+
+def endpoint_sample(pcm):
+    """
+    Sample at which the server-side Endpointer ends the utterance.
+    """
+    endpointer = Endpointer()
+    for i in range(0, len(pcm) - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        if endpointer.feed(pcm[i:i + FRAME_SAMPLES]):
+            return i + FRAME_SAMPLES
+    raise ValueError("No endpoint detected.")
+
+
+def upload_once(pcm, speech_end, uplink_kbps):
+    # The client stops recording where the server-side endpointer would
+    stop = endpoint_sample(pcm)
+    clip_pcm = pcm[:stop]
+    start = time.perf_counter()
+    clip = encode_m4a(clip_pcm)
+    encode = time.perf_counter() - start
+    uplink = len(clip) * 8 / (uplink_kbps * 1000)
+
+    view = views.AudioViewSet.as_view({"post": "create"})
+    request = APIRequestFactory().post(
+        "/api/audio/",
+        {"file": SimpleUploadedFile("clip.m4a", clip, "audio/mp4")},
+        format="multipart",
+    )
+    start = time.perf_counter()
+    response = view(request)
+    server = time.perf_counter() - start
+    assert response.status_code == 200
+    archive_executor.submit(lambda: None).result()
+    return (stop - speech_end) / RATE + encode + uplink + server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--uplink-kbps", type=float, default=1000)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8902", "--latency-ms", str(args.latency_ms),
+         "--upload-kbps", str(args.uplink_kbps)], stdout=subprocess.DEVNULL)
+    time.sleep(1)
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    pcm, speech_end = build_utterance()
+    try:
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            results = {
+                "upload": [upload_once(pcm, speech_end, args.uplink_kbps)
+                           for _ in range(args.runs)],
+                "stream pcm": [asyncio.run(stream_once(pcm, speech_end, CODEC_PCM))
+                               for _ in range(args.runs)],
+                "stream opus": [asyncio.run(stream_once(pcm, speech_end, CODEC_OPUS))
+                                for _ in range(args.runs)],
+            }
+    finally:
+        fake.terminate()
+
+    print(f"{'path':>12} {'p50 ms':>8} {'max ms':>8}")
+    for name, latencies in results.items():
+        print(f"{name:>12} {statistics.median(latencies) * 1000:>8.0f} "
+              f"{max(latencies) * 1000:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Storage for finished trips as LocationHistory rows versus one Trip per
+session (core.trajectories), and how fast archived trips decode. Walks are
+simulated at one fix a second with GPS jitter, loaded into a throwaway
+database, measured after VACUUM, archived, and measured again. Run from
+the repo root:
+
+    python sandbox/bench_trip_archive.py --sessions 200 --fixes 1800
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORK_DIR = tempfile.mkdtemp()
+os.environ["DJANGO_SETTINGS_MODULE"] = "sandbox.bench_settings"
+os.environ["BENCH_DB"] = os.path.join(WORK_DIR, "bench.sqlite3")
+os.environ["BENCH_MEDIA_ROOT"] = WORK_DIR
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+
+from core.models import LocationHistory, Trip
+from core.trajectories import archive_completed_trips, decode_path, trip_fixes
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def walk(session_id, fixes, rng):
+    lat, lng = 47.44 + rng.random() / 100, -122.30 + rng.random() / 100
+    heading = rng.random() * 6.28
+    when = START + timedelta(hours=rng.random() * 24)
+    for _ in range(fixes):
+        heading += rng.gauss(0, 0.2)
+        # ~1.3 m/s, with ~3 m of GPS noise on each fix
+        lat += 1.2e-5 * rng.gauss(1, 0.3) * math.cos(heading)
+        lng += 1.7e-5 * rng.gauss(1, 0.3) * math.sin(heading)
+        when += timedelta(milliseconds=1000 + rng.randint(-50, 50))
+        yield LocationHistory(
+            session_id=session_id,
+            latitude=lat + rng.gauss(0, 2.7e-5),
+            longitude=lng + rng.gauss(0, 4e-5),
+            timestamp=when,
+        )
+
+
+def database_bytes():
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cursor.execute("PRAGMA page_count")
+        pages = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return pages * cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--fixes", type=int, default=1800, help="fixes per session")
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    empty = database_bytes()
+    rng = random.Random(0)
+    for i in range(args.sessions):
+        LocationHistory.objects.bulk_create(walk(f"{i:032x}", args.fixes, rng), batch_size=5000)
+    total = args.sessions * args.fixes
+    rows = database_bytes() - empty
+
+    start = time.perf_counter()
+    trips = archive_completed_trips(60 * 60, now=START + timedelta(days=30))
+    archive_s = time.perf_counter() - start
+    assert len(trips) == args.sessions and not LocationHistory.objects.exists()
+    archived = database_bytes() - empty
+    blobs = sum(len(trip.path) for trip in Trip.objects.all())
+
+    print(f"{total} fixes in {args.sessions} sessions")
+    print(f"rows + index:  {rows / total:7.1f} bytes/fix  ({rows / 1e6:.1f} MB)")
+    print(f"trips:         {archived / total:7.1f} bytes/fix  ({archived / 1e6:.2f} MB), "
+          f"path blobs {blobs / total:.1f} bytes/fix")
+    print(f"reduction:     {rows / archived:7.1f}x")
+    print(f"archive:       {total / archive_s:7.0f} fixes/s")
+
+    paths = [trip.path for trip in Trip.objects.all()]
+    start = time.perf_counter()
+    decoded = sum(1 for path in paths for _ in decode_path(path))
+    print(f"decode_path:   {decoded / (time.perf_counter() - start):7.0f} fixes/s")
+    start = time.perf_counter()
+    decoded = sum(1 for trip in Trip.objects.iterator(chunk_size=50) for _ in trip_fixes(trip))
+    print(f"trip_fixes:    {decoded / (time.perf_counter() - start):7.0f} fixes/s "
+          "(from the database, as datetimes)")
+    connection.close()
+    shutil.rmtree(WORK_DIR)
+
+
+if __name__ == "__main__":
+    main()
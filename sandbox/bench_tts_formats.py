@@ -0,0 +1,82 @@
+"""
+Bytes per spoken response for each negotiated audio format, and how long
+they take to reach the client on a congested link. mp3 and aac sizes are
+the fake TTS's model of typical bitrates. Opus is noise really encoded
+at 32 kbps by the fake, passed on as is or re-encoded by core.tts at a
+client's lower bitrate; noise is an upper bound for speech. Run from the
+repo root:
+
+    python sandbox/bench_tts_formats.py
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8914/v1"
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core import tts
+from core.model_calls import ModelScheduler
+from core.tts import AudioFormat
+
+FORMATS = [
+    AudioFormat("mp3", None),
+    AudioFormat("aac", None),
+    AudioFormat("opus", None),
+    AudioFormat("opus", 24),
+    AudioFormat("opus", 16),
+    AudioFormat("opus", 12),
+]
+RESPONSES = {
+    "short": "अब दायाँ मोडेर सिधा हिँड्नुहोस्।",
+    "typical": (
+        "तपाईं बाटोबाट बाहिर हुनुहुन्छ, कृपया पछाडि फर्कनुहोस्। "
+        "अब दायाँ मोडेर सिधा हिँड्नुहोस्। तपाईंको उडान समयमै छ।"
+    ),
+    "long": (
+        "तपाईं बाटोबाट बाहिर हुनुहुन्छ, कृपया पछाडि फर्कनुहोस्। "
+        "अब दायाँ मोडेर सिधा हिँड्नुहोस्। "
+        "तपाईंको उडान समयमै छ र पैंतालीस मिनेटमा प्रस्थान गर्छ। "
+        "गेट बी बाह्र सुरक्षा जाँचपछि बायाँपट्टि छ। बाटोमा कुनै पसलमा नरोकिनुहोस्।"
+    ),
+}
+LINKS_KBPS = (250, 1000)
+
+
+def main():
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8914"], stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    tts.model_scheduler = ModelScheduler({}, 5, settings.MODEL_CALL_DEADLINES)
+
+    links = " ".join(f"{f'@{kbps} kbps ms':>14}" for kbps in LINKS_KBPS)
+    print(f"{'response':>8} {'format':>8} {'bytes':>7} {'synth ms':>10} {links}")
+    try:
+        for name, text in RESPONSES.items():
+            for audio_format in FORMATS:
+                caches["audio"].clear()
+                start = time.perf_counter()
+                audio = tts.synthesize(text, audio_format=audio_format)
+                elapsed = (time.perf_counter() - start) * 1000
+                label = audio_format.codec + (f"/{audio_format.kbps}" if audio_format.kbps else "")
+                transfer = " ".join(
+                    f"{len(audio) * 8 / kbps:>14.0f}" for kbps in LINKS_KBPS
+                )
+                print(f"{name:>8} {label:>8} {len(audio):>7} {elapsed:>10.0f} {transfer}")
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
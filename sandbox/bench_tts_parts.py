@@ -0,0 +1,93 @@
+"""
+Spoken responses of 1-6 Nepali sentences: a single TTS request for the
+whole text versus core.tts (speech_parts + synthesize_in_order). Reports
+the time until the first audio can play and until all of it is in hand.
+The fake TTS takes a fixed latency plus a time per character. Run from the
+repo root:
+
+    python sandbox/bench_tts_parts.py --latency-ms 300 --ms-per-char 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8912/v1"
+
+import django
+
+django.setup()
+
+from django.conf import settings
+
+from core import tts
+from core.model_calls import ModelScheduler
+
+SENTENCES = [
+    "तपाईं बाटोबाट बाहिर हुनुहुन्छ, कृपया पछाडि फर्कनुहोस्।",
+    "अब दायाँ मोडेर सिधा हिँड्नुहोस्।",
+    "तपाईंको उडान समयमै छ र पैंतालीस मिनेटमा प्रस्थान गर्छ।",
+    "गेट बी बाह्र सुरक्षा जाँचपछि बायाँपट्टि छ।",
+    "बाटोमा कुनै पसलमा नरोकिनुहोस्।",
+    "केही सोध्नु परेमा मलाई भन्नुहोस्।",
+]
+
+
+def single_shot(text):
+    start = time.perf_counter()
+    tts.synthesize(text)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+def in_parts(text):
+    start = time.perf_counter()
+    first = None
+    for _ in tts.synthesize_in_order(tts.speech_parts(text)):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--ms-per-char", type=float, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8912", "--latency-ms", str(args.latency_ms),
+         "--tts-ms-per-char", str(args.ms_per_char)],
+        stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    # Measure synthesis, not the tts-1 rate limit
+    tts.model_scheduler = ModelScheduler({}, 5, settings.MODEL_CALL_DEADLINES)
+
+    print(f"{'sentences':>9} {'chars':>6} {'parts':>6} {'single first/all ms':>20} "
+          f"{'parts first ms':>15} {'parts all ms':>13}")
+    try:
+        for count in (1, 2, 3, 4, 6):
+            text = " ".join(SENTENCES[:count])
+            rows = {}
+            for name, fn in (("single", single_shot), ("parts", in_parts)):
+                runs = [fn(text) for _ in range(args.repeats)]
+                rows[name] = (
+                    statistics.median(first for first, _ in runs) * 1000,
+                    statistics.median(total for _, total in runs) * 1000,
+                )
+            print(f"{count:>9} {len(text):>6} {len(tts.speech_parts(text)):>6} "
+                  f"{rows['single'][0]:>20.0f} {rows['parts'][0]:>15.0f} "
+                  f"{rows['parts'][1]:>13.0f}")
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Bytes and latency saved by trimming silence before Whisper. Builds a corpus
+from audio_recording.m4a padded with 0-5 s of background noise on both
+sides, plus 0.1-0.4 s snippets of it between 2 s of noise for one-word
+answers (AAC in m4a, like the app records), then sends each clip as
+uploaded and trimmed to fake_openai_server.py behind a throttled uplink.
+
+The sample itself is recorded over loud background noise that the VAD
+takes for speech throughout, so it is only re-encoded, not trimmed. Run
+from the repo root:
+
+    python sandbox/bench_vad_trim.py --upload-kbps 1000
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import time
+
+import av
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from openai import OpenAI
+
+from core.speech import RATE, decode_pcm, trim_silence
+
+
+def encode_m4a(pcm):
+    out = io.BytesIO()
+    with av.open(out, "w", format="ipod") as container:
+        stream = container.add_stream("aac", rate=RATE)
+        stream.layout = "mono"
+        stream.bit_rate = 64000
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = RATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def build_corpus():
+    speech = decode_pcm(os.path.join(ROOT, "audio_recording.m4a"))
+    rng = np.random.default_rng(0)
+    corpus = [("audio_recording.m4a", open(os.path.join(ROOT, "audio_recording.m4a"), "rb").read())]
+    for pad_s in (1, 3, 5):
+        noise = lambda: rng.normal(0, 40, pad_s * RATE).astype(np.int16)
+        pcm = np.concatenate([noise(), speech, noise()])
+        corpus.append((f"padded_{pad_s}s.m4a", encode_m4a(pcm)))
+    for word_s in (0.1, 0.25, 0.4):
+        word = speech[RATE:RATE + int(word_s * RATE)]
+        noise = lambda: rng.normal(0, 40, 2 * RATE).astype(np.int16)
+        pcm = np.concatenate([noise(), word, noise()])
+        corpus.append((f"word_{word_s}s.m4a", encode_m4a(pcm)))
+    return corpus
+
+
+def transcribe(client, name, data, content_type):
+    start = time.perf_counter()
+    client.audio.translations.create(model="whisper-1", file=(name, data, content_type))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--upload-kbps", type=float, default=1000)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "sandbox", "fake_openai_server.py"),
+         "--port", "8903", "--upload-kbps", str(args.upload_kbps)],
+        stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    client = OpenAI(base_url="http://127.0.0.1:8903/v1", api_key="fake")
+
+    print(f"{'clip':>20} {'audio s':>8} {'bytes':>7} {'trimmed s':>10} {'bytes':>7} "
+          f"{'trim ms':>8} {'orig ms':>8} {'new ms':>7} {'delta ms':>9}")
+    try:
+        total_before = total_after = 0
+        for name, data in build_corpus():
+            duration = len(decode_pcm(io.BytesIO(data))) / RATE
+            start = time.perf_counter()
+            trimmed = trim_silence(io.BytesIO(data))
+            trim_s = time.perf_counter() - start
+            # No speech found: the upload is sent as it is, like transcription_file
+            upload = (name, data, "audio/mp4") if trimmed is None else ("clip.ogg", trimmed, "audio/ogg")
+            trimmed = upload[1]
+            trimmed_duration = len(decode_pcm(io.BytesIO(trimmed))) / RATE
+
+            original_s = transcribe(client, name, data, "audio/mp4")
+            trimmed_s = trim_s + transcribe(client, *upload)
+            total_before += len(data)
+            total_after += len(trimmed)
+            print(f"{name:>20} {duration:>8.2f} {len(data):>7} {trimmed_duration:>10.2f} "
+                  f"{len(trimmed):>7} {trim_s * 1000:>8.1f} {original_s * 1000:>8.0f} "
+                  f"{trimmed_s * 1000:>7.0f} {(trimmed_s - original_s) * 1000:>+9.0f}")
+        print(f"total bytes {total_before} -> {total_after} "
+              f"({1 - total_after / total_before:.0%} saved)")
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
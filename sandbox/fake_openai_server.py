@@ -0,0 +1,205 @@
+"""
+Local stand-in for the OpenAI endpoints the backend calls (Whisper
+translations, chat completions, TTS), for benchmarking without network
+access or API cost. Point the client at it with OPENAI_BASE_URL:
+
+    python sandbox/fake_openai_server.py --port 8900 --latency-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 daphne server.asgi:application
+"""
+import argparse
+import io
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Speech runs at ~15 characters per second. Compressed formats are sized
+# at typical TTS bitrates (kbps); pcm is real 24 kHz 16-bit noise and opus
+# is that noise really encoded, so both can be decoded.
+SPEECH_CHARS_PER_SECOND = 15
+SPEECH_FORMATS = {
+    "mp3": (128, "audio/mpeg"),
+    "aac": (64, "audio/aac"),
+    "opus": (32, "audio/ogg"),
+    "pcm": (384, "audio/pcm"),
+}
+
+
+def ogg_opus(seconds, kbps):
+    """
+    `seconds` of 24 kHz noise as Ogg Opus at `kbps`.
+    """
+    import av
+    import numpy as np
+
+    pcm = np.random.default_rng().normal(0, 3000, int(seconds * 24000)).astype(np.int16)
+    out = io.BytesIO()
+    with av.open(out, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=24000)
+        stream.bit_rate = kbps * 1000
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = 24000
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0
+    # Throttles request bodies to simulate a slow uplink; 0 means unlimited
+    upload_kbps = 0
+    # Answers at most this many requests per second, then returns 429s
+    rate_limiter = None
+    # Fault injection: share of requests answered with a 500, and share
+    # answered after slow_ms instead of latency_ms
+    error_rate = 0
+    slow_rate = 0
+    slow_ms = 0
+    # Extra TTS time per input character, as synthesis time grows with text
+    tts_ms_per_char = 0
+
+    def do_POST(self):
+        body = self.read_body(int(self.headers.get("Content-Length", 0)))
+        if self.rate_limiter and not self.rate_limiter.allow():
+            self.send_json({"error": {"message": "Rate limit reached", "type": "requests"}}, 429)
+            return
+        if random.random() < self.error_rate:
+            time.sleep(self.latency_ms / 1000)
+            self.send_json({"error": {"message": "Injected fault", "type": "server_error"}}, 500)
+            return
+        slow = random.random() < self.slow_rate
+        time.sleep((self.slow_ms if slow else self.latency_ms) / 1000)
+
+        if self.path.endswith("/audio/translations") or self.path.endswith(
+            "/audio/transcriptions"
+        ):
+            # Shaped like the real API: only verbose_json carries more than text
+            text = "Where is my gate?"
+            if b'name="response_format"\r\n\r\nverbose_json' in body:
+                self.send_json({
+                    "task": "translate", "language": "english", "duration": 3.09,
+                    "text": text, "segments": [],
+                })
+            else:
+                self.send_json({"text": text})
+        elif self.path.endswith("/chat/completions"):
+            request = json.loads(body)
+            reply = "दायाँ मोड्नुहोस्।"
+            prompt_tokens = sum(
+                len(message.get("content", "")) // 4 + 3 for message in request.get("messages", [])
+            )
+            completion_tokens = len(reply) // 2
+            self.send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                # Roughly what the real tokenizer would count
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+        elif self.path.endswith("/audio/speech"):
+            request = json.loads(body)
+            text = request.get("input", "")
+            time.sleep(len(text) * self.tts_ms_per_char / 1000)
+            kbps, content_type = SPEECH_FORMATS[request.get("response_format", "mp3")]
+            seconds = len(text) / SPEECH_CHARS_PER_SECOND
+            if request.get("response_format") == "opus":
+                self.send_bytes(ogg_opus(seconds, kbps), content_type)
+                return
+            size = int(seconds * kbps * 1000 / 8)
+            self.send_bytes(os.urandom(size // 2 * 2), content_type)
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def read_body(self, length):
+        if not self.upload_kbps:
+            return self.rfile.read(length)
+        body = bytearray()
+        chunk_size = 4096
+        while len(body) < length:
+            chunk = self.rfile.read(min(chunk_size, length - len(body)))
+            body += chunk
+            time.sleep(len(chunk) * 8 / (self.upload_kbps * 1000))
+        return bytes(body)
+
+    def send_json(self, payload, status=200):
+        self.send_bytes(json.dumps(payload).encode(), "application/json", status)
+
+    def send_bytes(self, data, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RateLimiter:
+    """
+    Fixed one-second windows, like the upstream per-minute counters.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.window = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            window = int(time.monotonic())
+            if window != self.window:
+                self.window, self.count = window, 0
+            self.count += 1
+            return self.count <= self.rate
+
+
+def make_server(port, latency_ms=0, upload_kbps=0, rate_limit=0, error_rate=0,
+                slow_rate=0, slow_ms=0, tts_ms_per_char=0):
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency_ms": latency_ms,
+        "upload_kbps": upload_kbps,
+        "rate_limiter": RateLimiter(rate_limit) if rate_limit else None,
+        "error_rate": error_rate,
+        "slow_rate": slow_rate,
+        "slow_ms": slow_ms,
+        "tts_ms_per_char": tts_ms_per_char,
+    })
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--upload-kbps", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--slow-rate", type=float, default=0)
+    parser.add_argument("--slow-ms", type=float, default=0)
+    parser.add_argument("--tts-ms-per-char", type=float, default=0)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.port, args.latency_ms, args.upload_kbps, args.rate_limit,
+        args.error_rate, args.slow_rate, args.slow_ms, args.tts_ms_per_char,
+    )
+    print(f"Fake OpenAI listening on 127.0.0.1:{args.port}")
+    server.serve_forever()
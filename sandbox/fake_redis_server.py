@@ -0,0 +1,21 @@
+"""
+Local Redis-compatible stand-in for trying the multi-node mode without a
+Redis install (pip install "fakeredis[lua]"). Run from the repo root:
+
+    python sandbox/fake_redis_server.py --port 6379
+    REDIS_URL=redis://127.0.0.1:6379/0 daphne -p 8001 server.asgi:application
+"""
+import argparse
+
+from fakeredis import TcpFakeServer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    server = TcpFakeServer((args.host, args.port), server_type="redis")
+    print(f"Fake Redis listening on {args.host}:{args.port}")
+    server.serve_forever()
@@ -2,14 +2,18 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from core.routing import websocket_urlpatterns
 from django.urls import path
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
 
+# Set up Django before importing the consumers, which import models
+django_asgi_app = get_asgi_application()
+
+from core.routing import websocket_urlpatterns
+
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
+        "http": django_asgi_app,
         "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
     }
 )
@@ -89,6 +89,21 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # WAL lets readers run alongside the writer, and with synchronous=NORMAL
+        # a commit doesn't fsync (a power cut can lose the last commits, never
+        # corrupt the file). Writers queue on the lock for up to busy_timeout
+        # ms instead of failing with "database is locked"; IMMEDIATE takes the
+        # lock when a transaction starts, so it can't fail halfway through.
+        "OPTIONS": {
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA busy_timeout=5000;"
+                "PRAGMA temp_store=MEMORY;"
+                "PRAGMA cache_size=-20000"
+            ),
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -140,12 +155,231 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 ASGI_APPLICATION = "server.asgi.application"
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-        # "BACKEND": "channels_redis.core.RedisChannelLayer",
-        # "CONFIG": {
-        #     "hosts": [("127.0.0.1", 6379)],  # Redis server address
-        # },
-    },
+# Clients without a session token (from POST /api/sessions/) share one
+# session: its route, its questions and its audio. Once every client sends
+# a token, SESSION_TOKEN_REQUIRED=1 rejects requests and WebSocket
+# connections without one.
+SESSION_TOKEN_REQUIRED = os.getenv("SESSION_TOKEN_REQUIRED", "0") == "1"
+
+# Multi-node deployment
+# Setting REDIS_URL (e.g. redis://127.0.0.1:6379/0) moves the channel layer
+# and the cache into Redis so several Daphne workers can serve the same
+# sessions. Without it everything stays in-process, for a single worker.
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                # Receives block for up to 5 s, as long as redis-py's default
+                # socket timeout, so a slow reply times the connection out
+                "hosts": [{"address": REDIS_URL, "socket_timeout": 10}],
+                # Sharded feedback workers' trigger queues
+                "channel_capacity": {"feedback-worker-*": 10000},
+            },
+        },
+    }
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+        "audio": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        },
+    }
+    # Per-session state (routes, the active-session counter) is in
+    # "default" and must not be culled, so its limit is far above what one
+    # worker holds. Synthesized audio and transcriptions are larger and
+    # only save a model call, so they are culled from their own cache.
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        },
+        "audio": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "audio",
+            "OPTIONS": {"MAX_ENTRIES": 1000},
+        },
+    }
+
+# ASYNC_VIEWS=1 serves the OpenAI-bound endpoints (audio, location-history)
+# with async views instead of the DRF viewsets. At most OPENAI_CONCURRENCY
+# of their OpenAI requests are in flight per worker; the rest wait for a
+# slot. See sandbox/bench_async_views.py before turning it on.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "0") == "1"
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "64"))
+
+# Upstream model calls are admitted by core.model_calls.model_scheduler:
+# a token bucket per model, (requests per second, burst), with a priority
+# queue in front. Limits are per worker process, so divide the account's
+# limits by the number of workers.
+MODEL_RATE_LIMITS = {
+    "whisper-1": (50 / 60, 10),
+    "gpt-4o-mini": (500 / 60, 50),
+    "tts-1": (50 / 60, 10),
+}
+# Background calls, whose result nobody is waiting on, are shed after this
+# many seconds in the queue
+MODEL_CALL_BACKGROUND_MAX_WAIT = 5
+# Travellers departing this soon are served before everyone but those
+# off the path
+URGENT_DEPARTURE_MINUTES = 30
+# Seconds a model call may take, queue wait included, before the caller
+# falls back. The OpenAI clients time requests out at the same deadline, so
+# an abandoned request doesn't run on for the client's ten minute default. After MODEL_BREAKER_FAILURES failures in a row a model's
+# circuit opens and calls fall back at once for MODEL_BREAKER_RESET_SECONDS.
+MODEL_CALL_DEADLINES = {
+    "whisper-1": 20,
+    "gpt-4o-mini": 4,
+    "tts-1": 10,
 }
+MODEL_BREAKER_FAILURES = 5
+MODEL_BREAKER_RESET_SECONDS = 30
+
+# Token budgets for the off-path navigation prompt (core.prompts). The
+# traveller's question is cut to NAVIGATION_QUESTION_TOKENS, and further if
+# the whole prompt would exceed NAVIGATION_INPUT_TOKENS.
+NAVIGATION_INPUT_TOKENS = 300
+NAVIGATION_QUESTION_TOKENS = 120
+NAVIGATION_MAX_OUTPUT_TOKENS = 100
+
+# Spoken responses are split into up to TTS_MAX_PARTS parts, synthesized
+# concurrently and sent in order, so the first sentence plays while the
+# rest is synthesized. Each part is a tts-1 request against its rate limit.
+# At most TTS_CONCURRENCY TTS requests run at once per worker.
+TTS_MAX_PARTS = 3
+TTS_CONCURRENCY = 8
+# WebSocket clients that accept Opus get it as the TTS encodes it. One that
+# asks for a bitrate with ?kbps= gets it re-encoded at that bitrate, capped
+# at TTS_OPUS_KBPS. Synthesized audio is cached per format and text, in
+# the "audio" cache.
+TTS_OPUS_KBPS = 24
+TTS_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Navigation reads each session's last FIX_RING_SIZE fixes from memory;
+# rings are kept for the FIX_RING_SESSIONS most recently updated sessions
+# per worker. With several workers, route each session's REST location
+# uploads to one worker (e.g. by X-Session-Token), or its speed and fix
+# interval are worked out from only some of its fixes.
+FIX_RING_SIZE = 32
+FIX_RING_SESSIONS = 10000
+# Clients are told when to send their next fix (next_fix_seconds): every
+# FIX_INTERVAL_MIN_SECONDS off the path, often enough near a turn to get
+# two fixes in before it, and at most FIX_MAX_TRAVEL_METERS apart on
+# straights, up to FIX_INTERVAL_MAX_SECONDS. Speed is averaged over
+# FIX_SPEED_WINDOW_SECONDS; below FIX_STATIONARY_SPEED m/s the traveller is
+# standing still, unless a turn is within FIX_MAX_TRAVEL_METERS. GPS jitter
+# makes walkers look slow, so turns are timed for at least FIX_WALKING_SPEED.
+# Sessions without a route get FIX_INTERVAL_DEFAULT_SECONDS.
+FIX_INTERVAL_MIN_SECONDS = 1
+FIX_INTERVAL_MAX_SECONDS = 15
+FIX_INTERVAL_DEFAULT_SECONDS = 5
+FIX_MAX_TRAVEL_METERS = 20
+FIX_SPEED_WINDOW_SECONDS = 5
+FIX_STATIONARY_SPEED = 0.3
+FIX_WALKING_SPEED = 1.0
+# Feedback beats start when a session asks a question, leaves the path or
+# comes within FEEDBACK_MANEUVER_METERS of a turn, on up to FEEDBACK_WORKERS
+# threads per worker process. run_scheduler beats sessions that have had
+# none for FEEDBACK_HEARTBEAT_SECONDS.
+FEEDBACK_MANEUVER_METERS = 15
+FEEDBACK_WORKERS = 4
+FEEDBACK_HEARTBEAT_SECONDS = 120
+# FEEDBACK_SHARDED=1 runs beats in `run_scheduler --workers N` processes
+# instead of the web workers; set it (and REDIS_URL) for every process.
+# Sessions are spread over the workers by consistent hashing, with
+# FEEDBACK_RING_REPLICAS points per worker, and routers re-read the live
+# workers every FEEDBACK_MEMBERSHIP_SECONDS. A worker that stops
+# refreshing its slot for FEEDBACK_WORKER_TTL_SECONDS is out. A beat holds
+# a per-session lease of FEEDBACK_LEASE_SECONDS, renewed while it runs, so
+# a session moving between workers never has two beats at once. Stopping
+# workers finish their queue for up to FEEDBACK_DRAIN_SECONDS; crashed ones
+# are restarted with backoff up to FEEDBACK_RESTART_MAX_SECONDS.
+# run_scheduler prints each worker's queue metrics every
+# FEEDBACK_METRICS_SECONDS.
+FEEDBACK_SHARDED = os.getenv("FEEDBACK_SHARDED", "0") == "1"
+FEEDBACK_MAX_WORKERS = 64
+FEEDBACK_RING_REPLICAS = 100
+FEEDBACK_MEMBERSHIP_SECONDS = 2
+FEEDBACK_WORKER_TTL_SECONDS = 10
+FEEDBACK_LEASE_SECONDS = 60
+FEEDBACK_DRAIN_SECONDS = 30
+FEEDBACK_RESTART_MAX_SECONDS = 30
+FEEDBACK_METRICS_SECONDS = 30
+# Bulk location uploads (POST /api/location-history/bulk/) hold at most
+# LOCATION_BULK_MAX_FIXES fixes, inserted LOCATION_BULK_CHUNK_SIZE rows per
+# statement
+LOCATION_BULK_MAX_FIXES = 5000
+LOCATION_BULK_CHUNK_SIZE = 500
+# WebSocket fixes are buffered and inserted in one transaction once
+# LOCATION_FLUSH_ROWS are waiting or the oldest has waited
+# LOCATION_FLUSH_SECONDS, and when the worker exits. While the database is
+# unavailable at most LOCATION_BUFFER_MAX_ROWS are kept. REST fixes
+# (POST /api/location-history/) are inserted before the response, so it
+# carries the new row's id. LOCATION_WRITE_BEHIND=1 buffers them too: the
+# response's id is then null, and a fix answered with a 201 can be lost if
+# the process is killed outright.
+LOCATION_WRITE_BEHIND = os.getenv("LOCATION_WRITE_BEHIND", "0") == "1"
+LOCATION_FLUSH_ROWS = 500
+LOCATION_FLUSH_SECONDS = 1.0
+LOCATION_BUFFER_MAX_ROWS = 100_000
+# Location history lists are cursor-paginated, LOCATION_PAGE_SIZE fixes per
+# page (clients may ask for up to LOCATION_MAX_PAGE_SIZE with ?page_size=).
+# Exports stream rows LOCATION_EXPORT_CHUNK_SIZE at a time.
+LOCATION_PAGE_SIZE = 100
+LOCATION_MAX_PAGE_SIZE = 1000
+LOCATION_EXPORT_CHUNK_SIZE = 2000
+# A session with no fixes for TRIP_IDLE_SECONDS is a finished trip: the
+# scheduler compresses its fixes into one Trip row every
+# TRIP_ARCHIVE_INTERVAL_SECONDS and deletes them from LocationHistory,
+# reading TRIP_ARCHIVE_CHUNK_SIZE rows at a time
+TRIP_IDLE_SECONDS = 2 * 60 * 60
+TRIP_ARCHIVE_INTERVAL_SECONDS = 10 * 60
+TRIP_ARCHIVE_CHUNK_SIZE = 2000
+
+# Voice uploads are decoded, trimmed of leading/trailing silence with WebRTC
+# VAD and re-encoded as Opus before being sent to Whisper
+VAD_TRIM_UPLOADS = True
+# Translations are cached (in the "audio" cache) by the sha256 of the
+# uploaded bytes, so a retried upload is answered without calling Whisper
+# again
+TRANSCRIPTION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Audio is streamed to WebSocket clients in fixed-size binary chunks, with at
+# most AUDIO_SEND_QUEUE_SIZE responses pending per connection. A response
+# still queued after AUDIO_SEND_MAX_WAIT_SECONDS is stale and dropped.
+AUDIO_CHUNK_SIZE = 32 * 1024
+AUDIO_SEND_QUEUE_SIZE = 4
+AUDIO_SEND_MAX_WAIT_SECONDS = 60
+
+# Synthesized audio responses
+# Clips up to this size stay in memory, larger ones are spooled to disk
+AUDIO_STORE_MAX_MEMORY_BYTES = 512 * 1024
+AUDIO_STORE_SPOOL_DIR = MEDIA_ROOT / "spool"
+# A released clip is kept this long. Consumers on other workers hold no
+# reference, so this is what keeps a clip readable for them; it is longer
+# than any response waits in a send queue.
+AUDIO_STORE_LINGER_SECONDS = AUDIO_SEND_MAX_WAIT_SECONDS + 30
+# With a shared cache, in-memory clips are also published to it so a
+# consumer on another worker can read them. The spool directory must then
+# be on storage every worker can reach.
+AUDIO_STORE_SHARED = bool(REDIS_URL)
+
+# A client connecting with acks=1 acks the audio bytes it receives.
+# Sending pauses while AUDIO_SEND_WINDOW_BYTES are unacked, so a slow
+# client's responses wait in the queue (and the stalest are dropped)
+# instead of in the server's write buffer. A client that acks nothing for
+# AUDIO_SEND_ACK_TIMEOUT_SECONDS is disconnected. Clients that don't ack
+# are not paced.
+AUDIO_SEND_WINDOW_BYTES = 256 * 1024
+AUDIO_SEND_ACK_TIMEOUT_SECONDS = 20